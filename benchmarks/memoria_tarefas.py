@@ -0,0 +1,57 @@
+"""
+Compara a memória de N tarefas lidas de tarefas.txt como dict (formato
+antigo) e como tarefas.Tarefa (__slots__ + strings internadas).
+
+Uso (da raiz do projeto): python -m benchmarks.memoria_tarefas [quantidade]   (padrão 100000)
+"""
+
+import sys
+import tracemalloc
+from uuid import uuid4
+
+import tarefas
+
+SETORES = ['recepção', 'médico', 'farmácia', 'enfermagem']
+
+def _linhas(quantidade: int) -> list:
+    """Linhas no formato de tarefas.txt, parecidas com as geradas pelo workflow."""
+    linhas = []
+    for i in range(quantidade):
+        setor = SETORES[i % 4]
+        tarefa = {
+            'id': str(uuid4()), 'paciente_nome': f'Paciente {i}', 'titulo': f'{setor.title()} - Paciente {i}',
+            'descricao': 'Atendimento do fluxo automático', 'tipo_tarefa': 'Workflow', 'setor': setor,
+            'responsavel': 'sistema', 'prazo': '15/03/2026', 'prioridade': 'Normal',
+            'status': tarefas.STATUS_CONCLUIDA if i % 3 else tarefas.STATUS_PENDENTE,
+            'data_criacao': '15/03/2026', 'atendimento_token': str(uuid4()),
+        }
+        linhas.append('|'.join(tarefas._escape(tarefa.get(col)) for col in tarefas.COLUNAS_TAREFAS))
+    return linhas
+
+def _como_dict(linha: str) -> dict:
+    """Leitura antiga: um dict com as 24 colunas, sem internar nada."""
+    partes = linha.split('|')
+    return {col: tarefas._unescape(partes[i]) if i < len(partes) else None
+            for i, col in enumerate(tarefas.COLUNAS_TAREFAS)}
+
+def medir(leitor, linhas: list) -> int:
+    """Bytes alocados (e mantidos) para guardar as tarefas lidas por `leitor`."""
+    tracemalloc.start()
+    inicio = tracemalloc.get_traced_memory()[0]
+    guardadas = [leitor(linha) for linha in linhas]
+    total = tracemalloc.get_traced_memory()[0] - inicio
+    tracemalloc.stop()
+    del guardadas
+    return total
+
+def main(quantidade: int = 100000) -> None:
+    linhas = _linhas(quantidade)
+    em_dict = medir(_como_dict, linhas)
+    em_tarefa = medir(tarefas._linha_para_tarefa, linhas)
+    print(f"{quantidade} tarefas")
+    print(f"  dict:   {em_dict / 1024 / 1024:8.1f} MiB ({em_dict // quantidade} bytes/tarefa)")
+    print(f"  Tarefa: {em_tarefa / 1024 / 1024:8.1f} MiB ({em_tarefa // quantidade} bytes/tarefa)")
+    print(f"  redução: {100 - 100 * em_tarefa / em_dict:.0f}%")
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
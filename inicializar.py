@@ -6,6 +6,7 @@ Gera arquivos de persistência (.txt) compatíveis com a versão Web.
 
 import sys
 import os
+import shutil
 from uuid import uuid4
 
 # Adiciona o diretório atual ao path para garantir importações
@@ -39,6 +40,10 @@ def limpar_arquivos():
             except:
                 # Se não der para apagar, tenta zerar o conteúdo
                 with open(arq, 'w') as f: pass
+    # Partições diárias dos atendimentos e tarefas arquivadas
+    shutil.rmtree(atendimentos.PASTA_ATENDIMENTOS, ignore_errors=True)
+    shutil.rmtree(tarefas.PASTA_ARQUIVO_TAREFAS, ignore_errors=True)
+    atendimentos.limpar_cache_atendimentos()
 
 def criar_usuarios_base():
     """Cria a equipe hospitalar."""
@@ -80,11 +85,11 @@ def avancar_tarefa(atendimento_token, setor_atual, acao_simulada, usuario_respon
     Função auxiliar para simular o clique nos botões do dashboard.
     Avança o workflow de um paciente.
     """
-    todas_tarefas = tarefas._carregar_tarefas()
+    transacao = workflow.TransicaoWorkflow()
     tarefa_atual = None
     
     # Encontra a tarefa pendente do setor atual para este atendimento
-    for t in todas_tarefas:
+    for t in transacao.tarefas:
         if (t.get('atendimento_token') == atendimento_token and 
             t.get('setor', '').lower() == setor_atual.lower() and 
             t.get('status') == tarefas.STATUS_PENDENTE):
@@ -95,25 +100,23 @@ def avancar_tarefa(atendimento_token, setor_atual, acao_simulada, usuario_respon
         return False
         
     # Conclui a tarefa atual
-    tarefa_atual['status'] = tarefas.STATUS_CONCLUIDA
-    tarefa_atual['data_conclusao'] = tarefas._data_atual()
-    tarefa_atual['concluida_por'] = usuario_responsavel['id']
+    transacao.concluir(tarefa_atual['id'], usuario_responsavel['id'])
     
     # Simula a lógica de negócio do app.py (encaminhamento)
     nome_paciente = tarefa_atual['titulo'].split(' - ')[-1]
     
     if acao_simulada == 'ir_para_farmacia':
-        workflow.adicionar_tarefa_farmacia(atendimento_token, nome_paciente)
+        workflow.adicionar_tarefa_farmacia(atendimento_token, nome_paciente, transacao=transacao)
         
     elif acao_simulada == 'ir_para_enfermagem':
-        workflow.adicionar_tarefa_enfermagem(atendimento_token, nome_paciente)
+        workflow.adicionar_tarefa_enfermagem(atendimento_token, nome_paciente, transacao=transacao)
         
     elif acao_simulada == 'alta':
         # Apenas conclui, não cria nova
         pass
         
-    tarefas._salvar_tarefas(todas_tarefas)
-    return True
+    # Uma única gravação para conclusão + próxima etapa
+    return transacao.confirmar()
 
 def criar_cenarios():
     """Cria pacientes em diferentes estágios do atendimento."""
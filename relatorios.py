@@ -2,6 +2,12 @@ import datetime
 import usuarios
 import tarefas
 import os
+from array import array
+
+try:
+    import numpy
+except ImportError:  # opcional: sem ele a tabela é filtrada em Python puro
+    numpy = None
 
 def confirmacao_concluida(tarefa: dict) -> bool:
     """Verifica se a tarefa está concluída (booleano ou string)."""
@@ -24,6 +30,13 @@ def converter_data(data_str):
     except ValueError:
         return None
 
+def no_periodo(tarefa: dict, inicio=None, fim=None) -> bool:
+    """Data de conclusão (ou de criação) da tarefa entre inicio e fim (date, inclusive)."""
+    if not inicio and not fim: return True
+    data = converter_data(tarefa.get('data_conclusao')) or converter_data(tarefa.get('data_criacao'))
+    if not data: return False
+    return (not inicio or data.date() >= inicio) and (not fim or data.date() <= fim)
+
 def buscar_nome_usuario(id_usuario):
     """Busca o nome no dicionário de usuários de forma segura."""
     if not id_usuario or id_usuario == 'None':
@@ -45,8 +58,187 @@ def pode_ver_tudo(usuario_logado):
     # Recepção e Admin veem tudo
     return setor in ['recepção', 'admin', 'administração']
 
+# --- TABELA COLUNAR PARA OS RELATÓRIOS ---
+# Os relatórios filtram e somam milhares de tarefas (anos, com o arquivo).
+# Em vez de percorrer dicts convertendo datas com strptime e comparando
+# strings a cada linha, montamos uma vez por versão dos dados uma tabela
+# em colunas: status e setor como códigos pequenos em array('b'), pessoas
+# como códigos em array('l') e datas como segundos desde 1970 em
+# array('q'). Com NumPy os filtros rodam vetorizados sobre esses buffers
+# (sem cópia); sem ele, em Python puro sobre os mesmos arrays.
+
+SEM_DATA = -2 ** 63
+CODIGO_PENDENTE, CODIGO_CONCLUIDA, CODIGO_CANCELADA = 0, 1, 2
+_SEGUNDOS_DIA = 86400
+
+def _epoch(data):
+    """datetime/date -> segundos desde 1970 (UTC, meia-noite); None -> SEM_DATA."""
+    if data is None: return SEM_DATA
+    if not isinstance(data, datetime.datetime):
+        data = datetime.datetime(data.year, data.month, data.day)
+    return int(data.replace(tzinfo=datetime.timezone.utc).timestamp())
+
+def _codigo_status(tarefa: dict) -> int:
+    if confirmacao_concluida(tarefa): return CODIGO_CONCLUIDA
+    if 'cancelada' in str(tarefa.get('status') or '').lower(): return CODIGO_CANCELADA
+    return CODIGO_PENDENTE
+
+class TabelaTarefas:
+    """Snapshot colunar de uma lista de tarefas (linha i = i-ésima tarefa)."""
+
+    def __init__(self, lista):
+        self.setores = {}   # setor em minúsculas -> código
+        self.pessoas = {}   # id de usuário ('' = nenhum) -> código
+        status, setor, responsavel, concluida_por = [], [], [], []
+        criacao, conclusao, prazo = [], [], []
+        # Colunas só exibidas: referências às strings que já existem
+        self.titulo, self.setor_texto, self.data_conclusao, self.prazo_texto = [], [], [], []
+        # Datas e status se repetem muito: cada texto distinto é convertido uma vez
+        epochs, codigos = {}, {}
+        def epoch(texto):
+            valor = epochs.get(texto)
+            if valor is None:
+                valor = epochs[texto] = _epoch(converter_data(texto))
+            return valor
+        for t in lista:
+            texto_status = t.get('status')
+            codigo = codigos.get(texto_status)
+            if codigo is None:
+                codigo = codigos[texto_status] = _codigo_status(t)
+            status.append(codigo)
+            setor.append(self.setores.setdefault(str(t.get('setor')).lower(), len(self.setores)))
+            responsavel.append(self.pessoas.setdefault(t.get('responsavel') or '', len(self.pessoas)))
+            concluida_por.append(self.pessoas.setdefault(t.get('concluida_por') or '', len(self.pessoas)))
+            criacao.append(epoch(t.get('data_criacao')))
+            conclusao.append(epoch(t.get('data_conclusao')))
+            prazo.append(epoch(t.get('prazo')))
+            self.titulo.append(t.get('titulo') or '')
+            self.setor_texto.append(t.get('setor', 'Geral'))
+            self.data_conclusao.append(t.get('data_conclusao'))
+            self.prazo_texto.append(t.get('prazo'))
+        self.tamanho = len(status)
+        self.status = array('b', status)
+        self.setor = array('b' if len(self.setores) <= 127 else 'l', setor)
+        self.responsavel = array('l', responsavel)
+        self.concluida_por = array('l', concluida_por)
+        self.criacao = array('q', criacao)
+        self.conclusao = array('q', conclusao)
+        self.prazo = array('q', prazo)
+        # Data usada nos filtros por período: conclusão, senão criação
+        self.referencia = array('q', [c if c != SEM_DATA else cr for c, cr in zip(conclusao, criacao)])
+
+    def selecionar(self, status, inicio=None, fim=None, setor=None, pessoa=None, incluir_concluida_por=False):
+        """
+        Posições das linhas com um dos `status` (códigos), com data de
+        referência entre inicio e fim (date, inclusive) e, se setor/pessoa
+        forem dados, do setor ou da pessoa (responsável e, opcionalmente,
+        quem concluiu).
+        """
+        ini = _epoch(inicio)
+        fim = _epoch(fim) + _SEGUNDOS_DIA - 1 if fim else None
+        filtrar_pessoa = setor is not None or pessoa is not None
+        codigo_setor = self.setores.get(str(setor).lower(), -1)
+        codigo_pessoa = self.pessoas.get(pessoa, -1) if pessoa else -1
+
+        if numpy is not None and self.tamanho:
+            mascara = numpy.isin(_coluna(self.status), status)
+            if inicio or fim is not None:
+                referencia = _coluna(self.referencia)
+                mascara &= referencia != SEM_DATA
+                if inicio: mascara &= referencia >= ini
+                if fim is not None: mascara &= referencia <= fim
+            if filtrar_pessoa:
+                alvo = (_coluna(self.setor) == codigo_setor) | (_coluna(self.responsavel) == codigo_pessoa)
+                if incluir_concluida_por: alvo |= _coluna(self.concluida_por) == codigo_pessoa
+                mascara &= alvo
+            return numpy.flatnonzero(mascara).tolist()
+
+        linhas = []
+        for i in range(self.tamanho):
+            if self.status[i] not in status: continue
+            referencia = self.referencia[i]
+            if (inicio or fim is not None) and referencia == SEM_DATA: continue
+            if inicio and referencia < ini: continue
+            if fim is not None and referencia > fim: continue
+            if filtrar_pessoa and not (
+                    self.setor[i] == codigo_setor or self.responsavel[i] == codigo_pessoa
+                    or (incluir_concluida_por and self.concluida_por[i] == codigo_pessoa)):
+                continue
+            linhas.append(i)
+        return linhas
+
+    def dias_de_execucao(self, linhas):
+        """(soma dos dias entre criação e conclusão, quantas linhas têm as duas datas)."""
+        if numpy is not None and linhas:
+            criacao = _coluna(self.criacao)[linhas]
+            conclusao = _coluna(self.conclusao)[linhas]
+            validas = (criacao != SEM_DATA) & (conclusao != SEM_DATA)
+            dias = (conclusao[validas] - criacao[validas]) // _SEGUNDOS_DIA
+            return int(dias.sum()), int(validas.sum())
+        total = quantidade = 0
+        for i in linhas:
+            if self.criacao[i] != SEM_DATA and self.conclusao[i] != SEM_DATA:
+                total += (self.conclusao[i] - self.criacao[i]) // _SEGUNDOS_DIA
+                quantidade += 1
+        return total, quantidade
+
+    def vencidas(self, linhas, hoje) -> set:
+        """Linhas (entre `linhas`) com prazo antes de `hoje`."""
+        limite = _epoch(hoje)
+        if numpy is not None and linhas:
+            prazo = _coluna(self.prazo)[linhas]
+            return set(numpy.asarray(linhas)[(prazo != SEM_DATA) & (prazo < limite)].tolist())
+        return {i for i in linhas if self.prazo[i] != SEM_DATA and self.prazo[i] < limite}
+
+    def contagem_por_pessoa(self, linhas, coluna='concluida_por') -> list:
+        """[(id da pessoa, quantidade)] na ordem da primeira aparição entre `linhas`."""
+        codigos = getattr(self, coluna)
+        ids = {codigo: pessoa for pessoa, codigo in self.pessoas.items()}
+        if numpy is not None and linhas:
+            valores, primeira, quantidades = numpy.unique(
+                _coluna(codigos)[linhas], return_index=True, return_counts=True)
+            ordem = numpy.argsort(primeira, kind='stable')
+            return [(ids[int(valores[i])], int(quantidades[i])) for i in ordem]
+        contagem = {}
+        for i in linhas:
+            contagem[codigos[i]] = contagem.get(codigos[i], 0) + 1
+        return [(ids[codigo], qtd) for codigo, qtd in contagem.items()]
+
+def _coluna(dados: array):
+    """Visão NumPy (sem cópia) de um array da tabela."""
+    return numpy.frombuffer(dados, dtype=dados.typecode)
+
+# Campos que a TabelaTarefas lê: o resto da tarefa nem é decodificado
+_COLUNAS_TABELA = ('status', 'setor', 'responsavel', 'concluida_por', 'data_criacao',
+                   'data_conclusao', 'prazo', 'titulo')
+
+_tabelas = {}  # (historico, inicio, fim) -> (assinatura dos arquivos, TabelaTarefas)
+
+def tabela_tarefas(historico: bool = False, inicio=None, fim=None) -> TabelaTarefas:
+    """
+    Tabela das tarefas ativas (ou ativas + arquivadas do período, se
+    historico), refeita só quando tarefas.txt, o journal ou o índice do
+    arquivo mudam no disco.
+    """
+    chave = (historico, inicio, fim)
+    assinatura = None
+    if not tarefas.repositorio.usando_sqlite():
+        assinatura = (tarefas._assinatura_tarefas(),
+                      tarefas._assinatura_arquivo(tarefas._arquivo_indice_arquivo()))
+        guardada = _tabelas.get(chave)
+        if guardada and guardada[0] == assinatura:
+            return guardada[1]
+    tabela = TabelaTarefas(tarefas.iter_tarefas(colunas=_COLUNAS_TABELA, historico=historico, inicio=inicio, fim=fim))
+    if assinatura is not None:
+        if len(_tabelas) >= 8: _tabelas.clear()
+        _tabelas[chave] = (assinatura, tabela)
+    return tabela
+
+def _nomes_usuarios() -> dict:
+    return {u['id']: u['nome'] for u in usuarios.listar_usuarios()}
+
 # RELATÓRIO 1: CONCLUÍDAS 
-def gerar_relatorio_concluidos(usuario_filtro=None):
+def gerar_relatorio_concluidos(usuario_filtro=None, inicio=None, fim=None):
     titulo = "RELATÓRIO DE CONCLUÍDAS"
     ver_tudo = pode_ver_tudo(usuario_filtro)
     
@@ -57,50 +249,32 @@ def gerar_relatorio_concluidos(usuario_filtro=None):
     
     imprimir_cabecalho(titulo)
 
-    lista_alvo = tarefas._carregar_tarefas()
-    concluidas_count = 0
-    tempo_total_dias = 0
-    qtd_com_calculo = 0
+    # Concluídas antigas já saíram de tarefas.txt: a tabela soma o arquivo do período
+    tabela = tabela_tarefas(historico=True, inicio=inicio, fim=fim)
+    filtro = {}
+    if usuario_filtro and not ver_tudo:
+        filtro = {'setor': usuario_filtro['setor'], 'pessoa': usuario_filtro['id'], 'incluir_concluida_por': True}
+    linhas = tabela.selecionar((CODIGO_CONCLUIDA,), inicio, fim, **filtro)
 
     print(f"{'TÍTULO':<25} | {'DATA CONC.':<12} | {'RESPONSÁVEL'}")
     print("-" * 60)
 
-    for tarefa in lista_alvo:
-        if not confirmacao_concluida(tarefa):
-            continue
-
-        # FILTRO
-        if usuario_filtro and not ver_tudo:
-            eh_responsavel = tarefa.get('responsavel') == usuario_filtro['id']
-            eh_concluido_por = tarefa.get('concluida_por') == usuario_filtro['id']
-            eh_setor = str(tarefa.get('setor')).lower() == str(usuario_filtro['setor']).lower()
-            
-            if not (eh_responsavel or eh_concluido_por or eh_setor):
-                continue
-
-        concluidas_count += 1
-        
+    nomes = _nomes_usuarios()
+    ids = {codigo: pessoa for pessoa, codigo in tabela.pessoas.items()}
+    for i in linhas:
         # Quem concluiu a tarefa?
-        id_resp = tarefa.get('concluida_por') or tarefa.get('responsavel')
-        nome_resp = buscar_nome_usuario(id_resp)
-        
-        data_fim_str = tarefa.get('data_conclusao') or "---"
-        print(f"{tarefa['titulo'][:25]:<25} | {data_fim_str:<12} | {nome_resp}")
-
-        # Cálculo de tempo
-        data_criacao = converter_data(tarefa.get('data_criacao'))
-        data_conclusao = converter_data(tarefa.get('data_conclusao'))
+        id_resp = ids[tabela.concluida_por[i]] or ids[tabela.responsavel[i]]
+        nome_resp = nomes.get(id_resp, "Usuário Removido") if id_resp and id_resp != 'None' else "Sistema/Automático"
+        data_fim_str = tabela.data_conclusao[i] or "---"
+        print(f"{tabela.titulo[i][:25]:<25} | {data_fim_str:<12} | {nome_resp}")
 
-        if data_criacao and data_conclusao:
-            diferenca = data_conclusao - data_criacao
-            tempo_total_dias += diferenca.days
-            qtd_com_calculo += 1
+    tempo_total_dias, qtd_com_calculo = tabela.dias_de_execucao(linhas)
 
     print("-" * 60)
-    if concluidas_count == 0:
+    if not linhas:
         print(">> Nenhuma tarefa concluída encontrada para este perfil.")
     else:
-        print(f"Total concluídas: {concluidas_count}")
+        print(f"Total concluídas: {len(linhas)}")
         if qtd_com_calculo > 0:
             media = tempo_total_dias / qtd_com_calculo
             print(f"Tempo médio de execução: {int(media)} dias")
@@ -117,78 +291,44 @@ def gerar_relatorio_pendentes(usuario_filtro=None):
     
     imprimir_cabecalho(titulo)
 
-    lista_alvo = tarefas._carregar_tarefas()
-    hoje = datetime.datetime.now()
-    
-    pendentes_count = 0
-    atrasadas_count = 0
+    # Pendências nunca vão para o arquivo: só as ativas
+    tabela = tabela_tarefas()
+    filtro = {}
+    if usuario_filtro and not ver_tudo:
+        filtro = {'setor': usuario_filtro['setor'], 'pessoa': usuario_filtro['id']}
+    linhas = tabela.selecionar((CODIGO_PENDENTE,), **filtro)
+    atrasadas = tabela.vencidas(linhas, datetime.date.today())
 
     print(f"{'TÍTULO':<25} | {'SETOR':<12} | {'PRAZO'}")
     print("-" * 60)
 
-    for tarefa in lista_alvo:
-        if confirmacao_concluida(tarefa):
-            continue
-        
-        status_atual = tarefa.get('status', '')
-        if 'cancelada' in status_atual.lower():
-            continue
-
-        # FILTRO
-        if usuario_filtro and not ver_tudo:
-            eh_responsavel = tarefa.get('responsavel') == usuario_filtro['id']
-            eh_setor = str(tarefa.get('setor')).lower() == str(usuario_filtro['setor']).lower()
-            
-            if not (eh_responsavel or eh_setor):
-                continue
-
-        pendentes_count += 1
-        
-        prazo_str = tarefa.get('prazo')
-        data_prazo = converter_data(prazo_str)
-        aviso = ""
-        
-        if data_prazo and data_prazo.date() < hoje.date():
-            aviso = " [ATRASADO!]"
-            atrasadas_count += 1
-        
-        setor_t = tarefa.get('setor', 'Geral')
-        print(f"{tarefa['titulo'][:25]:<25} | {setor_t:<12} | {prazo_str}{aviso}")
+    for i in linhas:
+        aviso = " [ATRASADO!]" if i in atrasadas else ""
+        print(f"{tabela.titulo[i][:25]:<25} | {tabela.setor_texto[i]:<12} | {tabela.prazo_texto[i]}{aviso}")
 
     print("-" * 60)
-    print(f"Total Pendentes: {pendentes_count}")
-    print(f"Total Atrasadas: {atrasadas_count}")
+    print(f"Total Pendentes: {len(linhas)}")
+    print(f"Total Atrasadas: {len(atrasadas)}")
 
 # RELATÓRIO 3: PRODUTIVIDADE DA EQUIPE 
-def gerar_relatorio_produtividade(usuario_filtro=None):
+def gerar_relatorio_produtividade(usuario_filtro=None, inicio=None, fim=None):
     imprimir_cabecalho("PRODUTIVIDADE DA EQUIPE (RANKING)")
 
     # Mapeia ID -> Nome
-    mapa_nomes = {}
-    for u in usuarios.listar_usuarios():
-        mapa_nomes[u['id']] = u['nome']
+    mapa_nomes = _nomes_usuarios()
+
+    tabela = tabela_tarefas(historico=True, inicio=inicio, fim=fim)
+    linhas = tabela.selecionar((CODIGO_CONCLUIDA,), inicio, fim)
 
     contagem = {}
-    
-    lista_alvo = tarefas._carregar_tarefas()
     total_geral = 0
-    
-    for tarefa in lista_alvo:
-        if confirmacao_concluida(tarefa):
-            # Quem concluiu de fato?
-            resp_id = tarefa.get('concluida_por')
-            
-            # Se não tem 'concluida_por', tenta 'responsavel' (mas cuidado com 'sistema')
-            if not resp_id or resp_id == 'sistema':
-                continue 
-
-            nome = mapa_nomes.get(resp_id, "Usuário Removido")
-            
-            if nome not in contagem:
-                 contagem[nome] = 0
-            
-            contagem[nome] += 1
-            total_geral += 1
+    for resp_id, qtd in tabela.contagem_por_pessoa(linhas):
+        # Sem 'concluida_por' (ou concluída pelo 'sistema') não entra no ranking
+        if not resp_id or resp_id == 'sistema':
+            continue
+        nome = mapa_nomes.get(resp_id, "Usuário Removido")
+        contagem[nome] = contagem.get(nome, 0) + qtd
+        total_geral += qtd
 
     # Ordenar
     ranking = sorted(contagem.items(), key=lambda item: item[1], reverse=True)
@@ -204,11 +344,15 @@ def gerar_relatorio_produtividade(usuario_filtro=None):
     print(f"Total de entregas manuais: {total_geral}")
 
 # RELATÓRIO 4: EXPORTAR PARA TXT (CORRIGIDO)
-def exportar_relatorio_txt(usuario_logado):
+_COLUNAS_EXPORTACAO = ('status', 'titulo', 'descricao', 'setor', 'prazo', 'responsavel',
+                       'concluida_por', 'data_criacao', 'data_conclusao')
+
+def exportar_relatorio_txt(usuario_logado, inicio=None, fim=None):
     imprimir_cabecalho("EXPORTAR RELATÓRIO")
     
     nome_arquivo = f"relatorio_{datetime.datetime.now().strftime('%Y%m%d_%H%M')}.txt"
-    lista_alvo = tarefas._carregar_tarefas()
+    # Streaming: o histórico inteiro nunca fica em memória
+    lista_alvo = tarefas.iter_tarefas(colunas=_COLUNAS_EXPORTACAO, historico=True, inicio=inicio, fim=fim)
     
     try:
         with open(nome_arquivo, 'w', encoding='utf-8') as f:
@@ -221,6 +365,8 @@ def exportar_relatorio_txt(usuario_logado):
             
             count = 0
             for t in lista_alvo:
+                if not no_periodo(t, inicio, fim):
+                    continue
                 if not ver_tudo:
                     eh_resp = t.get('responsavel') == usuario_logado['id']
                     eh_setor = str(t.get('setor')).lower() == str(usuario_logado['setor']).lower()
@@ -2,11 +2,32 @@ from uuid import uuid4
 from datetime import datetime, timedelta
 import os
 import ast
+import copy
+import json
+import sys
+import operator
+import threading
+import bisect
+import heapq
+from array import array
+from contextlib import contextmanager
 import usuarios 
+from utils import arquivos, repositorio
 
 # --- CONFIGURAÇÕES E CONSTANTES ---
 ARQUIVO_TAREFAS = "tarefas.txt"
 ARQUIVO_PACIENTES = "pacientes.txt"
+ARQUIVO_JOURNAL_TAREFAS = "tarefas.journal"
+
+# Modo journal: alterações são anexadas a ARQUIVO_JOURNAL_TAREFAS e o
+# snapshot (tarefas.txt) só é reescrito quando o journal passa do limite.
+USAR_JOURNAL = os.environ.get('TASKFLOW_TAREFAS_JOURNAL', '0') == '1'
+LIMITE_JOURNAL_BYTES = int(os.environ.get('TASKFLOW_JOURNAL_LIMITE', 1024 * 1024))
+
+# Atendimentos encerrados há mais de DIAS_TAREFAS_ATIVAS dias saem de
+# tarefas.txt para PASTA_ARQUIVO_TAREFAS (ver arquivar_tarefas_concluidas).
+PASTA_ARQUIVO_TAREFAS = os.environ.get('TASKFLOW_TAREFAS_ARQUIVO', 'tarefas_arquivo')
+DIAS_TAREFAS_ATIVAS = int(os.environ.get('TASKFLOW_TAREFAS_DIAS', '7'))
 
 STATUS_PENDENTE = "Pendente"
 STATUS_CONCLUIDA = "Concluída"
@@ -22,56 +43,1198 @@ COLUNAS_TAREFAS = [
     'atendimento_token'
 ]
 
+# Colunas com poucos valores distintos: uma única string compartilhada por
+# todas as tarefas em vez de uma cópia por linha lida do arquivo
+_COLUNAS_INTERNADAS = frozenset(['setor', 'status', 'prioridade', 'tipo_tarefa', 'responsavel',
+                                 'prazo', 'data_criacao', 'data_conclusao'])
+
+# --- REGISTRO DE TAREFA ---
+
+class Tarefa:
+    """
+    Tarefa com __slots__ (um campo por coluna) no lugar de um dict de 24
+    chaves, quase todas None: ocupa uma fração da memória no cache.
+
+    Continua funcionando como dict para o resto do sistema e os templates:
+    t['status'], t.get(), in, keys()/items(), update(), dict(t) e == com dict.
+    t.status também funciona. Chaves fora de COLUNAS_TAREFAS (ex.:
+    responsavel_nome, colocada pelo app) ficam num dict à parte.
+    """
+    __slots__ = tuple(COLUNAS_TAREFAS) + ('_extras',)
+
+    def __init__(self, dados=(), **campos):
+        for col in COLUNAS_TAREFAS:
+            setattr(self, col, None)
+        self._extras = None
+        self.update(dados, **campos)
+
+    def __getitem__(self, chave):
+        if chave in _COLUNAS:
+            return getattr(self, chave)
+        if self._extras is not None and chave in self._extras:
+            return self._extras[chave]
+        raise KeyError(chave)
+
+    def __setitem__(self, chave, valor):
+        if chave in _COLUNAS:
+            if chave in _COLUNAS_INTERNADAS and type(valor) is str:
+                valor = sys.intern(valor)
+            setattr(self, chave, valor)
+        else:
+            if self._extras is None: self._extras = {}
+            self._extras[chave] = valor
+
+    def __delitem__(self, chave):
+        if chave in _COLUNAS:
+            setattr(self, chave, None)
+        elif self._extras is not None and chave in self._extras:
+            del self._extras[chave]
+        else:
+            raise KeyError(chave)
+
+    def __contains__(self, chave):
+        return chave in _COLUNAS or (self._extras is not None and chave in self._extras)
+
+    def __iter__(self):
+        yield from COLUNAS_TAREFAS
+        if self._extras: yield from self._extras
+
+    def __len__(self):
+        return len(COLUNAS_TAREFAS) + len(self._extras or ())
+
+    def keys(self):
+        return list(self)
+
+    def values(self):
+        return [self[chave] for chave in self]
+
+    def items(self):
+        return [(chave, self[chave]) for chave in self]
+
+    def get(self, chave, padrao=None):
+        if chave in _COLUNAS: return getattr(self, chave)
+        if self._extras is not None: return self._extras.get(chave, padrao)
+        return padrao
+
+    def setdefault(self, chave, padrao=None):
+        if chave not in self: self[chave] = padrao
+        return self[chave]
+
+    def pop(self, chave, *padrao):
+        try: valor = self[chave]
+        except KeyError:
+            if padrao: return padrao[0]
+            raise
+        del self[chave]
+        return valor
+
+    def update(self, dados=(), **campos):
+        for chave, valor in (dados.items() if hasattr(dados, 'items') else dados):
+            self[chave] = valor
+        for chave, valor in campos.items():
+            self[chave] = valor
+
+    def copy(self):
+        copia = Tarefa.__new__(Tarefa)
+        for col, valor in zip(COLUNAS_TAREFAS, _valores_colunas(self)):
+            setattr(copia, col, valor)
+        copia._extras = dict(self._extras) if self._extras else None
+        return copia
+
+    def como_dict(self) -> dict:
+        dados = dict(zip(COLUNAS_TAREFAS, _valores_colunas(self)))
+        if self._extras: dados.update(self._extras)
+        return dados
+
+    def __eq__(self, outro):
+        if isinstance(outro, Tarefa):
+            return (_valores_colunas(self) == _valores_colunas(outro)
+                    and (self._extras or {}) == (outro._extras or {}))
+        if isinstance(outro, dict):
+            return self.como_dict() == outro
+        return NotImplemented
+
+    __hash__ = None  # mutável, como dict
+
+    def __repr__(self):
+        return f"Tarefa({self.como_dict()!r})"
+
+_COLUNAS = frozenset(COLUNAS_TAREFAS)
+_valores_colunas = operator.attrgetter(*COLUNAS_TAREFAS)
+
 # --- FUNÇÕES AUXILIARES DE PERSISTÊNCIA ---
 
-def _escape(valor):
+# Versões do formato dos arquivos de tarefas (tarefas.txt, journal e arquivo):
+#   1 - cabeçalho só com as colunas; dicts gravados com str() e lidos com
+#       ast.literal_eval (lento e sem tipo definido).
+#   2 - cabeçalho "#v2|id|...", dicts em JSON compacto e texto comum que
+#       começa com "{" prefixado com <STR>, para nunca virar dict na leitura.
+#       O journal começa com a linha "V|2".
+# Arquivos sem marcador são lidos como versão 1; migrar_formato_tarefas()
+# converte os antigos.
+VERSAO_FORMATO_TAREFAS = 2
+
+def _escape(valor, versao=VERSAO_FORMATO_TAREFAS):
     if valor is None: return ''
-    if isinstance(valor, dict):
-        return str(valor).replace('|', '<PIPE>').replace('\n', '<NL>')
-    return str(valor).replace('|', '<PIPE>').replace('\n', '<NL>')
+    if versao < 2:
+        texto = str(valor)
+    elif isinstance(valor, dict):
+        texto = json.dumps(valor, ensure_ascii=False, separators=(',', ':'), default=str)
+    else:
+        texto = str(valor)
+        if texto.startswith(('{', '<STR>')): texto = '<STR>' + texto
+    return texto.replace('|', '<PIPE>').replace('\n', '<NL>')
 
-def _unescape(valor):
-    if not valor or valor == 'None' or valor == '': return None
-    texto = valor.replace('<PIPE>', '|').replace('<NL>', '\n')
+def _unescape(valor, versao=VERSAO_FORMATO_TAREFAS):
+    if not valor or valor == 'None': return None
+    texto = valor
+    if '<' in texto:
+        if versao >= 2 and texto.startswith('<STR>'):
+            return texto[5:].replace('<PIPE>', '|').replace('<NL>', '\n')
+        texto = texto.replace('<PIPE>', '|').replace('<NL>', '\n')
     if texto.startswith('{') and texto.endswith('}'):
+        if versao >= 2:
+            try: return json.loads(texto)
+            except ValueError: return texto
         try: return ast.literal_eval(texto)
         except: return texto
     return texto
 
-def _salvar_tarefas(tarefas: list) -> bool:
+def _normalizar_valor(valor):
+    """Devolve o valor como ele ficaria depois de salvo e relido do arquivo."""
+    if valor is None: return None
+    if isinstance(valor, dict):
+        # JSON troca chaves não-texto por str e tuplas por listas
+        return json.loads(json.dumps(valor, default=str))
+    return _unescape(_escape(valor))
+
+def _cabecalho_tarefas(versao=VERSAO_FORMATO_TAREFAS) -> str:
+    colunas = '|'.join(COLUNAS_TAREFAS)
+    return f"{colunas}\n" if versao < 2 else f"#v{versao}|{colunas}\n"
+
+def _versao_do_cabecalho(cabecalho: str) -> int:
+    if cabecalho.startswith('#v'):
+        try: return int(cabecalho[2:].split('|', 1)[0])
+        except ValueError: pass
+    return 1
+
+def _tarefa_para_linha(tarefa: dict, versao=VERSAO_FORMATO_TAREFAS) -> str:
+    return '|'.join(_escape(tarefa.get(col), versao) for col in COLUNAS_TAREFAS)
+
+# Colunas que já apareceram com valor dict (dados_triagem, sinais_vitais...).
+# Só elas precisam de cópia profunda ao entregar linhas do cache.
+_colunas_dict = set()
+
+def _linha_para_tarefa(linha: str, versao=VERSAO_FORMATO_TAREFAS) -> Tarefa:
+    partes = linha.split('|')
+    tarefa = Tarefa()
+    for i, col in enumerate(COLUNAS_TAREFAS):
+        if i < len(partes):
+            valor = _unescape(partes[i], versao)
+            if isinstance(valor, dict): _colunas_dict.add(col)
+            tarefa[col] = valor
+        else: tarefa[col] = None
+    return tarefa
+
+def _normalizar_tarefa(tarefa: dict) -> Tarefa:
+    normalizada = Tarefa()
+    for col in COLUNAS_TAREFAS:
+        valor = _normalizar_valor(tarefa.get(col))
+        if isinstance(valor, dict): _colunas_dict.add(col)
+        normalizada[col] = valor
+    return normalizada
+
+# --- CACHE EM MEMÓRIA DAS TAREFAS ---
+# Mantém as tarefas já interpretadas de tarefas.txt em memória, compartilhadas
+# entre as threads do processo. O arquivo só é relido quando muda no disco
+# (mtime, tamanho ou inode). Quem chama recebe cópias das linhas, então
+# alterar o resultado de _carregar_tarefas() nunca corrompe o cache.
+#
+# 'por_chave' guarda as linhas na ordem do arquivo, indexadas pelo id.
+
+_cache_lock = threading.RLock()
+_cache_tarefas = {'assinatura': None, 'por_chave': {}, 'offset_journal': 0,
+                  'versao_journal': VERSAO_FORMATO_TAREFAS}
+_cache_stats = {'hits': 0, 'misses': 0}
+_compactacao = {'thread': None}
+
+def _assinatura_arquivo(caminho: str):
     try:
-        with open(ARQUIVO_TAREFAS, 'w', encoding='utf-8') as f:
-            f.write('|'.join(COLUNAS_TAREFAS) + '\n')
-            for t in tarefas:
-                linha = []
-                for col in COLUNAS_TAREFAS:
-                    linha.append(_escape(t.get(col)))
-                f.write('|'.join(linha) + '\n')
+        st = os.stat(caminho)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+def _assinatura_tarefas():
+    return (_assinatura_arquivo(ARQUIVO_TAREFAS), _assinatura_arquivo(ARQUIVO_JOURNAL_TAREFAS))
+
+def _copiar_tarefa(tarefa: Tarefa) -> Tarefa:
+    copia = tarefa.copy()
+    for col in _colunas_dict:
+        valor = getattr(copia, col)
+        if isinstance(valor, dict):
+            setattr(copia, col, copy.deepcopy(valor))
+    return copia
+
+def _chave_tarefa(tarefa: dict, posicao: int):
+    return tarefa.get('id') or ('__sem_id__', posicao)
+
+def limpar_cache_tarefas() -> None:
+    """Descarta o cache; a próxima leitura relê o arquivo."""
+    with _cache_lock:
+        _cache_tarefas['assinatura'] = None
+        _substituir_linhas([])
+
+def estatisticas_cache_tarefas() -> dict:
+    """Contadores de acertos/faltas do cache de tarefas."""
+    with _cache_lock:
+        return dict(_cache_stats)
+
+# --- NOTIFICAÇÃO DE MUDANÇAS ---
+# Quem acompanha atendimentos em tempo real (web.workflow) registra um
+# observador, chamado com os atendimento_token cujas tarefas mudaram no
+# cache: por gravação deste processo ou por releitura do que outro worker
+# gravou (ver verificar_mudancas_tarefas). None = não dá para saber quais
+# (backend SQLite). Sem observadores nada disso é calculado.
+#
+# Os painéis dos setores (filas ao vivo) registram observadores de linhas,
+# chamados com os pares (antiga, nova) das tarefas que mudaram: antiga None
+# = criada, nova None = removida. As linhas são as do cache, que nunca são
+# alteradas no lugar (só trocadas), e não devem ser modificadas.
+
+_observadores = []
+_observadores_linhas = []
+_mudancas_pendentes = {}  # chave -> (linha antes da primeira mudança, linha atual)
+_versao_sqlite = {'valor': None}
+
+def observar_mudancas(observador) -> None:
+    """Registra observador(tokens): tokens é um frozenset de atendimento_token ou None."""
+    if observador not in _observadores:
+        _observadores.append(observador)
+
+def observar_linhas(observador) -> None:
+    """Registra observador(pares): lista de (antiga, nova) das tarefas alteradas, ou None."""
+    if observador not in _observadores_linhas:
+        _observadores_linhas.append(observador)
+
+def _observando() -> bool:
+    return bool(_observadores or _observadores_linhas)
+
+def _marcar_mudanca(chave, antiga, nova) -> None:
+    anterior = _mudancas_pendentes.get(chave)
+    _mudancas_pendentes[chave] = (anterior[0] if anterior else antiga, nova)
+
+def _avisar(observadores, mudancas) -> None:
+    for observador in list(observadores):
+        try:
+            observador(mudancas)
+        except Exception as e:
+            print(f"Erro ao notificar mudança de tarefas: {e}")
+
+def _avisar_observadores(tokens, pares=None) -> None:
+    """tokens None = não se sabe o que mudou: todos os observadores recebem None."""
+    if tokens is None or tokens: _avisar(_observadores, tokens)
+    if tokens is None or pares: _avisar(_observadores_linhas, None if tokens is None else pares)
+
+def _notificar_mudancas() -> None:
+    """Entrega aos observadores as mudanças acumuladas. Chamar com _cache_lock adquirido."""
+    if not _mudancas_pendentes: return
+    # Uma linha que mudou e voltou ao que era (ex.: cache descartado e relido) não conta
+    pares = [(antiga, nova) for antiga, nova in _mudancas_pendentes.values() if antiga != nova]
+    _mudancas_pendentes.clear()
+    tokens = frozenset(t.get('atendimento_token') for par in pares for t in par
+                       if t is not None and t.get('atendimento_token'))
+    _avisar_observadores(tokens, pares)
+
+def verificar_mudancas_tarefas() -> None:
+    """
+    Traz para este processo o que outros gravaram, notificando os
+    observadores. Quando nada mudou custa um stat (ou um PRAGMA no SQLite).
+    """
+    if repositorio.usando_sqlite():
+        versao = repositorio.conexao().execute('PRAGMA data_version').fetchone()[0]
+        anterior, _versao_sqlite['valor'] = _versao_sqlite['valor'], versao
+        if anterior is not None and versao != anterior:
+            _avisar_observadores(None)
+        return
+    with _cache_em_dia():
+        pass
+
+# --- ÍNDICES SECUNDÁRIOS ---
+# Mapas em memória para achar tarefas sem percorrer a lista inteira:
+#   atendimento: atendimento_token -> chaves
+#   setor:       setor normalizado -> status normalizado -> chaves
+#   responsavel: id do usuário (responsavel ou concluida_por) -> chaves
+#   grupos:      (setor normalizado, responsavel) -> contadores por status e
+#                as TAMANHO_RECENTES mais recentes (ver _entrar_no_grupo)
+#   recencia:    todas as chaves em ordem de recência, para paginar (ver
+#                _entrar_na_recencia)
+# Cada conjunto de chaves é um dict usado como conjunto ordenado. 'seq'
+# guarda a posição de cada tarefa para devolver resultados na ordem do
+# arquivo. São atualizados linha a linha a cada gravação.
+
+_indices = {'seq': {}, 'proximo': 0, 'atendimento': {}, 'setor': {}, 'responsavel': {}, 'grupos': {},
+            'recencia': (array('q'), [])}
+
+# Tarefas recentes guardadas por grupo: os painéis mostram as 10 mais recentes
+TAMANHO_RECENTES = 10
+
+def _pessoas_tarefa(tarefa: dict) -> set:
+    return {p for p in (tarefa.get('responsavel'), tarefa.get('concluida_por')) if p}
+
+def _indexar(chave, tarefa: dict) -> None:
+    if chave not in _indices['seq']:
+        _indices['seq'][chave] = _indices['proximo']
+        _indices['proximo'] += 1
+    token = tarefa.get('atendimento_token')
+    if token:
+        _indices['atendimento'].setdefault(token, {})[chave] = None
+    setor = repositorio.normalizar_chave(tarefa.get('setor'))
+    status = repositorio.normalizar_chave(tarefa.get('status'))
+    _indices['setor'].setdefault(setor, {}).setdefault(status, {})[chave] = None
+    for pessoa in _pessoas_tarefa(tarefa):
+        _indices['responsavel'].setdefault(pessoa, {})[chave] = None
+    _entrar_no_grupo(chave, tarefa, setor, status)
+    _entrar_na_recencia(chave, tarefa)
+
+def _remover_de(indice: dict, valor, chave) -> None:
+    conjunto = indice.get(valor)
+    if conjunto is None: return
+    conjunto.pop(chave, None)
+    if not conjunto: del indice[valor]
+
+def _desindexar(chave, tarefa: dict) -> None:
+    _remover_de(_indices['atendimento'], tarefa.get('atendimento_token'), chave)
+    setor = repositorio.normalizar_chave(tarefa.get('setor'))
+    status = repositorio.normalizar_chave(tarefa.get('status'))
+    por_status = _indices['setor'].get(setor)
+    if por_status is not None:
+        _remover_de(por_status, status, chave)
+        if not por_status: del _indices['setor'][setor]
+    for pessoa in _pessoas_tarefa(tarefa):
+        _remover_de(_indices['responsavel'], pessoa, chave)
+    _sair_do_grupo(chave, tarefa, setor, status)
+    _sair_da_recencia(chave, tarefa)
+
+# Cada grupo guarda em 'recentes' as suas tarefas mais recentes, ordenadas
+# por (chave_recencia, chave). A lista é sempre o topo do grupo: toda
+# tarefa de fora dela é mais antiga que qualquer uma de dentro, e 'teto' é
+# um limite para a recência das de fora (None = não há nenhuma fora). Tirar
+# uma tarefa da lista preserva isso; só quando ela fica curta com tarefas
+# de fora é que o grupo é remontado, na consulta (_recentes_do_grupo).
+
+def _item_recente(chave, tarefa: dict) -> tuple:
+    return (repositorio.chave_recencia(tarefa, _indices['seq'][chave]), chave)
+
+def _entrar_no_grupo(chave, tarefa: dict, setor: str, status: str) -> None:
+    """Conta a tarefa no grupo (setor e status já normalizados) e a põe nas recentes se couber."""
+    chave_grupo = (setor, tarefa.get('responsavel') or '')
+    grupo = _indices['grupos'].get(chave_grupo)
+    if grupo is None:
+        grupo = _indices['grupos'][chave_grupo] = {'status': {}, 'recentes': [], 'teto': None}
+    grupo['status'][status] = grupo['status'].get(status, 0) + 1
+    item = _item_recente(chave, tarefa)
+    if grupo['teto'] is not None and item[0] < grupo['teto']:
+        return
+    recentes = grupo['recentes']
+    if not recentes or item > recentes[-1]:
+        recentes.append(item)  # o caso comum: a tarefa mais nova do grupo
+    else:
+        bisect.insort(recentes, item)
+    if len(recentes) > TAMANHO_RECENTES:
+        saiu = recentes.pop(0)[0]
+        grupo['teto'] = saiu if grupo['teto'] is None else max(grupo['teto'], saiu)
+
+def _sair_do_grupo(chave, tarefa: dict, setor: str, status: str) -> None:
+    chave_grupo = (setor, tarefa.get('responsavel') or '')
+    grupo = _indices['grupos'].get(chave_grupo)
+    if grupo is None: return
+    grupo['status'][status] -= 1
+    if not grupo['status'][status]: del grupo['status'][status]
+    if not grupo['status']:
+        del _indices['grupos'][chave_grupo]
+        return
+    recentes = grupo['recentes']
+    recencia = _item_recente(chave, tarefa)[0]
+    i = bisect.bisect_left(recentes, (recencia,))
+    if i < len(recentes) and recentes[i][1] == chave:
+        del recentes[i]
+
+# 'recencia' são duas listas paralelas ordenadas: as chaves de recência
+# como inteiro (AAAAMMDD << 32 | seq) num array e as chaves das tarefas.
+# Uma tarefa nova quase sempre é a mais recente e entra no fim. Na
+# reconstrução completa (_substituir_linhas) fica None e é ordenada uma vez
+# no final.
+
+def _recencia_inteira(chave, tarefa: dict) -> int:
+    return repositorio.chave_recencia(tarefa, 0)[0] << 32 | _indices['seq'][chave]
+
+def _entrar_na_recencia(chave, tarefa: dict) -> None:
+    if _indices['recencia'] is None: return
+    recencias, chaves = _indices['recencia']
+    valor = _recencia_inteira(chave, tarefa)
+    if not recencias or valor > recencias[-1]:
+        recencias.append(valor)
+        chaves.append(chave)
+        return
+    i = bisect.bisect_left(recencias, valor)
+    recencias.insert(i, valor)
+    chaves.insert(i, chave)
+
+def _sair_da_recencia(chave, tarefa: dict) -> None:
+    if _indices['recencia'] is None: return
+    recencias, chaves = _indices['recencia']
+    i = bisect.bisect_left(recencias, _recencia_inteira(chave, tarefa))
+    if i < len(chaves) and chaves[i] == chave:
+        del recencias[i]
+        del chaves[i]
+
+def _montar_recencia() -> None:
+    por_chave = _cache_tarefas['por_chave']
+    itens = sorted((_recencia_inteira(c, t), c) for c, t in por_chave.items())
+    _indices['recencia'] = (array('q', [valor for valor, _ in itens]), [c for _, c in itens])
+
+def _recentes_do_grupo(chave_grupo, grupo: dict) -> list:
+    """'recentes' do grupo, remontada a partir do índice de setor se ficou curta."""
+    if len(grupo['recentes']) < TAMANHO_RECENTES and grupo['teto'] is not None:
+        setor, responsavel = chave_grupo
+        por_chave = _cache_tarefas['por_chave']
+        itens = sorted(_item_recente(c, por_chave[c])
+                       for conjunto in _indices['setor'].get(setor, {}).values() for c in conjunto
+                       if (por_chave[c].get('responsavel') or '') == responsavel)
+        grupo['recentes'] = itens[-TAMANHO_RECENTES:]
+        grupo['teto'] = itens[-TAMANHO_RECENTES - 1][0] if len(itens) > TAMANHO_RECENTES else None
+    return grupo['recentes']
+
+def _trocar_linha(chave, nova) -> None:
+    """Insere, substitui (nova=dict) ou remove (nova=None) uma linha do cache."""
+    por_chave = _cache_tarefas['por_chave']
+    antiga = por_chave.get(chave)
+    if _observando() and antiga != nova:
+        _marcar_mudanca(chave, antiga, nova)
+    if antiga is not None:
+        _desindexar(chave, antiga)
+    if nova is None:
+        por_chave.pop(chave, None)
+        _indices['seq'].pop(chave, None)
+    else:
+        por_chave[chave] = nova
+        _indexar(chave, nova)
+
+def _substituir_linhas(linhas: list) -> None:
+    """Troca todo o conteúdo do cache e reconstrói os índices."""
+    _indices.update({'seq': {}, 'proximo': 0, 'atendimento': {}, 'setor': {}, 'responsavel': {}, 'grupos': {},
+                     'recencia': None})
+    por_chave = {}
+    for i, t in enumerate(linhas):
+        chave = _chave_tarefa(t, i)
+        if chave in por_chave:
+            _desindexar(chave, por_chave[chave])
+        por_chave[chave] = t
+        _indexar(chave, t)
+    if _observando():
+        antigas = _cache_tarefas['por_chave']
+        for chave, t in por_chave.items():
+            antiga = antigas.get(chave)
+            if antiga != t: _marcar_mudanca(chave, antiga, t)
+        for chave, antiga in antigas.items():
+            if chave not in por_chave: _marcar_mudanca(chave, antiga, None)
+    _cache_tarefas['por_chave'] = por_chave
+    _montar_recencia()
+
+def _sincronizar_linhas(linhas: list) -> None:
+    """
+    Deixa o cache igual a `linhas` mexendo só no que mudou. Se a ordem das
+    tarefas existentes mudou, reconstrói tudo (a ordem do arquivo importa).
+    """
+    por_chave = _cache_tarefas['por_chave']
+    seq = _indices['seq']
+    novas = {}
+    ultima_posicao = -1
+    viu_nova = False
+    for i, t in enumerate(linhas):
+        chave = _chave_tarefa(t, i)
+        if chave in novas or (chave in seq and (viu_nova or seq[chave] < ultima_posicao)):
+            _substituir_linhas(linhas)
+            return
+        if chave in seq: ultima_posicao = seq[chave]
+        else: viu_nova = True
+        novas[chave] = t
+
+    for chave in [c for c in por_chave if c not in novas]:
+        _trocar_linha(chave, None)
+    for chave, t in novas.items():
+        if por_chave.get(chave) != t:
+            _trocar_linha(chave, t)
+    _cache_tarefas['por_chave'] = {chave: por_chave[chave] for chave in novas}
+
+def _linhas_por_chaves(conjuntos) -> list:
+    """Cópias das tarefas de um ou mais conjuntos de chaves, na ordem do arquivo."""
+    chaves = set()
+    for conjunto in conjuntos:
+        chaves.update(conjunto)
+    seq = _indices['seq']
+    por_chave = _cache_tarefas['por_chave']
+    return [_copiar_tarefa(por_chave[c]) for c in sorted(chaves, key=seq.__getitem__)]
+
+# --- JOURNAL (APPEND-ONLY) ---
+# Com USAR_JOURNAL ligado, cada criação/alteração vira uma linha anexada a
+# tarefas.journal ("U|<campos>" para upsert, "D|<id>" para exclusão) em vez
+# de reescrever tarefas.txt inteiro. tarefas.txt continua no formato pipe
+# e passa a ser o snapshot; a leitura aplica o journal por cima dele.
+
+def _aplicar_journal(inicio: int = 0) -> int:
+    """Aplica ao cache as linhas do journal a partir de `inicio`. Retorna o novo offset."""
+    if not os.path.exists(ARQUIVO_JOURNAL_TAREFAS): return 0
+    with open(ARQUIVO_JOURNAL_TAREFAS, 'rb') as f:
+        f.seek(inicio)
+        dados = f.read()
+    fim = dados.rfind(b'\n') + 1  # ignora uma linha final ainda incompleta
+    if inicio == 0: _cache_tarefas['versao_journal'] = 1  # journal sem linha "V|"
+    for linha in dados[:fim].decode('utf-8').split('\n'):
+        if linha.startswith('U|'):
+            tarefa = _linha_para_tarefa(linha[2:], _cache_tarefas['versao_journal'])
+            _trocar_linha(tarefa['id'], tarefa)
+        elif linha.startswith('D|'):
+            _trocar_linha(_unescape(linha[2:], _cache_tarefas['versao_journal']), None)
+        elif linha.startswith('V|'):
+            _cache_tarefas['versao_journal'] = int(linha[2:])
+    return inicio + fim
+
+def _escrever_snapshot(tarefas) -> list:
+    """Reescreve tarefas.txt inteiro e devolve as linhas normalizadas."""
+    normalizadas = []
+    def _linhas():
+        yield _cabecalho_tarefas()
+        for t in tarefas:
+            yield _tarefa_para_linha(t) + '\n'
+            normalizadas.append(_normalizar_tarefa(t))
+    arquivos.escrever_atomico(ARQUIVO_TAREFAS, _linhas())
+    return normalizadas
+
+def _salvar_no_journal(tarefas: list) -> bool:
+    """Anexa ao journal só o que mudou em relação ao estado atual.
+
+    Retorna False quando há linhas sem id (não dá para referenciá-las no
+    journal); nesse caso quem chama reescreve o snapshot.
+    """
+    if any(not t.get('id') for t in tarefas): return False
+    _garantir_cache(contar=False)
+    por_chave = _cache_tarefas['por_chave']
+    if any(isinstance(chave, tuple) for chave in por_chave): return False
+
+    # Journal novo sai na versão atual; um antigo continua na versão dele
+    if _cache_tarefas['offset_journal'] == 0:
+        _cache_tarefas['versao_journal'] = VERSAO_FORMATO_TAREFAS
+    versao = _cache_tarefas['versao_journal']
+    registros = []
+    novos_ids = set()
+    for t in tarefas:
+        normalizada = _normalizar_tarefa(t)
+        novos_ids.add(normalizada['id'])
+        if por_chave.get(normalizada['id']) != normalizada:
+            _trocar_linha(normalizada['id'], normalizada)
+            registros.append('U|' + _tarefa_para_linha(t, versao))
+    for chave in [c for c in por_chave if c not in novos_ids]:
+        _trocar_linha(chave, None)
+        registros.append('D|' + _escape(chave, versao))
+    if registros and _cache_tarefas['offset_journal'] == 0 and versao >= 2:
+        registros.insert(0, f'V|{versao}')
+
+    if registros:
+        with open(ARQUIVO_JOURNAL_TAREFAS, 'a', encoding='utf-8') as f:
+            f.write('\n'.join(registros) + '\n')
+    assinatura = _assinatura_tarefas()
+    tamanho_journal = assinatura[1][1] if assinatura[1] else 0
+    _cache_tarefas['assinatura'] = assinatura
+    _cache_tarefas['offset_journal'] = tamanho_journal
+
+    if tamanho_journal > LIMITE_JOURNAL_BYTES:
+        _agendar_compactacao()
+    return True
+
+def compactar_journal_tarefas() -> bool:
+    """Grava o estado atual como novo snapshot e esvazia o journal."""
+    with arquivos.trava(ARQUIVO_TAREFAS), _cache_lock:
+        try:
+            _garantir_cache(contar=False)
+            _escrever_snapshot(_cache_tarefas['por_chave'].values())
+            if os.path.exists(ARQUIVO_JOURNAL_TAREFAS):
+                os.remove(ARQUIVO_JOURNAL_TAREFAS)
+            _cache_tarefas['assinatura'] = _assinatura_tarefas()
+            _cache_tarefas['offset_journal'] = 0
+            return True
+        except Exception as e:
+            print(f"Erro ao compactar journal de tarefas: {e}")
+            limpar_cache_tarefas()
+            return False
+
+def _agendar_compactacao() -> None:
+    """Roda a compactação numa thread separada, fora do caminho da requisição."""
+    thread = _compactacao['thread']
+    if thread is not None and thread.is_alive(): return
+    thread = threading.Thread(target=compactar_journal_tarefas, daemon=True)
+    _compactacao['thread'] = thread
+    thread.start()
+
+# --- LEITURA E GRAVAÇÃO (BACKEND TEXTO) ---
+# Entre processos (vários workers do gunicorn) vale a trava de arquivo de
+# utils.arquivos: compartilhada para reler o disco, exclusiva para gravar.
+# Ordem fixa: primeiro a trava de arquivo, depois _cache_lock.
+
+@contextmanager
+def transacao_tarefas():
+    """Trava exclusiva durante um ciclo carregar-alterar-salvar inteiro.
+
+    Sem ela, dois workers que carregam a mesma lista ao mesmo tempo
+    sobrescrevem a alteração um do outro ao salvar. No SQLite é uma
+    transação BEGIN IMMEDIATE na conexão da thread.
+    """
+    if repositorio.usando_sqlite():
+        with repositorio.transacao():
+            yield
+        return
+    with arquivos.trava(ARQUIVO_TAREFAS):
+        yield
+
+def _salvar_tarefas_texto(tarefas: list) -> bool:
+    try:
+        with arquivos.trava(ARQUIVO_TAREFAS), _cache_lock:
+            if not (USAR_JOURNAL and _salvar_no_journal(tarefas)):
+                normalizadas = _escrever_snapshot(tarefas)
+                if os.path.exists(ARQUIVO_JOURNAL_TAREFAS):
+                    os.remove(ARQUIVO_JOURNAL_TAREFAS)
+                _sincronizar_linhas(normalizadas)
+                _cache_tarefas['assinatura'] = _assinatura_tarefas()
+                _cache_tarefas['offset_journal'] = 0
+            _notificar_mudancas()
         return True
     except Exception as e:
         print(f"Erro ao salvar tarefas: {e}")
+        limpar_cache_tarefas()
         return False
 
-def _carregar_tarefas() -> list:
-    if not os.path.exists(ARQUIVO_TAREFAS): return []
-    lista_tarefas = []
+def _ler_linhas_tarefas(caminho: str, colunas=None):
+    """
+    Gera as tarefas de um arquivo com cabeçalho (tarefas.txt ou um dia do
+    arquivo), uma por vez. Com `colunas`, só esses campos são decodificados
+    e cada linha sai como dict com eles; sem, sai a Tarefa completa.
+    """
+    if not os.path.exists(caminho): return
+    posicoes = None if colunas is None else [(COLUNAS_TAREFAS.index(col), col) for col in colunas]
+    with open(caminho, 'r', encoding='utf-8') as f:
+        versao = _versao_do_cabecalho(f.readline())
+        for linha in f:
+            linha = linha.rstrip('\n')
+            if not linha.strip(): continue
+            if posicoes is None:
+                yield _linha_para_tarefa(linha, versao)
+                continue
+            partes = linha.split('|')
+            yield {col: _unescape(partes[i], versao) if i < len(partes) else None for i, col in posicoes}
+
+def _ler_snapshot() -> list:
+    return list(_ler_linhas_tarefas(ARQUIVO_TAREFAS))
+
+def _garantir_cache(contar: bool = True) -> None:
+    """Deixa o cache coerente com o disco. Chamar com _cache_lock adquirido."""
+    assinatura = _assinatura_tarefas()
+    anterior = _cache_tarefas['assinatura']
+    if assinatura == anterior:
+        if contar: _cache_stats['hits'] += 1
+        return
+    if contar: _cache_stats['misses'] += 1
+
     try:
-        with open(ARQUIVO_TAREFAS, 'r', encoding='utf-8') as f:
-            linhas = f.readlines()
-            if len(linhas) < 2: return []
-            for linha in linhas[1:]:
-                linha = linha.strip()
-                if not linha: continue
-                partes = linha.split('|')
-                tarefa = {}
-                for i, col in enumerate(COLUNAS_TAREFAS):
-                    if i < len(partes): tarefa[col] = _unescape(partes[i])
-                    else: tarefa[col] = None
-                lista_tarefas.append(tarefa)
+        journal, journal_anterior = assinatura[1], anterior[1] if anterior else None
+        so_journal_cresceu = (
+            anterior is not None and assinatura[0] == anterior[0]
+            and journal is not None and journal_anterior is not None
+            and journal[2] == journal_anterior[2]
+            and journal[1] >= _cache_tarefas['offset_journal']
+        )
+        if so_journal_cresceu:
+            # Só houve append no journal: aplica apenas o trecho novo
+            offset = _aplicar_journal(_cache_tarefas['offset_journal'])
+        else:
+            _substituir_linhas(_ler_snapshot())
+            offset = _aplicar_journal()
+        _cache_tarefas['assinatura'] = assinatura
+        _cache_tarefas['offset_journal'] = offset
     except Exception as e:
         print(f"Erro ao carregar tarefas: {e}")
-        return []
-    return lista_tarefas
+        limpar_cache_tarefas()
+    _notificar_mudancas()
+
+@contextmanager
+def _cache_em_dia():
+    """Segura _cache_lock com o cache coerente com o disco.
+
+    No acerto basta o stat; a trava compartilhada só é pega para reler.
+    """
+    with _cache_lock:
+        if _assinatura_tarefas() == _cache_tarefas['assinatura']:
+            _cache_stats['hits'] += 1
+            yield
+            return
+    with arquivos.trava(ARQUIVO_TAREFAS, exclusiva=False), _cache_lock:
+        _garantir_cache()
+        yield
+
+@contextmanager
+def leitura_estavel():
+    """
+    Enquanto dura, nada é gravado nem notificado neste processo e as
+    leituras de tarefas veem todas o mesmo estado (ex.: tirar a foto de um
+    painel junto com a posição no log de eventos das filas).
+    """
+    if repositorio.usando_sqlite():
+        yield
+        return
+    with arquivos.trava(ARQUIVO_TAREFAS, exclusiva=False), _cache_lock:
+        _garantir_cache()
+        yield
+
+def _carregar_tarefas_texto() -> list:
+    with _cache_em_dia():
+        return [_copiar_tarefa(t) for t in _cache_tarefas['por_chave'].values()]
+
+class _RepositorioTarefasTexto(repositorio.RepositorioTarefas):
+    """tarefas.txt (+ journal), com o cache e os índices em memória acima."""
+
+    def carregar(self) -> list:
+        return _carregar_tarefas_texto()
+
+    def salvar(self, tarefas: list) -> bool:
+        return _salvar_tarefas_texto(tarefas)
+
+    def obter(self, id_tarefa: str):
+        with _cache_em_dia():
+            tarefa = _cache_tarefas['por_chave'].get(id_tarefa)
+            return _copiar_tarefa(tarefa) if tarefa is not None else None
+
+    def por_atendimento(self, atendimento_token: str) -> list:
+        with _cache_em_dia():
+            return _linhas_por_chaves([_indices['atendimento'].get(atendimento_token, {})])
+
+    def por_setor(self, setor: str, status: str = None) -> list:
+        with _cache_em_dia():
+            por_status = _indices['setor'].get(repositorio.normalizar_chave(setor), {})
+            if status is None:
+                return _linhas_por_chaves(por_status.values())
+            return _linhas_por_chaves([por_status.get(repositorio.normalizar_chave(status), {})])
+
+    def por_responsavel(self, id_usuario: str) -> list:
+        with _cache_em_dia():
+            return _linhas_por_chaves([_indices['responsavel'].get(id_usuario, {})])
+
+    def por_setor_ou_responsavel(self, setor: str, id_usuario: str) -> list:
+        with _cache_em_dia():
+            por_status = _indices['setor'].get(repositorio.normalizar_chave(setor), {})
+            conjuntos = list(por_status.values())
+            conjuntos.append(_indices['responsavel'].get(id_usuario, {}))
+            return _linhas_por_chaves(conjuntos)
+
+    def contar(self, incluir) -> dict:
+        with _cache_em_dia():
+            contagem = {}
+            for chave_grupo, grupo in _indices['grupos'].items():
+                if incluir(*chave_grupo):
+                    for status, quantidade in grupo['status'].items():
+                        contagem[status] = contagem.get(status, 0) + quantidade
+            return contagem
+
+    def recentes(self, incluir, quantidade: int = 10) -> list:
+        if quantidade > TAMANHO_RECENTES:
+            return super().recentes(incluir, quantidade)
+        with _cache_em_dia():
+            listas = [_recentes_do_grupo(chave_grupo, grupo)
+                      for chave_grupo, grupo in _indices['grupos'].items() if incluir(*chave_grupo)]
+            itens = heapq.nlargest(quantidade, (item for lista in listas for item in lista))
+            por_chave = _cache_tarefas['por_chave']
+            return [_copiar_tarefa(por_chave[chave]) for _, chave in itens]
+
+    def pagina(self, incluir=None, apos=None, quantidade: int = 50, setor=None, status=None,
+               inicio=None, fim=None, busca=None) -> tuple:
+        filtro = repositorio.filtro_pagina(incluir, setor, status, busca)
+        with _cache_em_dia():
+            recencias, chaves = _indices['recencia']
+            por_chave = _cache_tarefas['por_chave']
+            # Faixa [menor, maior) de recências que ainda podem entrar na página
+            menor = repositorio.dia_ordenavel(inicio) << 32 if inicio else None
+            maior = (repositorio.dia_ordenavel(fim) + 1) << 32 if fim else None
+            cursor = repositorio.ler_cursor(apos)
+            if cursor is not None:
+                anterior = por_chave.get(cursor[1]) if cursor[1] else None
+                if anterior is not None:
+                    limite = _recencia_inteira(cursor[1], anterior)
+                else:
+                    limite = (cursor[0] + 1) << 32  # a tarefa do cursor sumiu: recomeça o dia dela
+                maior = limite if maior is None else min(maior, limite)
+
+            candidatas = None
+            if setor:
+                por_status = _indices['setor'].get(repositorio.normalizar_chave(setor), {})
+                conjuntos = list(por_status.values()) if not status else \
+                    [por_status.get(repositorio.normalizar_chave(status), {})]
+                candidatas = sum(len(c) for c in conjuntos)
+            if candidatas is not None and candidatas * 8 < len(chaves):
+                # Setor (e status) seletivos: só as candidatas do índice
+                itens = []
+                for conjunto in conjuntos:
+                    for chave in conjunto:
+                        valor = _recencia_inteira(chave, por_chave[chave])
+                        if (menor is None or valor >= menor) and (maior is None or valor < maior) \
+                                and filtro(por_chave[chave]):
+                            itens.append((valor, chave))
+                encontradas = [c for _, c in heapq.nlargest(quantidade + 1, itens)]
+            else:
+                # Da mais recente para trás na ordem de recência, até fechar a página
+                encontradas = []
+                i = len(recencias) if maior is None else bisect.bisect_left(recencias, maior)
+                parada = 0 if menor is None else bisect.bisect_left(recencias, menor)
+                while i > parada and len(encontradas) <= quantidade:
+                    i -= 1
+                    if filtro(por_chave[chaves[i]]):
+                        encontradas.append(chaves[i])
+            return repositorio.fechar_pagina([_copiar_tarefa(por_chave[c]) for c in encontradas], quantidade)
+
+_REPOSITORIO_TEXTO = _RepositorioTarefasTexto()
+# O SQLite grava o registro como JSON: normaliza para dict
+_REPOSITORIO_SQLITE = repositorio.RepositorioTarefasSQLite(lambda t: _normalizar_tarefa(t).como_dict())
+
+def _repositorio_tarefas() -> repositorio.RepositorioTarefas:
+    """Backend escolhido em utils.repositorio.BACKEND (texto ou sqlite)."""
+    if repositorio.usando_sqlite(): return _REPOSITORIO_SQLITE
+    return _REPOSITORIO_TEXTO
+
+def _salvar_tarefas(tarefas: list) -> bool:
+    salvou = _repositorio_tarefas().salvar(tarefas)
+    # O backend texto já notifica pelo cache; no SQLite não se sabe o que mudou
+    if salvou and repositorio.usando_sqlite(): _avisar_observadores(None)
+    return salvou
+
+def _carregar_tarefas() -> list:
+    return _repositorio_tarefas().carregar()
+
+def buscar_tarefas_por_atendimento(atendimento_token: str) -> list:
+    encontradas = _repositorio_tarefas().por_atendimento(atendimento_token)
+    # Atendimento antigo (app do paciente aberto depois do arquivamento)
+    return encontradas or buscar_tarefas_arquivadas(atendimento_token)
+
+def buscar_tarefas_por_setor(setor: str, status: str = None) -> list:
+    return _repositorio_tarefas().por_setor(setor, status)
+
+def buscar_tarefas_por_responsavel(id_usuario: str) -> list:
+    return _repositorio_tarefas().por_responsavel(id_usuario)
+
+def buscar_tarefas_por_setor_ou_responsavel(setor: str, id_usuario: str) -> list:
+    """Tarefas do setor ou ligadas ao usuário (responsável/concluída por), sem repetição."""
+    return _repositorio_tarefas().por_setor_ou_responsavel(setor, id_usuario)
+
+def pagina_tarefas(incluir=None, apos=None, quantidade: int = 50, **filtros) -> tuple:
+    """
+    Uma página das tarefas ativas, da mais recente para a mais antiga, e o
+    cursor da próxima (None na última). Filtros: setor, status, inicio e
+    fim (datetime.date, data de criação) e busca (título, descrição ou
+    paciente); ver RepositorioTarefas.pagina.
+    """
+    return _repositorio_tarefas().pagina(incluir, apos, quantidade, **filtros)
+
+def resumo_tarefas(incluir=None, quantidade: int = 10) -> tuple:
+    """
+    (total, concluídas, as `quantidade` mais recentes) das tarefas ativas
+    cujo grupo (setor normalizado, responsavel) é aceito por
+    incluir(setor, responsavel); sem `incluir`, de todas. No backend texto
+    vem dos contadores e listas mantidos a cada gravação, sem percorrer as
+    tarefas.
+    """
+    if incluir is None:
+        incluir = lambda setor, responsavel: True
+    repositorio_tarefas = _repositorio_tarefas()
+    contagem = repositorio_tarefas.contar(incluir)
+    concluidas = contagem.get(repositorio.normalizar_chave(STATUS_CONCLUIDA), 0)
+    return sum(contagem.values()), concluidas, repositorio_tarefas.recentes(incluir, quantidade)
+
+# --- ARQUIVO DE ATENDIMENTOS ENCERRADOS ---
+# Tarefas de atendimentos já encerrados só interessam aos relatórios, mas
+# ficariam sendo relidas por todo painel e fila. arquivar_tarefas_concluidas
+# move as tarefas de cada atendimento (atendimento_token, ou paciente_id no
+# fluxo do terminal) cujas tarefas estão todas concluídas/canceladas há mais
+# de DIAS_TAREFAS_ATIVAS dias para PASTA_ARQUIVO_TAREFAS/AAAAMMDD.txt (dia do
+# encerramento, mesmo formato de tarefas.txt). indice.txt guarda
+# "atendimento|AAAAMMDD|AAAAMMDD" (dia do arquivo e data mais antiga das
+# tarefas) para achar as tarefas de um atendimento arquivado e saber que
+# dias do arquivo têm tarefas de um período.
+
+_indice_arquivo = {'assinatura': None, 'dias': {}, 'primeiras': {}}
+
+def _arquivo_do_dia(dia: str) -> str:
+    return os.path.join(PASTA_ARQUIVO_TAREFAS, f"{dia}.txt")
+
+def _arquivo_indice_arquivo() -> str:
+    return os.path.join(PASTA_ARQUIVO_TAREFAS, 'indice.txt')
+
+def _encerrada(tarefa: dict) -> bool:
+    return tarefa.get('status') in (STATUS_CONCLUIDA, STATUS_CANCELADA)
+
+def _data_da_tarefa(tarefa: dict):
+    for campo in ('data_conclusao', 'data_criacao'):
+        try:
+            return datetime.strptime(str(tarefa.get(campo))[:10], "%d/%m/%Y").date()
+        except ValueError:
+            continue
+    return None
+
+def _anexar_ao_arquivo(dia: str, lista: list) -> None:
+    caminho = _arquivo_do_dia(dia)
+    versao = VERSAO_FORMATO_TAREFAS
+    if os.path.exists(caminho):
+        with open(caminho, 'r', encoding='utf-8') as f:
+            versao = _versao_do_cabecalho(f.readline())
+    with open(caminho, 'a', encoding='utf-8') as f:
+        if f.tell() == 0: f.write(_cabecalho_tarefas())
+        for t in lista:
+            f.write(_tarefa_para_linha(t, versao) + '\n')
+
+def arquivar_tarefas_concluidas(dias: int = None) -> int:
+    """Move para o arquivo os atendimentos encerrados há mais de `dias` dias. Retorna quantas tarefas saíram."""
+    if repositorio.usando_sqlite(): return 0  # o SQLite já consulta por índice
+    dias = DIAS_TAREFAS_ATIVAS if dias is None else dias
+    limite = (datetime.now() - timedelta(days=dias)).date()
+    try:
+        with transacao_tarefas():
+            lista = _carregar_tarefas()
+            grupos = {}
+            for t in lista:
+                chave = t.get('atendimento_token') or t.get('paciente_id')
+                if chave: grupos.setdefault(chave, []).append(t)
+
+            por_dia, indice, saem = {}, [], set()
+            for chave, grupo in grupos.items():
+                if not all(_encerrada(t) and t.get('id') for t in grupo): continue
+                datas = [d for d in map(_data_da_tarefa, grupo) if d]
+                if not datas or max(datas) >= limite: continue
+                dia = max(datas).strftime('%Y%m%d')
+                por_dia.setdefault(dia, []).extend(grupo)
+                indice.append(f"{chave}|{dia}|{min(datas).strftime('%Y%m%d')}\n")
+                saem.update(t['id'] for t in grupo)
+            if not saem: return 0
+
+            # Primeiro o arquivo, depois tarefas.txt: se cair no meio, a tarefa
+            # fica nos dois lugares e a leitura do histórico descarta a cópia.
+            os.makedirs(PASTA_ARQUIVO_TAREFAS, exist_ok=True)
+            for dia, grupo in por_dia.items():
+                _anexar_ao_arquivo(dia, grupo)
+            with open(_arquivo_indice_arquivo(), 'a', encoding='utf-8') as f:
+                f.write(''.join(indice))
+            _salvar_tarefas([t for t in lista if t['id'] not in saem])
+            return len(saem)
+    except Exception as e:
+        print(f"Erro ao arquivar tarefas: {e}")
+        return 0
+
+def _carregar_indice_arquivo() -> dict:
+    assinatura = _assinatura_arquivo(_arquivo_indice_arquivo())
+    if assinatura != _indice_arquivo['assinatura']:
+        dias, primeiras = {}, {}
+        if assinatura is not None:
+            with open(_arquivo_indice_arquivo(), 'r', encoding='utf-8') as f:
+                for linha in f:
+                    atendimento, _, resto = linha.strip().partition('|')
+                    dia, _, primeira = resto.partition('|')
+                    if not dia: continue
+                    dias.setdefault(atendimento, []).append(dia)
+                    # Linha antiga, sem a data mais antiga (''): vale qualquer data
+                    primeiras[dia] = min(primeiras.get(dia, primeira), primeira)
+        _indice_arquivo.update(assinatura=assinatura, dias=dias, primeiras=primeiras)
+    return _indice_arquivo
+
+def _dias_do_atendimento_arquivado(chave: str) -> list:
+    return _carregar_indice_arquivo()['dias'].get(chave, [])
+
+def _ler_arquivo_do_dia(dia: str, colunas=None):
+    return _ler_linhas_tarefas(_arquivo_do_dia(dia), colunas)
+
+def _dias_arquivados(inicio=None, fim=None) -> list:
+    """
+    Dias do arquivo que podem ter tarefas com data entre inicio e fim. O
+    dia é o do encerramento, a data mais recente do atendimento: um dia
+    depois de `fim` ainda entra se o atendimento começou até `fim`.
+    """
+    if not os.path.isdir(PASTA_ARQUIVO_TAREFAS): return []
+    primeiras = _carregar_indice_arquivo()['primeiras'] if fim else {}
+    dias = []
+    for nome in sorted(os.listdir(PASTA_ARQUIVO_TAREFAS)):
+        dia = nome[:-4]
+        if not (nome.endswith('.txt') and dia.isdigit()): continue
+        data = datetime.strptime(dia, '%Y%m%d').date()
+        if inicio and data < inicio: continue
+        if fim and data > fim and primeiras.get(dia, '') > fim.strftime('%Y%m%d'): continue
+        dias.append(dia)
+    return dias
+
+def iterar_tarefas_arquivadas(inicio=None, fim=None, colunas=None):
+    """
+    Tarefas arquivadas, uma a uma, dos dias do arquivo que podem ter
+    tarefas com data entre `inicio` e `fim` (date, inclusive). Vêm junto
+    outras tarefas dos mesmos atendimentos: o filtro exato por data fica
+    com quem lê (ex.: TabelaTarefas.selecionar).
+    """
+    for dia in _dias_arquivados(inicio, fim):
+        yield from _ler_arquivo_do_dia(dia, colunas)
+
+def buscar_tarefas_arquivadas(atendimento_token: str) -> list:
+    encontradas = {}
+    for dia in _dias_do_atendimento_arquivado(atendimento_token):
+        for t in _ler_arquivo_do_dia(dia):
+            if atendimento_token in (t.get('atendimento_token'), t.get('paciente_id')):
+                encontradas[t['id']] = t
+    return list(encontradas.values())
+
+def carregar_historico_tarefas(ativas: list = None, inicio=None, fim=None) -> list:
+    """Tarefas ativas (ou `ativas`) + arquivadas do período, sem repetir ids (a ativa prevalece)."""
+    historico = _carregar_tarefas() if ativas is None else list(ativas)
+    vistos = {t.get('id') for t in historico}
+    for t in iterar_tarefas_arquivadas(inicio, fim):
+        if t.get('id') in vistos: continue
+        vistos.add(t.get('id'))
+        historico.append(t)
+    return historico
+
+# --- LEITURA EM STREAMING ---
+# iter_tarefas percorre as tarefas sem montar a lista de cópias que
+# _carregar_tarefas devolve: para buscas que param no primeiro resultado,
+# contagens e relatórios/exportações sobre históricos grandes.
+
+def _projetar(tarefa, colunas) -> dict:
+    linha = {}
+    for col in colunas:
+        valor = tarefa.get(col)
+        linha[col] = copy.deepcopy(valor) if isinstance(valor, dict) else valor
+    return linha
+
+def _iterar_tarefas_texto(predicado, colunas):
+    with _cache_lock:
+        frio = _cache_tarefas['assinatura'] is None
+    if frio and not os.path.exists(ARQUIVO_JOURNAL_TAREFAS):
+        # Processo que ainda não leu as tarefas (relatório, exportação pelo
+        # terminal): lê tarefas.txt direto, sem carregar o cache inteiro
+        if predicado is None:
+            yield from _ler_linhas_tarefas(ARQUIVO_TAREFAS, colunas)
+            return
+        for t in _ler_linhas_tarefas(ARQUIVO_TAREFAS):
+            if predicado(t): yield t if colunas is None else _projetar(t, colunas)
+        return
+    # Com o cache carregado, basta a lista de referências às linhas (que
+    # nunca são alteradas no lugar, só trocadas); a cópia é por linha entregue
+    with _cache_em_dia():
+        linhas = list(_cache_tarefas['por_chave'].values())
+    for t in linhas:
+        if predicado is None or predicado(t):
+            yield _copiar_tarefa(t) if colunas is None else _projetar(t, colunas)
+
+def iter_tarefas(predicado=None, colunas=None, historico: bool = False, inicio=None, fim=None):
+    """
+    Gera as tarefas uma a uma, na ordem de tarefas.txt.
+
+    Args:
+        predicado: Função que recebe a tarefa completa (só para leitura) e
+            diz se ela sai; None = todas
+        colunas: Campos de cada tarefa entregue (dict só com eles); None =
+            Tarefa completa. Lendo do disco, só esses campos são decodificados
+        historico: Inclui depois as tarefas arquivadas do período
+            inicio/fim, sem repetir ids (como carregar_historico_tarefas)
+
+    Parar de consumir o gerador (break, next) encerra a leitura.
+    """
+    if colunas is not None:
+        colunas = list(colunas)
+        desconhecidas = [col for col in colunas if col not in _COLUNAS]
+        if desconhecidas: raise ValueError(f"Colunas desconhecidas: {desconhecidas}")
+    # O histórico precisa do id para não repetir a cópia arquivada de uma ativa
+    leitura = colunas
+    sem_id = historico and colunas is not None and 'id' not in colunas
+    if sem_id: leitura = colunas + ['id']
+
+    if repositorio.usando_sqlite():
+        ativas = (t if leitura is None else _projetar(t, leitura)
+                  for t in _repositorio_tarefas().iterar() if predicado is None or predicado(t))
+    else:
+        ativas = _iterar_tarefas_texto(predicado, leitura)
+
+    vistos = set()
+    for t in ativas:
+        if historico: vistos.add(t.get('id'))
+        if sem_id: t.pop('id')
+        yield t
+    if not historico: return
+
+    # Cópias repetidas no arquivo caem no mesmo dia (ver arquivar_tarefas_concluidas):
+    # basta lembrar os ids do dia em leitura, além dos das ativas
+    for dia in _dias_arquivados(inicio, fim):
+        do_dia = set()
+        if predicado is None:
+            linhas = _ler_arquivo_do_dia(dia, leitura)
+        else:
+            linhas = (t if leitura is None else _projetar(t, leitura)
+                      for t in _ler_arquivo_do_dia(dia) if predicado(t))
+        for t in linhas:
+            id_tarefa = t.get('id')
+            if id_tarefa in vistos or id_tarefa in do_dia: continue
+            do_dia.add(id_tarefa)
+            if sem_id: t.pop('id')
+            yield t
+
+# --- MIGRAÇÃO DO FORMATO DOS ARQUIVOS ---
+# Converte arquivos antigos (versão 1) para VERSAO_FORMATO_TAREFAS linha a
+# linha, por um temporário + os.replace: nunca carrega o arquivo inteiro.
+
+def _migrar_arquivo_tarefas(caminho: str) -> bool:
+    """Reescreve um arquivo com cabeçalho (tarefas.txt ou um dia do arquivo) no formato atual."""
+    if not os.path.exists(caminho): return False
+    with open(caminho, 'r', encoding='utf-8') as f:
+        versao = _versao_do_cabecalho(f.readline())
+        if versao == VERSAO_FORMATO_TAREFAS: return False
+        def _linhas():
+            yield _cabecalho_tarefas()
+            for linha in f:
+                linha = linha.rstrip('\n')
+                if linha: yield _tarefa_para_linha(_linha_para_tarefa(linha, versao)) + '\n'
+        arquivos.escrever_atomico(caminho, _linhas())
+    return True
+
+def _migrar_journal_tarefas() -> bool:
+    if not os.path.exists(ARQUIVO_JOURNAL_TAREFAS): return False
+    with open(ARQUIVO_JOURNAL_TAREFAS, 'r', encoding='utf-8') as f:
+        primeira = f.readline()
+        if primeira.startswith('V|'): return False
+        f.seek(0)
+        def _linhas():
+            yield f'V|{VERSAO_FORMATO_TAREFAS}\n'
+            for linha in f:
+                if not linha.endswith('\n'): break  # linha incompleta: não é aplicada na leitura
+                linha = linha[:-1]
+                if linha.startswith('U|'):
+                    yield 'U|' + _tarefa_para_linha(_linha_para_tarefa(linha[2:], 1)) + '\n'
+                elif linha.startswith('D|'):
+                    yield 'D|' + _escape(_unescape(linha[2:], 1)) + '\n'
+        arquivos.escrever_atomico(ARQUIVO_JOURNAL_TAREFAS, _linhas())
+    return True
+
+def migrar_formato_tarefas() -> list:
+    """Converte tarefas.txt, o journal e o arquivo de encerrados para o formato atual. Retorna os arquivos convertidos."""
+    convertidos = []
+    with arquivos.trava(ARQUIVO_TAREFAS):
+        if _migrar_arquivo_tarefas(ARQUIVO_TAREFAS): convertidos.append(ARQUIVO_TAREFAS)
+        if _migrar_journal_tarefas(): convertidos.append(ARQUIVO_JOURNAL_TAREFAS)
+        if os.path.isdir(PASTA_ARQUIVO_TAREFAS):
+            for nome in sorted(os.listdir(PASTA_ARQUIVO_TAREFAS)):
+                if not (nome.endswith('.txt') and nome[:-4].isdigit()): continue
+                caminho = os.path.join(PASTA_ARQUIVO_TAREFAS, nome)
+                if _migrar_arquivo_tarefas(caminho): convertidos.append(caminho)
+    limpar_cache_tarefas()
+    return convertidos
 
 # --- PERSISTÊNCIA DE PACIENTES (Simples) ---
 def _carregar_pacientes() -> list:
@@ -98,7 +1261,7 @@ def _hora_atual():
     return datetime.now().strftime("%H:%M")
 
 def _buscar_tarefa_por_id(id_tarefa: str, tarefas: list = None):
-    if tarefas is None: tarefas = _carregar_tarefas()
+    if tarefas is None: return _repositorio_tarefas().obter(id_tarefa)
     for t in tarefas:
         if t['id'] == id_tarefa: return t
     return None
@@ -125,9 +1288,10 @@ def criar_tarefa_manual(usuario_logado: dict):
         "data_criacao": _data_atual(),
         "paciente_nome": "Interno"
     }
-    tarefas = _carregar_tarefas()
-    tarefas.append(nova_tarefa)
-    _salvar_tarefas(tarefas)
+    with transacao_tarefas():
+        tarefas = _carregar_tarefas()
+        tarefas.append(nova_tarefa)
+        _salvar_tarefas(tarefas)
     print("✓ Tarefa criada.")
 
 def editar_tarefa(usuario_logado: dict):
@@ -147,8 +1311,14 @@ def editar_tarefa(usuario_logado: dict):
         if idx < 0: return
         alvo = meus_itens[idx]
         novo_titulo = input(f"Título [{alvo['titulo']}]: ")
-        if novo_titulo: alvo['titulo'] = novo_titulo
-        _salvar_tarefas(tarefas)
+        if novo_titulo:
+            # Relê dentro da trava: o que outro processo gravou enquanto o
+            # usuário digitava não se perde
+            with transacao_tarefas():
+                tarefas = _carregar_tarefas()
+                for t in tarefas:
+                    if t['id'] == alvo['id']: t['titulo'] = novo_titulo
+                _salvar_tarefas(tarefas)
         print("✓ Editado.")
     except: pass
 
@@ -164,8 +1334,9 @@ def excluir_tarefa(usuario_logado: dict):
         idx = int(input("Número para excluir: ")) - 1
         if idx < 0: return
         alvo = meus_itens[idx]
-        tarefas = [t for t in tarefas if t['id'] != alvo['id']]
-        _salvar_tarefas(tarefas)
+        with transacao_tarefas():
+            tarefas = [t for t in _carregar_tarefas() if t['id'] != alvo['id']]
+            _salvar_tarefas(tarefas)
         print("✓ Excluído.")
     except: pass
 
@@ -181,7 +1352,6 @@ def criar_paciente(usuario_logado: dict, nome: str, cpf: str,
 
 def _criar_fluxo_atendimento(paciente_id: str, nome_paciente: str, 
                              tipo_atendimento: str, usuario_criador: dict):
-    tarefas = _carregar_tarefas()
     hoje = _data_atual()
     
     # Cria as tarefas encadeadas
@@ -196,19 +1366,20 @@ def _criar_fluxo_atendimento(paciente_id: str, nome_paciente: str,
           "prazo": hoje, "prioridade": "Normal", "status": STATUS_PENDENTE, 
           "dependencia": t1['id'], "data_criacao": hoje}
           
-    tarefas.extend([t1, t2])
-    _salvar_tarefas(tarefas)
+    with transacao_tarefas():
+        tarefas = _carregar_tarefas()
+        tarefas.extend([t1, t2])
+        _salvar_tarefas(tarefas)
 
 # --- FUNÇÕES DE LISTAGEM E VISUALIZAÇÃO (REIMPLEMENTADAS) ---
 
 def listar_tarefas_por_setor(usuario_logado):
     """Lista tarefas específicas do setor do usuário logado."""
-    tarefas = _carregar_tarefas()
     setor_user = str(usuario_logado['setor']).lower()
     
     print(f"\n--- TAREFAS: {setor_user.upper()} ---")
     encontrou = False
-    for t in tarefas:
+    for t in buscar_tarefas_por_setor(setor_user):
         if str(t.get('setor')).lower() == setor_user:
             encontrou = True
             status = t.get('status')
@@ -239,10 +1410,14 @@ def concluir_tarefa_setor(usuario_logado):
         if idx < 0: return
         selecionada = pendentes[idx]
         
-        selecionada['status'] = STATUS_CONCLUIDA
-        selecionada['data_conclusao'] = _data_atual()
-        selecionada['concluida_por'] = usuario_logado['id']
-        _salvar_tarefas(tarefas)
+        with transacao_tarefas():
+            tarefas = _carregar_tarefas()
+            for t in tarefas:
+                if t['id'] == selecionada['id']:
+                    t['status'] = STATUS_CONCLUIDA
+                    t['data_conclusao'] = _data_atual()
+                    t['concluida_por'] = usuario_logado['id']
+            _salvar_tarefas(tarefas)
         print("✓ Tarefa concluída!")
     except: pass
 
@@ -251,8 +1426,6 @@ def exibir_fila_por_setor():
     Mostra um painel geral de todas as filas do hospital.
     Ideal para ver onde os pacientes estão parados.
     """
-    tarefas = _carregar_tarefas()
-    
     # Define a ordem lógica do fluxo hospitalar
     setores_ordem = ['recepção', 'enfermagem', 'médico', 'farmácia']
     
@@ -265,7 +1438,7 @@ def exibir_fila_por_setor():
     for setor in setores_ordem:
         # Filtra tarefas pendentes deste setor
         fila_setor = [
-            t for t in tarefas 
+            t for t in buscar_tarefas_por_setor(setor, STATUS_PENDENTE)
             if str(t.get('setor')).lower() == setor 
             and t.get('status') == STATUS_PENDENTE
         ]
@@ -331,4 +1504,14 @@ def dispensar_medicamento(u): concluir_tarefa_setor(u)
 def administrar_medicamento(u): concluir_tarefa_setor(u)
 def verificar_paciente(u): concluir_tarefa_setor(u)
 def dar_alta_paciente(u): concluir_tarefa_setor(u)
-def solicitar_exames(u): print("Funcionalidade em breve.")
\ No newline at end of file
+def solicitar_exames(u): print("Funcionalidade em breve.")
+
+if __name__ == '__main__':
+    # python tarefas.py          -> arquiva atendimentos encerrados (cron, ex.: uma vez por dia)
+    # python tarefas.py migrar   -> converte arquivos antigos para o formato atual
+    if sys.argv[1:] == ['migrar']:
+        convertidos = migrar_formato_tarefas()
+        print(f"Arquivos convertidos para a versão {VERSAO_FORMATO_TAREFAS}: {len(convertidos)}")
+        for caminho in convertidos: print(f"  {caminho}")
+    else:
+        print(f"Tarefas arquivadas: {arquivar_tarefas_concluidas()}")
@@ -0,0 +1,71 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from utils import arquivos
+from web import medicos
+
+
+class TestArquivoMapeado(unittest.TestCase):
+
+    def setUp(self):
+        self.pasta = tempfile.mkdtemp()
+        self.arquivo = os.path.join(self.pasta, 'dados.txt')
+        with open(self.arquivo, 'w', encoding='utf-8', newline='') as f:
+            f.write('id|nome|setor\r\n'
+                    'a1|Ana|médico\n'
+                    '\n'
+                    '  a2|Bruno|None  \n'
+                    'a3|Célia\n'
+                    'a10|Dora|farmácia')
+
+    def tearDown(self):
+        arquivos._mapeados.clear()
+        shutil.rmtree(self.pasta, ignore_errors=True)
+
+    def test_mesmos_registros_que_carregar_dados(self):
+        mapeado = arquivos.ArquivoMapeado(self.arquivo)
+        self.assertEqual(len(mapeado), 4)
+        self.assertEqual(list(mapeado), arquivos.carregar_dados(self.arquivo))
+        self.assertEqual(mapeado[1], {'id': 'a2', 'nome': 'Bruno', 'setor': None})
+        self.assertEqual(mapeado[-1]['nome'], 'Dora')
+        self.assertEqual([r['id'] for r in mapeado[1:3]], ['a2', 'a3'])
+        with self.assertRaises(IndexError):
+            mapeado[4]
+
+    def test_busca_compara_so_o_campo(self):
+        mapeado = arquivos.ArquivoMapeado(self.arquivo)
+        with patch.object(mapeado, '_registro', wraps=mapeado._registro) as registro:
+            self.assertEqual(mapeado.buscar('id', 'a10')['setor'], 'farmácia')
+        self.assertEqual(registro.call_count, 1)
+        self.assertEqual(mapeado.buscar('nome', 'Célia')['id'], 'a3')
+        self.assertIsNone(mapeado.buscar('id', 'a'))
+        self.assertIsNone(mapeado.buscar('inexistente', 'a1'))
+
+    def test_arquivo_ausente_ou_vazio(self):
+        self.assertEqual(len(arquivos.ArquivoMapeado(os.path.join(self.pasta, 'nao_existe.txt'))), 0)
+        vazio = os.path.join(self.pasta, 'vazio.txt')
+        arquivos.salvar_dados([], vazio)
+        self.assertEqual(list(arquivos.ArquivoMapeado(vazio)), [])
+
+    def test_reaproveitado_ate_o_arquivo_mudar(self):
+        mapeado = arquivos.abrir_mapeado(self.arquivo)
+        self.assertIs(arquivos.abrir_mapeado(self.arquivo), mapeado)
+
+        arquivos.salvar_dados([{'id': 'b1', 'nome': 'Eva'}], self.arquivo)
+        novo = arquivos.abrir_mapeado(self.arquivo)
+        self.assertIsNot(novo, mapeado)
+        self.assertEqual(list(novo), [{'id': 'b1', 'nome': 'Eva'}])
+        self.assertEqual(mapeado[0]['id'], 'a1')  # o mapeamento antigo continua íntegro
+
+    def test_obter_medico(self):
+        with patch.object(medicos, 'MEDICOS_FILE', os.path.join(self.pasta, 'medicos.txt')):
+            medicos.criar_medicos_exemplo()
+            self.assertEqual(medicos.obter_medico('med003')['nome'], 'Dr. João Oliveira')
+            self.assertIsNone(medicos.obter_medico('med999'))
+
+
+if __name__ == '__main__':
+    unittest.main()
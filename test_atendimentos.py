@@ -0,0 +1,278 @@
+import gzip
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+from unittest.mock import patch
+
+from utils import arquivos
+from web import atendimentos
+
+
+def _emitir_senhas(pasta, quantidade, fila):
+    atendimentos.ARQUIVO_SENHAS = os.path.join(pasta, 'senhas.txt')
+    fila.put([atendimentos._REPOSITORIO_TEXTO.proxima_senha('01/02/2026') for _ in range(quantidade)])
+
+
+class _BaseAtendimentos(unittest.TestCase):
+    NOMES = ['PASTA_ATENDIMENTOS', 'ARQUIVO_ATENDIMENTOS', 'ARQUIVO_EVENTOS', 'ARQUIVO_SENHAS',
+             'EVENTOS_POR_SNAPSHOT']
+
+    def setUp(self):
+        self.pasta = tempfile.mkdtemp()
+        self.originais = [getattr(atendimentos, nome) for nome in self.NOMES]
+        for nome in self.NOMES[:-1]:
+            setattr(atendimentos, nome, os.path.join(self.pasta, nome.lower()))
+        atendimentos.limpar_cache_atendimentos()
+        self.hoje = datetime.now().strftime('%Y%m%d')
+
+    def tearDown(self):
+        for nome, original in zip(self.NOMES, self.originais):
+            setattr(atendimentos, nome, original)
+        atendimentos.limpar_cache_atendimentos()
+        shutil.rmtree(self.pasta, ignore_errors=True)
+
+    def _particao_de_hoje(self, sufixo='jsonl'):
+        return atendimentos._caminho(self.hoje, sufixo)
+
+    def _anexar_de_outro_processo(self, registro, sufixo='jsonl'):
+        os.makedirs(atendimentos.PASTA_ATENDIMENTOS, exist_ok=True)
+        with open(self._particao_de_hoje(sufixo), 'a', encoding='utf-8') as f:
+            f.write(json.dumps(registro) + '\n')
+
+
+class TestIndiceAtendimentos(_BaseAtendimentos):
+
+    def test_consulta_por_token_sem_ler_o_arquivo_todo(self):
+        criados = [atendimentos.criar_atendimento(str(i), f'Paciente {i}', 'dr1', 'Cardiologia')
+                   for i in range(5)]
+
+        with patch.object(atendimentos._RepositorioAtendimentosTexto, 'carregar') as carregar:
+            for a in criados:
+                self.assertEqual(atendimentos.obter_atendimento(a['token'])['nome_paciente'], a['nome_paciente'])
+            self.assertIsNone(atendimentos.obter_atendimento('inexistente'))
+        carregar.assert_not_called()
+
+    def test_linhas_anexadas_entram_no_indice_incrementalmente(self):
+        primeiro = atendimentos.criar_atendimento('1', 'Ana', 'dr1', 'Cardiologia')
+        atendimentos.obter_atendimento(primeiro['token'])
+        particao = atendimentos._particao(self.hoje)
+        offset = particao.checkins['offset']
+
+        self._anexar_de_outro_processo({'token': 'tk-novo', 'nome_paciente': 'Bia'})
+        self.assertEqual(atendimentos.obter_atendimento('tk-novo')['nome_paciente'], 'Bia')
+        self.assertEqual(particao.posicoes['tk-novo'], offset)
+
+    def test_linha_incompleta_fica_para_depois(self):
+        self._anexar_de_outro_processo({'token': 'a', 'nome_paciente': 'Ana'})
+        with open(self._particao_de_hoje(), 'a', encoding='utf-8') as f:
+            f.write('{"token": "b", "nome_pac')
+        self.assertIsNone(atendimentos.obter_atendimento('b'))
+
+        with open(self._particao_de_hoje(), 'a', encoding='utf-8') as f:
+            f.write('iente": "Bia"}\n')
+        self.assertEqual(atendimentos.obter_atendimento('b')['nome_paciente'], 'Bia')
+
+    def test_arquivo_rotacionado_ou_truncado_refaz_o_indice(self):
+        self._anexar_de_outro_processo({'token': 'velho', 'nome_paciente': 'Ana'})
+        self.assertIsNotNone(atendimentos.obter_atendimento('velho'))
+
+        # Rotação: arquivo novo no lugar
+        os.rename(self._particao_de_hoje(), self._particao_de_hoje() + '.1')
+        self._anexar_de_outro_processo({'token': 'novo', 'nome_paciente': 'Bia'})
+        self.assertIsNone(atendimentos.obter_atendimento('velho'))
+        self.assertEqual(atendimentos.obter_atendimento('novo')['nome_paciente'], 'Bia')
+
+        # Truncamento no mesmo arquivo
+        with open(self._particao_de_hoje(), 'w', encoding='utf-8'):
+            pass
+        self.assertIsNone(atendimentos.obter_atendimento('novo'))
+
+
+class TestSenhasAtendimento(_BaseAtendimentos):
+
+    def test_senha_sequencial_sem_ler_o_historico(self):
+        primeiro = atendimentos.criar_atendimento('1', 'Ana', 'dr1', 'Cardiologia')
+        with patch.object(atendimentos._RepositorioAtendimentosTexto, 'carregar') as carregar:
+            segundo = atendimentos.criar_atendimento('2', 'Bia', 'dr1', 'Cardiologia')
+        carregar.assert_not_called()
+
+        self.assertTrue(primeiro['senha'].endswith('-001'))
+        self.assertTrue(segundo['senha'].endswith('-002'))
+        self.assertEqual(segundo['posicao_fila'], 2)
+
+    def test_contador_recomeca_a_cada_dia(self):
+        repo = atendimentos._REPOSITORIO_TEXTO
+        self.assertEqual([repo.proxima_senha('01/02/2026') for _ in range(3)], [1, 2, 3])
+        self.assertEqual(repo.proxima_senha('02/02/2026'), 1)
+
+    def test_primeiro_uso_continua_a_contagem_do_dia(self):
+        for token in ('a', 'b'):
+            atendimentos._salvar_atendimento({'token': token, 'data_checkin': '01/02/2026 08:00'})
+        atendimentos._salvar_atendimento({'token': 'c', 'data_checkin': '31/01/2026 08:00'})
+        self.assertEqual(atendimentos._REPOSITORIO_TEXTO.proxima_senha('01/02/2026'), 3)
+
+    @unittest.skipIf(arquivos.fcntl is None, 'fcntl indisponível nesta plataforma')
+    def test_totens_simultaneos_nao_repetem_senha(self):
+        contexto = multiprocessing.get_context('fork')
+        fila = contexto.Queue()
+        processos = [contexto.Process(target=_emitir_senhas, args=(self.pasta, 20, fila)) for _ in range(5)]
+        for p in processos:
+            p.start()
+        senhas = [s for _ in processos for s in fila.get(timeout=30)]
+        for p in processos:
+            p.join(timeout=30)
+        self.assertEqual(sorted(senhas), list(range(1, 101)))
+
+
+class TestStatusAtendimento(_BaseAtendimentos):
+
+    def setUp(self):
+        super().setUp()
+        self.token = atendimentos.criar_atendimento('1', 'Ana', 'dr1', 'Cardiologia')['token']
+
+    def test_status_vira_evento_anexado(self):
+        with open(self._particao_de_hoje(), 'rb') as f:
+            checkin = f.read()
+        atendimentos.atualizar_status_atendimento(self.token, 'em_atendimento', 'medico')
+        atendimentos.atualizar_status_atendimento(self.token, 'em_atendimento', 'farmacia')
+
+        with open(self._particao_de_hoje(), 'rb') as f:
+            self.assertEqual(f.read(), checkin)
+        with open(self._particao_de_hoje('eventos.jsonl'), encoding='utf-8') as f:
+            self.assertEqual([json.loads(l)['etapa'] for l in f], ['medico', 'farmacia'])
+
+        self.assertEqual(atendimentos.obter_status_atendimento(self.token)['etapa'], 'farmacia')
+        atendimento = atendimentos.obter_atendimento(self.token)
+        self.assertEqual((atendimento['status'], atendimento['etapa']), ('em_atendimento', 'farmacia'))
+        self.assertEqual(atendimentos._carregar_atendimentos()[0]['etapa'], 'farmacia')
+
+    def test_eventos_de_outro_worker_sao_lidos_incrementalmente(self):
+        atendimentos.atualizar_status_atendimento(self.token, 'em_atendimento', 'medico')
+        self.assertEqual(atendimentos.obter_status_atendimento(self.token)['etapa'], 'medico')
+        particao = atendimentos._particao(self.hoje)
+        offset = particao.eventos['offset']
+
+        self._anexar_de_outro_processo({'token': self.token, 'status': 'concluido', 'etapa': 'concluido'},
+                                       'eventos.jsonl')
+        self.assertEqual(atendimentos.obter_status_atendimento(self.token)['status'], 'concluido')
+        self.assertGreater(particao.eventos['offset'], offset)
+
+    def test_snapshot_encurta_a_releitura(self):
+        atendimentos.EVENTOS_POR_SNAPSHOT = 3
+        for etapa in ('medico', 'farmacia', 'enfermagem'):
+            atendimentos.atualizar_status_atendimento(self.token, 'em_atendimento', etapa)
+        atendimentos.obter_status_atendimento(self.token)
+        atendimentos._snapshot_estados['thread'].join(timeout=5)
+        atendimentos.atualizar_status_atendimento(self.token, 'concluido', 'concluido')
+
+        # Worker novo: parte do snapshot e só relê o evento posterior a ele
+        atendimentos.limpar_cache_atendimentos()
+        with patch.object(atendimentos._Particao, '_ler_snapshot', autospec=True,
+                          side_effect=atendimentos._Particao._ler_snapshot) as ler:
+            self.assertEqual(atendimentos.obter_status_atendimento(self.token)['etapa'], 'concluido')
+        self.assertEqual(ler.call_count, 1)
+        self.assertEqual(atendimentos._particao(self.hoje).desde_snapshot, 1)
+        with open(self._particao_de_hoje('estados.json'), encoding='utf-8') as f:
+            snapshot = json.load(f)
+        self.assertEqual(snapshot['estados'][self.token]['etapa'], 'enfermagem')
+        self.assertLess(snapshot['offset'], os.path.getsize(self._particao_de_hoje('eventos.jsonl')))
+
+    def test_snapshot_de_outro_arquivo_e_ignorado(self):
+        atendimentos.atualizar_status_atendimento(self.token, 'em_atendimento', 'medico')
+        atendimentos.gravar_snapshot_estados()
+
+        os.remove(self._particao_de_hoje('eventos.jsonl'))
+        atendimentos.atualizar_status_atendimento(self.token, 'em_atendimento', 'farmacia')
+        atendimentos.limpar_cache_atendimentos()
+        self.assertEqual(atendimentos.obter_status_atendimento(self.token)['etapa'], 'farmacia')
+
+
+class TestParticoesAtendimento(_BaseAtendimentos):
+
+    def _checkin_antigo(self, token, data='01/01/2020 08:00'):
+        atendimentos._salvar_atendimento({'token': token, 'nome_paciente': token.title(),
+                                          'data_checkin': data, 'status': 'em_andamento'})
+
+    def test_cada_dia_tem_sua_particao(self):
+        self._checkin_antigo('antigo')
+        hoje = atendimentos.criar_atendimento('1', 'Ana', 'dr1', 'Cardiologia')
+
+        self.assertEqual(atendimentos._dias_existentes(), ['20200101', self.hoje])
+        with open(atendimentos._caminho('20200101', 'jsonl'), encoding='utf-8') as f:
+            self.assertEqual([json.loads(l)['token'] for l in f], ['antigo'])
+
+        # Token de hoje não passa pelo índice de dias; o antigo passa
+        with patch.object(atendimentos, '_dia_indexado', wraps=atendimentos._dia_indexado) as indice:
+            self.assertEqual(atendimentos.obter_atendimento(hoje['token'])['nome_paciente'], 'Ana')
+            indice.assert_not_called()
+            self.assertEqual(atendimentos.obter_atendimento('antigo')['nome_paciente'], 'Antigo')
+            indice.assert_called_once_with('antigo')
+
+        atendimentos.atualizar_status_atendimento('antigo', 'concluido', 'concluido')
+        self.assertTrue(os.path.exists(atendimentos._caminho('20200101', 'eventos.jsonl')))
+        self.assertEqual(atendimentos.obter_status_atendimento('antigo')['status'], 'concluido')
+
+    def test_rotacao_arquiva_em_gzip_e_continua_legivel(self):
+        self._checkin_antigo('antigo')
+        atendimentos.atualizar_status_atendimento('antigo', 'em_atendimento', 'medico')
+        atendimentos.criar_atendimento('1', 'Ana', 'dr1', 'Cardiologia')
+
+        self.assertEqual(atendimentos.rotacionar_atendimentos(dias=7), ['20200101'])
+        self.assertFalse(os.path.exists(atendimentos._caminho('20200101', 'jsonl')))
+        with gzip.open(atendimentos._caminho('20200101', 'jsonl') + '.gz', 'rt', encoding='utf-8') as f:
+            self.assertEqual(json.loads(f.readline())['token'], 'antigo')
+        self.assertTrue(os.path.exists(self._particao_de_hoje()))
+
+        self.assertEqual(atendimentos.obter_atendimento('antigo')['etapa'], 'medico')
+        self.assertEqual([a['nome_paciente'] for a in atendimentos.iterar_atendimentos()], ['Antigo', 'Ana'])
+
+        # Evento depois do arquivamento: novo arquivo ao lado do .gz, somado na próxima rotação
+        atendimentos.atualizar_status_atendimento('antigo', 'concluido', 'concluido')
+        self.assertEqual(atendimentos.obter_status_atendimento('antigo')['status'], 'concluido')
+        self.assertEqual(atendimentos.rotacionar_atendimentos(dias=7), ['20200101'])
+        atendimentos.limpar_cache_atendimentos()
+        self.assertEqual(atendimentos.obter_atendimento('antigo')['status'], 'concluido')
+
+    def test_indice_de_tokens_ordenado_consultado_por_busca_binaria(self):
+        for i in range(20):
+            self._checkin_antigo(f'tk{i:02d}', f'{i % 9 + 1:02d}/01/2020 08:00')
+        self.assertEqual(atendimentos.ordenar_indice_tokens(), 20)
+        self._checkin_antigo('depois', '15/01/2020 08:00')
+        atendimentos.limpar_cache_atendimentos()
+
+        self.assertEqual(atendimentos._dia_indexado('tk13'), '20200105')
+        self.assertEqual(atendimentos.obter_atendimento('tk00')['nome_paciente'], 'Tk00')
+        self.assertEqual(atendimentos.obter_atendimento('depois')['nome_paciente'], 'Depois')
+        self.assertIsNone(atendimentos._dia_indexado('tk20'))
+        self.assertIsNone(atendimentos._dia_indexado('inexistente-e-mais-longo-que-todos'))
+        # Em memória só a cauda anexada depois do tokens.ord
+        self.assertEqual(atendimentos._indice['dias'], {'depois': '20200115'})
+
+        # tokens.idx trocado (outro inode): o tokens.ord antigo deixa de valer
+        with open(atendimentos._arquivo_indice_tokens(), encoding='utf-8') as f:
+            linhas = f.readlines()
+        arquivos.escrever_atomico(atendimentos._arquivo_indice_tokens(), linhas[:1] + ['novo|20200120\n'])
+        self.assertEqual(atendimentos._dia_indexado('novo'), '20200120')
+        self.assertIsNone(atendimentos._dia_indexado('tk13'))
+        self.assertEqual(atendimentos._dia_indexado('tk00'), '20200101')
+
+    def test_arquivo_unico_antigo_e_migrado(self):
+        with open(atendimentos.ARQUIVO_ATENDIMENTOS, 'w', encoding='utf-8') as f:
+            for token, data in (('a', '01/01/2020 08:00'), ('b', '02/01/2020 09:00')):
+                f.write(json.dumps({'token': token, 'data_checkin': data, 'status': 'em_andamento'}) + '\n')
+        with open(atendimentos.ARQUIVO_EVENTOS, 'w', encoding='utf-8') as f:
+            f.write(json.dumps({'token': 'b', 'status': 'concluido', 'etapa': 'concluido'}) + '\n')
+
+        self.assertEqual(atendimentos.obter_atendimento('b')['status'], 'concluido')
+        self.assertEqual(atendimentos._dias_existentes(), ['20200101', '20200102'])
+        self.assertFalse(os.path.exists(atendimentos.ARQUIVO_ATENDIMENTOS))
+        self.assertTrue(os.path.exists(atendimentos.ARQUIVO_ATENDIMENTOS + '.migrado'))
+        self.assertEqual([a['token'] for a in atendimentos._carregar_atendimentos()], ['a', 'b'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,243 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import tarefas
+import usuarios
+from utils import arquivos
+
+PROCESSOS = 6
+OPERACOES = 15
+
+
+def _inserir_tarefas(pasta, usar_journal, numero):
+    tarefas.ARQUIVO_TAREFAS = os.path.join(pasta, 'tarefas.txt')
+    tarefas.ARQUIVO_JOURNAL_TAREFAS = os.path.join(pasta, 'tarefas.journal')
+    tarefas.USAR_JOURNAL = usar_journal
+    tarefas.LIMITE_JOURNAL_BYTES = 2048  # força compactações no meio do teste
+    tarefas.limpar_cache_tarefas()
+    for i in range(OPERACOES):
+        with tarefas.transacao_tarefas():
+            lista = tarefas._carregar_tarefas()
+            lista.append({'id': f'p{numero}-{i}', 'titulo': f'T {numero} {i}',
+                          'setor': 'recepção', 'status': tarefas.STATUS_PENDENTE})
+            tarefas._salvar_tarefas(lista)
+    thread = tarefas._compactacao['thread']
+    if thread is not None:
+        thread.join(timeout=5)
+
+
+def _cadastrar_usuarios(pasta, numero):
+    usuarios.USUARIOS_FILE = os.path.join(pasta, 'usuarios.txt')
+    usuarios.usuarios.clear()
+    for i in range(OPERACOES):
+        usuarios.cadastrar_usuario(f'U {numero} {i}', f'u{numero}_{i}', 'u@x.com', '123', 'Recepção')
+
+
+def _reescrever_dados(arquivo, numero):
+    for i in range(OPERACOES):
+        with arquivos.trava(arquivo):
+            dados = arquivos.carregar_dados(arquivo)
+            dados.append({'id': f'{numero}-{i}', 'texto': 'x' * 200})
+            arquivos.salvar_dados(dados, arquivo)
+
+
+def _ler_dados(arquivo, fila):
+    # Sem trava de escrita: só confere que nunca vê arquivo pela metade
+    for _ in range(OPERACOES * 4):
+        for registro in arquivos.carregar_dados(arquivo):
+            if registro['texto'] != 'x' * 200:
+                fila.put('registro truncado')
+                return
+    fila.put('ok')
+
+
+@unittest.skipIf(arquivos.fcntl is None, 'fcntl indisponível nesta plataforma')
+class TestConcorrenciaEntreProcessos(unittest.TestCase):
+
+    def setUp(self):
+        self.pasta = tempfile.mkdtemp()
+        self.contexto = multiprocessing.get_context('fork')
+
+    def tearDown(self):
+        shutil.rmtree(self.pasta, ignore_errors=True)
+
+    def _rodar(self, alvo, argumentos):
+        processos = [self.contexto.Process(target=alvo, args=args) for args in argumentos]
+        for p in processos:
+            p.start()
+        for p in processos:
+            p.join(timeout=60)
+            self.assertEqual(p.exitcode, 0)
+
+    def _conferir_tarefas(self, usar_journal):
+        self._rodar(_inserir_tarefas, [(self.pasta, usar_journal, n) for n in range(PROCESSOS)])
+
+        originais = (tarefas.ARQUIVO_TAREFAS, tarefas.ARQUIVO_JOURNAL_TAREFAS)
+        try:
+            tarefas.ARQUIVO_TAREFAS = os.path.join(self.pasta, 'tarefas.txt')
+            tarefas.ARQUIVO_JOURNAL_TAREFAS = os.path.join(self.pasta, 'tarefas.journal')
+            tarefas.limpar_cache_tarefas()
+            ids = [t['id'] for t in tarefas._carregar_tarefas()]
+        finally:
+            tarefas.ARQUIVO_TAREFAS, tarefas.ARQUIVO_JOURNAL_TAREFAS = originais
+            tarefas.limpar_cache_tarefas()
+
+        esperados = {f'p{n}-{i}' for n in range(PROCESSOS) for i in range(OPERACOES)}
+        self.assertEqual(len(ids), len(esperados))
+        self.assertEqual(set(ids), esperados)
+
+    def test_tarefas_sem_perda_de_atualizacao(self):
+        self._conferir_tarefas(usar_journal=False)
+
+    def test_tarefas_sem_perda_de_atualizacao_no_journal(self):
+        self._conferir_tarefas(usar_journal=True)
+
+    def test_cadastros_simultaneos_de_usuarios(self):
+        self._rodar(_cadastrar_usuarios, [(self.pasta, n) for n in range(PROCESSOS)])
+
+        originais = usuarios.USUARIOS_FILE
+        try:
+            usuarios.USUARIOS_FILE = os.path.join(self.pasta, 'usuarios.txt')
+            logins = {u['login'] for u in usuarios._repositorio_usuarios().carregar().values()}
+        finally:
+            usuarios.USUARIOS_FILE = originais
+        self.assertEqual(logins, {f'u{n}_{i}' for n in range(PROCESSOS) for i in range(OPERACOES)})
+
+    def test_leitores_nunca_veem_arquivo_pela_metade(self):
+        arquivo = os.path.join(self.pasta, 'dados.txt')
+        fila = self.contexto.Queue()
+        escritores = [self.contexto.Process(target=_reescrever_dados, args=(arquivo, n))
+                      for n in range(PROCESSOS)]
+        leitores = [self.contexto.Process(target=_ler_dados, args=(arquivo, fila)) for _ in range(2)]
+        for p in escritores + leitores:
+            p.start()
+        for p in escritores + leitores:
+            p.join(timeout=60)
+            self.assertEqual(p.exitcode, 0)
+
+        self.assertEqual([fila.get(timeout=5) for _ in leitores], ['ok', 'ok'])
+        self.assertEqual(len(arquivos.carregar_dados(arquivo)), PROCESSOS * OPERACOES)
+
+
+class TestDiretorioUsuarios(unittest.TestCase):
+
+    def setUp(self):
+        self.pasta = tempfile.mkdtemp()
+        self.originais = (usuarios.USUARIOS_FILE, dict(usuarios.usuarios))
+        usuarios.USUARIOS_FILE = os.path.join(self.pasta, 'usuarios.txt')
+        usuarios.usuarios.clear()
+        usuarios._load_usuarios_from_file()
+
+    def tearDown(self):
+        usuarios.USUARIOS_FILE = self.originais[0]
+        usuarios.usuarios.clear()
+        usuarios.usuarios.update(self.originais[1])
+        usuarios._load_usuarios_from_file()
+        shutil.rmtree(self.pasta, ignore_errors=True)
+
+    def _cadastro_de_outro_worker(self, login):
+        # Outro processo anexa um cadastro sem passar pela memória deste
+        outro = dict(usuarios._linha_para_usuario('|'.join(['id-' + login, login.title(), '', login, 'paciente', 'x'])))
+        with open(usuarios.USUARIOS_FILE, 'a', encoding='utf-8') as f:
+            f.write(usuarios._usuario_para_linha(outro) + '\n')
+
+    def test_cadastro_de_outro_worker_aparece_lendo_so_o_final(self):
+        usuarios.cadastrar_usuario('Ana', 'ana', 'ana@x.com', '123', 'Recepção')
+        tamanho = os.path.getsize(usuarios.USUARIOS_FILE)
+
+        self._cadastro_de_outro_worker('bia')
+        with patch.object(usuarios, '_ler_usuarios_desde', wraps=usuarios._ler_usuarios_desde) as ler:
+            self.assertEqual(usuarios.buscar_usuario_por_login('bia')['id'], 'id-bia')
+            self.assertIsNotNone(usuarios.buscar_usuario_por_login('ana'))
+        ler.assert_called_once_with(tamanho)
+
+    def test_propria_gravacao_nao_relê_o_arquivo(self):
+        usuarios.cadastrar_usuario('Ana', 'ana', 'ana@x.com', '123', 'Recepção')
+        with patch.object(usuarios, '_ler_usuarios_desde') as ler:
+            usuarios.cadastrar_usuario('Bia', 'bia', 'bia@x.com', '123', 'Paciente')
+            self.assertEqual(len(usuarios.listar_usuarios()), 2)
+        ler.assert_not_called()
+
+    def test_arquivo_trocado_e_relido_inteiro(self):
+        usuarios.cadastrar_usuario('Ana', 'ana', 'ana@x.com', '123', 'Recepção')
+        # Outro worker compactou o arquivo: reescrita atômica, novo inode
+        with open(usuarios.USUARIOS_FILE, encoding='utf-8') as f:
+            arquivos.escrever_atomico(usuarios.USUARIOS_FILE, [f.read()])
+        self._cadastro_de_outro_worker('bia')
+
+        with patch.object(usuarios, '_ler_usuarios_desde', wraps=usuarios._ler_usuarios_desde) as ler:
+            self.assertIsNotNone(usuarios.buscar_usuario_por_login('bia'))
+        ler.assert_called_once_with(0)
+
+    def test_arquivo_trocado_sem_um_usuario_tira_ele_da_memoria(self):
+        ana = usuarios.cadastrar_usuario('Ana', 'ana', 'ana@x.com', '123', 'Recepção')
+        bia = usuarios.cadastrar_usuario('Bia', 'bia', 'bia@x.com', '123', 'Médico')
+        # Outro worker regravou o arquivo sem a Ana
+        arquivos.escrever_atomico(usuarios.USUARIOS_FILE, [usuarios._usuario_para_linha(bia) + '\n'])
+
+        self.assertIsNone(usuarios.buscar_usuario_por_login('ana'))
+        self.assertIsNone(usuarios.obter_usuario(ana['id']))
+        self.assertEqual([u['id'] for u in usuarios.listar_usuarios()], [bia['id']])
+
+
+class TestCrudManualDeTarefas(unittest.TestCase):
+
+    def setUp(self):
+        self.pasta = tempfile.mkdtemp()
+        self.originais = (tarefas.ARQUIVO_TAREFAS, tarefas.ARQUIVO_JOURNAL_TAREFAS)
+        tarefas.ARQUIVO_TAREFAS = os.path.join(self.pasta, 'tarefas.txt')
+        tarefas.ARQUIVO_JOURNAL_TAREFAS = os.path.join(self.pasta, 'tarefas.journal')
+        tarefas.limpar_cache_tarefas()
+        tarefas._salvar_tarefas([{'id': 'a', 'titulo': 'Curativo', 'setor': 'enfermagem',
+                                  'status': tarefas.STATUS_PENDENTE}])
+        self.usuario = {'id': 'u1', 'setor': 'Enfermagem'}
+
+    def tearDown(self):
+        tarefas.ARQUIVO_TAREFAS, tarefas.ARQUIVO_JOURNAL_TAREFAS = self.originais
+        tarefas.limpar_cache_tarefas()
+        shutil.rmtree(self.pasta, ignore_errors=True)
+
+    def _outro_processo_cria_tarefa(self, resposta):
+        # Enquanto o usuário digita, outro processo grava uma tarefa nova
+        def digitar(_):
+            with tarefas.transacao_tarefas():
+                lista = tarefas._carregar_tarefas()
+                lista.append({'id': 'b', 'titulo': 'Outra', 'setor': 'médico',
+                              'status': tarefas.STATUS_PENDENTE})
+                tarefas._salvar_tarefas(lista)
+            return resposta
+        return digitar
+
+    def _por_id(self):
+        tarefas.limpar_cache_tarefas()
+        return {t['id']: t for t in tarefas._carregar_tarefas()}
+
+    def test_concluir_nao_apaga_tarefa_gravada_durante_a_digitacao(self):
+        with patch('builtins.input', side_effect=self._outro_processo_cria_tarefa('1')), \
+                patch('builtins.print'):
+            tarefas.concluir_tarefa_setor(self.usuario)
+
+        lidas = self._por_id()
+        self.assertEqual(sorted(lidas), ['a', 'b'])
+        self.assertEqual(lidas['a']['status'], tarefas.STATUS_CONCLUIDA)
+
+    def test_excluir_nao_apaga_tarefa_gravada_durante_a_digitacao(self):
+        with patch('builtins.input', side_effect=self._outro_processo_cria_tarefa('1')), \
+                patch('builtins.print'):
+            tarefas.excluir_tarefa(self.usuario)
+
+        self.assertEqual(sorted(self._por_id()), ['b'])
+
+    def test_trava_de_leitura_nao_vira_de_escrita(self):
+        with arquivos.trava(tarefas.ARQUIVO_TAREFAS, exclusiva=False):
+            with self.assertRaises(RuntimeError):
+                with tarefas.transacao_tarefas():
+                    pass
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,580 @@
+import io
+import os
+import random
+import shutil
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from datetime import date
+from unittest.mock import patch
+
+from benchmarks import memoria_tarefas
+import relatorios
+import tarefas
+
+
+class TestCacheTarefas(unittest.TestCase):
+
+    def setUp(self):
+        self.pasta = tempfile.mkdtemp()
+        self.arquivo_original = tarefas.ARQUIVO_TAREFAS
+        tarefas.ARQUIVO_TAREFAS = os.path.join(self.pasta, 'tarefas.txt')
+        tarefas.limpar_cache_tarefas()
+
+    def tearDown(self):
+        tarefas.ARQUIVO_TAREFAS = self.arquivo_original
+        tarefas.limpar_cache_tarefas()
+        shutil.rmtree(self.pasta, ignore_errors=True)
+
+    def _nova_tarefa(self, titulo, **extra):
+        tarefa = {'id': titulo.lower(), 'titulo': titulo, 'setor': 'enfermagem',
+                  'status': tarefas.STATUS_PENDENTE, 'sinais_vitais': {'pa': '12/8'}}
+        tarefa.update(extra)
+        return tarefa
+
+    def test_leitura_repetida_usa_cache(self):
+        tarefas._salvar_tarefas([self._nova_tarefa('A'), self._nova_tarefa('B')])
+        antes = tarefas.estatisticas_cache_tarefas()
+
+        primeira = tarefas._carregar_tarefas()
+        segunda = tarefas._carregar_tarefas()
+
+        depois = tarefas.estatisticas_cache_tarefas()
+        self.assertEqual(primeira, segunda)
+        self.assertEqual(depois['hits'] - antes['hits'], 2)
+        self.assertEqual(depois['misses'], antes['misses'])
+        self.assertEqual(primeira[0]['sinais_vitais'], {'pa': '12/8'})
+
+    def test_alterar_resultado_nao_corrompe_cache(self):
+        tarefas._salvar_tarefas([self._nova_tarefa('A')])
+
+        lista = tarefas._carregar_tarefas()
+        lista[0]['status'] = tarefas.STATUS_CONCLUIDA
+        lista[0]['sinais_vitais']['pa'] = '20/10'
+        lista.append(self._nova_tarefa('B'))
+
+        relida = tarefas._carregar_tarefas()
+        self.assertEqual(len(relida), 1)
+        self.assertEqual(relida[0]['status'], tarefas.STATUS_PENDENTE)
+        self.assertEqual(relida[0]['sinais_vitais'], {'pa': '12/8'})
+
+    def test_mudanca_externa_invalida_cache(self):
+        tarefas._salvar_tarefas([self._nova_tarefa('A')])
+        tarefas._carregar_tarefas()
+
+        with open(tarefas.ARQUIVO_TAREFAS, 'a', encoding='utf-8') as f:
+            f.write('|'.join(['externa', '', '', 'Externa']) + '\n')
+
+        misses = tarefas.estatisticas_cache_tarefas()['misses']
+        relida = tarefas._carregar_tarefas()
+        self.assertEqual([t['id'] for t in relida], ['a', 'externa'])
+        self.assertEqual(tarefas.estatisticas_cache_tarefas()['misses'], misses + 1)
+
+    def test_cache_igual_a_releitura(self):
+        tarefas._salvar_tarefas([self._nova_tarefa('A', prioridade=3, descricao='')])
+        do_cache = tarefas._carregar_tarefas()
+
+        tarefas.limpar_cache_tarefas()
+        do_disco = tarefas._carregar_tarefas()
+        self.assertEqual(do_cache, do_disco)
+
+
+class TestJournalTarefas(unittest.TestCase):
+
+    def setUp(self):
+        self.pasta = tempfile.mkdtemp()
+        self.originais = (tarefas.ARQUIVO_TAREFAS, tarefas.ARQUIVO_JOURNAL_TAREFAS,
+                          tarefas.USAR_JOURNAL, tarefas.LIMITE_JOURNAL_BYTES)
+        tarefas.ARQUIVO_TAREFAS = os.path.join(self.pasta, 'tarefas.txt')
+        tarefas.ARQUIVO_JOURNAL_TAREFAS = os.path.join(self.pasta, 'tarefas.journal')
+        tarefas.USAR_JOURNAL = True
+        tarefas.LIMITE_JOURNAL_BYTES = 1024 * 1024
+        tarefas.limpar_cache_tarefas()
+
+    def tearDown(self):
+        (tarefas.ARQUIVO_TAREFAS, tarefas.ARQUIVO_JOURNAL_TAREFAS,
+         tarefas.USAR_JOURNAL, tarefas.LIMITE_JOURNAL_BYTES) = self.originais
+        tarefas.limpar_cache_tarefas()
+        shutil.rmtree(self.pasta, ignore_errors=True)
+
+    def _reler_do_disco(self):
+        tarefas.limpar_cache_tarefas()
+        return tarefas._carregar_tarefas()
+
+    def test_alteracao_vira_append_no_journal(self):
+        tarefas._salvar_tarefas([{'id': 'a', 'titulo': 'A', 'status': tarefas.STATUS_PENDENTE}])
+
+        lista = tarefas._carregar_tarefas()
+        lista[0]['status'] = tarefas.STATUS_CONCLUIDA
+        lista.append({'id': 'b', 'titulo': 'B', 'status': tarefas.STATUS_PENDENTE})
+        tarefas._salvar_tarefas(lista)
+
+        self.assertFalse(os.path.exists(tarefas.ARQUIVO_TAREFAS))
+        with open(tarefas.ARQUIVO_JOURNAL_TAREFAS, encoding='utf-8') as f:
+            registros = f.read().splitlines()
+        self.assertEqual(registros[0], f'V|{tarefas.VERSAO_FORMATO_TAREFAS}')
+        self.assertEqual([r.split('|')[1] for r in registros[1:]], ['a', 'a', 'b'])
+
+        relidas = self._reler_do_disco()
+        self.assertEqual([(t['id'], t['status']) for t in relidas],
+                         [('a', tarefas.STATUS_CONCLUIDA), ('b', tarefas.STATUS_PENDENTE)])
+
+    def test_exclusao_vira_registro_de_remocao(self):
+        tarefas._salvar_tarefas([{'id': 'a', 'titulo': 'A'}, {'id': 'b', 'titulo': 'B'}])
+        tarefas._salvar_tarefas([t for t in tarefas._carregar_tarefas() if t['id'] != 'a'])
+
+        self.assertEqual([t['id'] for t in self._reler_do_disco()], ['b'])
+
+    def test_compactacao_gera_snapshot_no_formato_pipe(self):
+        tarefas._salvar_tarefas([{'id': 'a', 'titulo': 'A'}, {'id': 'b', 'titulo': 'B'}])
+        self.assertTrue(tarefas.compactar_journal_tarefas())
+
+        self.assertFalse(os.path.exists(tarefas.ARQUIVO_JOURNAL_TAREFAS))
+        with open(tarefas.ARQUIVO_TAREFAS, encoding='utf-8') as f:
+            self.assertEqual(f.readline(), tarefas._cabecalho_tarefas())
+        self.assertEqual([t['id'] for t in self._reler_do_disco()], ['a', 'b'])
+
+    def test_limite_dispara_compactacao_em_segundo_plano(self):
+        tarefas.LIMITE_JOURNAL_BYTES = 10
+        tarefas._salvar_tarefas([{'id': 'a', 'titulo': 'A'}])
+        tarefas._compactacao['thread'].join(timeout=5)
+
+        self.assertFalse(os.path.exists(tarefas.ARQUIVO_JOURNAL_TAREFAS))
+        self.assertEqual([t['id'] for t in self._reler_do_disco()], ['a'])
+
+
+class TestIndicesTarefas(unittest.TestCase):
+
+    def setUp(self):
+        self.pasta = tempfile.mkdtemp()
+        self.originais = (tarefas.ARQUIVO_TAREFAS, tarefas.ARQUIVO_JOURNAL_TAREFAS, tarefas.USAR_JOURNAL)
+        tarefas.ARQUIVO_TAREFAS = os.path.join(self.pasta, 'tarefas.txt')
+        tarefas.ARQUIVO_JOURNAL_TAREFAS = os.path.join(self.pasta, 'tarefas.journal')
+        tarefas.limpar_cache_tarefas()
+
+    def tearDown(self):
+        tarefas.ARQUIVO_TAREFAS, tarefas.ARQUIVO_JOURNAL_TAREFAS, tarefas.USAR_JOURNAL = self.originais
+        tarefas.limpar_cache_tarefas()
+        shutil.rmtree(self.pasta, ignore_errors=True)
+
+    def _conferir_com_busca_linear(self):
+        repo = tarefas._REPOSITORIO_TEXTO
+        linear = tarefas.repositorio.RepositorioTarefas
+        for token in ('tk0', 'tk1', 'tk2'):
+            self.assertEqual(repo.por_atendimento(token), linear.por_atendimento(repo, token))
+        for setor in ('recepção', 'médico', 'farmacia', 'enfermagem'):
+            self.assertEqual(repo.por_setor(setor), linear.por_setor(repo, setor))
+            for status in (tarefas.STATUS_PENDENTE, tarefas.STATUS_CONCLUIDA):
+                self.assertEqual(repo.por_setor(setor, status), linear.por_setor(repo, setor, status))
+            self.assertEqual(repo.por_setor_ou_responsavel(setor, 'u1'),
+                             linear.por_setor_ou_responsavel(repo, setor, 'u1'))
+        for pessoa in ('u1', 'u2', 'sistema'):
+            self.assertEqual(repo.por_responsavel(pessoa), linear.por_responsavel(repo, pessoa))
+        for incluir in (lambda setor, responsavel: True, lambda setor, responsavel: setor == 'medico',
+                        lambda setor, responsavel: responsavel == 'u1' or setor == 'farmacia'):
+            self.assertEqual(repo.contar(incluir), linear.contar(repo, incluir))
+            for quantidade in (1, 3, 10):
+                self.assertEqual(repo.recentes(incluir, quantidade), linear.recentes(repo, incluir, quantidade))
+            for filtros in ({}, {'setor': 'Médico'}, {'setor': 'enfermagem', 'status': 'pendente'},
+                            {'status': tarefas.STATUS_CONCLUIDA}, {'busca': 'tarefa 1'}):
+                self.assertEqual(self._paginas(repo.pagina, incluir, **filtros),
+                                 self._paginas(lambda *a, **f: linear.pagina(repo, *a, **f), incluir, **filtros))
+
+    def _paginas(self, pagina, incluir, **filtros):
+        """Ids de todas as páginas de 4, seguindo os cursores."""
+        paginas, apos = [], None
+        while True:
+            tarefas_pagina, apos = pagina(incluir, apos, 4, **filtros)
+            paginas.append([t['id'] for t in tarefas_pagina])
+            if apos is None:
+                return paginas
+
+    def _executar_fluxo(self):
+        setores = ['recepção', 'médico', 'farmácia', 'enfermagem']
+        lista = [
+            {'id': f't{i}', 'setor': setores[i % 4], 'status': tarefas.STATUS_PENDENTE,
+             'atendimento_token': f'tk{i % 3}', 'responsavel': 'sistema' if i % 2 else 'u1',
+             'data_criacao': f'{10 - i % 5:02d}/0{1 + i % 2}/2025', 'titulo': f'Tarefa {i}'}
+            for i in range(12)
+        ]
+        tarefas._salvar_tarefas(lista)
+        self._conferir_com_busca_linear()
+
+        lista = tarefas._carregar_tarefas()
+        lista[3]['status'] = tarefas.STATUS_CONCLUIDA
+        lista[3]['concluida_por'] = 'u2'
+        lista[5]['setor'] = 'Enfermagem'
+        del lista[7]
+        lista.append({'id': 'novo', 'setor': 'médico', 'status': tarefas.STATUS_PENDENTE,
+                      'atendimento_token': 'tk1', 'responsavel': 'u2'})
+        tarefas._salvar_tarefas(lista)
+        self._conferir_com_busca_linear()
+
+        # Reordenação força reconstrução completa dos índices
+        tarefas._salvar_tarefas(list(reversed(tarefas._carregar_tarefas())))
+        self._conferir_com_busca_linear()
+
+        tarefas.limpar_cache_tarefas()
+        self._conferir_com_busca_linear()
+
+    def test_indices_acompanham_gravacoes(self):
+        tarefas.USAR_JOURNAL = False
+        self._executar_fluxo()
+
+    def test_indices_acompanham_gravacoes_no_journal(self):
+        tarefas.USAR_JOURNAL = True
+        self._executar_fluxo()
+
+    def test_recentes_mantidas_com_lista_curta(self):
+        # Grupo bem maior que a lista: concluir, mudar de setor e apagar as
+        # recentes obriga a lista a se refazer sem perder a ordem
+        aleatorio = random.Random(7)
+        lista = [{'id': f't{i}', 'setor': aleatorio.choice(['médico', 'farmácia']), 'responsavel': 'sistema',
+                  'status': tarefas.STATUS_PENDENTE, 'data_criacao': f'{aleatorio.randint(1, 28):02d}/03/2025'}
+                 for i in range(40)]
+        with patch.object(tarefas, 'TAMANHO_RECENTES', 3):
+            tarefas._salvar_tarefas(lista)
+            for passo in range(30):
+                lista = tarefas._carregar_tarefas()
+                recentes = tarefas.resumo_tarefas(lambda setor, responsavel: setor == 'medico', 3)[2]
+                alvo = next(t for t in lista if t['id'] == recentes[0]['id']) if recentes else aleatorio.choice(lista)
+                if passo % 3 == 0:
+                    alvo['status'] = tarefas.STATUS_CONCLUIDA
+                elif passo % 3 == 1:
+                    alvo['setor'] = 'farmácia'
+                else:
+                    lista.remove(alvo)
+                lista.append({'id': f'n{passo}', 'setor': 'médico', 'responsavel': 'sistema',
+                              'status': tarefas.STATUS_PENDENTE, 'data_criacao': f'{passo % 28 + 1:02d}/03/2025'})
+                tarefas._salvar_tarefas(lista)
+                self._conferir_com_busca_linear()
+
+    def test_resumo_tarefas(self):
+        tarefas._salvar_tarefas([
+            {'id': 'a', 'setor': 'Farmácia', 'status': tarefas.STATUS_CONCLUIDA, 'data_criacao': '02/01/2025'},
+            {'id': 'b', 'setor': 'farmacia', 'status': tarefas.STATUS_PENDENTE, 'data_criacao': '31/12/2024'},
+            {'id': 'c', 'setor': 'médico', 'status': tarefas.STATUS_PENDENTE, 'data_criacao': '02/01/2025',
+             'responsavel': 'dr1'},
+        ])
+        total, concluidas, recentes = tarefas.resumo_tarefas()
+        self.assertEqual((total, concluidas), (3, 1))
+        # Pela data de verdade (não pela string dd/mm) e, no mesmo dia, a criada por último primeiro
+        self.assertEqual([t['id'] for t in recentes], ['c', 'a', 'b'])
+        total, concluidas, recentes = tarefas.resumo_tarefas(lambda setor, responsavel: setor == 'farmacia', 1)
+        self.assertEqual((total, concluidas, [t['id'] for t in recentes]), (2, 1, ['a']))
+        self.assertEqual(tarefas.resumo_tarefas(lambda setor, responsavel: responsavel == 'dr1')[:2], (1, 0))
+
+    def test_pagina_pelo_indice(self):
+        lista = [{'id': f't{i:03d}', 'setor': 'farmácia' if i % 20 == 0 else 'médico',
+                  'status': tarefas.STATUS_PENDENTE, 'data_criacao': f'{i % 28 + 1:02d}/02/2025',
+                  'titulo': f'Consulta - Paciente {i}'} for i in range(200)]
+        tarefas._salvar_tarefas(lista)
+
+        with patch.object(tarefas, '_recencia_inteira', wraps=tarefas._recencia_inteira) as recencia:
+            pagina, apos = tarefas.pagina_tarefas(quantidade=5)
+        self.assertLess(recencia.call_count, 10)  # não percorre as 200
+        self.assertEqual([t['id'] for t in pagina], ['t195', 't167', 't139', 't111', 't083'])
+
+        # Setor seletivo (10 de 200): vai direto às candidatas do índice de setor
+        with patch.object(tarefas, '_recencia_inteira', wraps=tarefas._recencia_inteira) as recencia:
+            pagina, apos = tarefas.pagina_tarefas(setor='Farmácia', quantidade=4)
+        self.assertEqual(recencia.call_count, 10)
+        self.assertEqual([t['id'] for t in pagina], ['t080', 't160', 't020', 't100'])
+        self.assertEqual([t['id'] for t in tarefas.pagina_tarefas(setor='farmacia', apos=apos, quantidade=4)[0]],
+                         ['t180', 't040', 't120', 't060'])
+
+        # Período inclusivo e busca sem acento/caixa
+        pagina, _ = tarefas.pagina_tarefas(inicio=date(2025, 2, 3), fim=date(2025, 2, 3), busca='PACIENTE 1')
+        self.assertEqual([t['id'] for t in pagina], ['t198', 't170', 't142', 't114'])
+
+        # A tarefa do cursor sumiu: recomeça o dia dela (repete em vez de pular tarefas)
+        pagina, apos = tarefas.pagina_tarefas(quantidade=2)
+        tarefas._salvar_tarefas([t for t in tarefas._carregar_tarefas() if t['id'] != pagina[-1]['id']])
+        self.assertEqual([t['id'] for t in tarefas.pagina_tarefas(apos=apos, quantidade=3)[0]],
+                         ['t195', 't139', 't111'])
+
+    def test_busca_por_atendimento_na_ordem_do_arquivo(self):
+        tarefas._salvar_tarefas([
+            {'id': 'a', 'atendimento_token': 'x'}, {'id': 'b', 'atendimento_token': 'y'},
+            {'id': 'c', 'atendimento_token': 'x'},
+        ])
+        self.assertEqual([t['id'] for t in tarefas.buscar_tarefas_por_atendimento('x')], ['a', 'c'])
+        self.assertEqual(tarefas.buscar_tarefas_por_atendimento('z'), [])
+
+
+class TestRegistroTarefa(unittest.TestCase):
+
+    def test_funciona_como_dict(self):
+        t = tarefas.Tarefa({'id': 'a', 'titulo': 'A', 'sinais_vitais': {'pa': '12/8'}})
+        self.assertEqual(t['titulo'], 'A')
+        self.assertEqual(t.titulo, 'A')
+        self.assertIsNone(t.get('prazo'))
+        self.assertEqual(t.get('inexistente', 'x'), 'x')
+        self.assertIn('prazo', t)
+        self.assertNotIn('responsavel_nome', t)
+
+        t['responsavel_nome'] = 'Sistema'
+        t.update(status=tarefas.STATUS_CONCLUIDA)
+        comum = dict(t)
+        self.assertEqual(comum['responsavel_nome'], 'Sistema')
+        self.assertEqual(len(comum), len(tarefas.COLUNAS_TAREFAS) + 1)
+        self.assertEqual(t, comum)
+        self.assertEqual(comum, t)
+        self.assertEqual(t.pop('responsavel_nome'), 'Sistema')
+        self.assertRaises(KeyError, t.__getitem__, 'responsavel_nome')
+
+        copia = t.copy()
+        copia['status'] = tarefas.STATUS_PENDENTE
+        self.assertNotEqual(copia, t)
+
+    def test_valores_repetidos_sao_compartilhados(self):
+        a = tarefas._linha_para_tarefa('|'.join(['a', '', '', 'A', '', '', 'médico']))
+        b = tarefas._linha_para_tarefa('|'.join(['b', '', '', 'B', '', '', 'médico']))
+        self.assertIs(a['setor'], b['setor'])
+
+    def test_templates_acessam_campos_e_extras(self):
+        from jinja2 import Template
+        t = tarefas.Tarefa(titulo='Triagem')
+        t['responsavel_nome'] = 'Joy'
+        self.assertEqual(Template('{{ t.titulo }}/{{ t.responsavel_nome }}/{{ t.get("setor", "-") }}').render(t=t),
+                         'Triagem/Joy/None')
+
+    def test_ocupa_menos_memoria_que_dict(self):
+        linhas = memoria_tarefas._linhas(2000)
+        em_dict = memoria_tarefas.medir(memoria_tarefas._como_dict, linhas)
+        em_tarefa = memoria_tarefas.medir(tarefas._linha_para_tarefa, linhas)
+        self.assertLess(em_tarefa, em_dict * 0.6)
+
+
+class TestArquivoTarefas(unittest.TestCase):
+
+    def setUp(self):
+        self.pasta = tempfile.mkdtemp()
+        self.originais = (tarefas.ARQUIVO_TAREFAS, tarefas.ARQUIVO_JOURNAL_TAREFAS, tarefas.PASTA_ARQUIVO_TAREFAS)
+        tarefas.ARQUIVO_TAREFAS = os.path.join(self.pasta, 'tarefas.txt')
+        tarefas.ARQUIVO_JOURNAL_TAREFAS = os.path.join(self.pasta, 'tarefas.journal')
+        tarefas.PASTA_ARQUIVO_TAREFAS = os.path.join(self.pasta, 'arquivo')
+        tarefas.limpar_cache_tarefas()
+
+        def tarefa(id_, token, status, conclusao=None):
+            return {'id': id_, 'titulo': f'Tarefa {id_}', 'setor': 'médico', 'status': status,
+                    'atendimento_token': token, 'data_criacao': '01/01/2020',
+                    'data_conclusao': conclusao, 'concluida_por': 'u1'}
+        hoje = tarefas._data_atual()
+        tarefas._salvar_tarefas([
+            tarefa('a1', 'velho', tarefas.STATUS_CONCLUIDA, '01/01/2020'),
+            tarefa('a2', 'velho', tarefas.STATUS_CANCELADA, '02/01/2020'),
+            tarefa('b1', 'aberto', tarefas.STATUS_CONCLUIDA, '01/01/2020'),
+            tarefa('b2', 'aberto', tarefas.STATUS_PENDENTE),
+            tarefa('c1', 'recente', tarefas.STATUS_CONCLUIDA, hoje),
+        ])
+
+    def tearDown(self):
+        tarefas.ARQUIVO_TAREFAS, tarefas.ARQUIVO_JOURNAL_TAREFAS, tarefas.PASTA_ARQUIVO_TAREFAS = self.originais
+        tarefas.limpar_cache_tarefas()
+        shutil.rmtree(self.pasta, ignore_errors=True)
+
+    def test_so_atendimentos_encerrados_e_antigos_saem(self):
+        self.assertEqual(tarefas.arquivar_tarefas_concluidas(dias=7), 2)
+
+        self.assertEqual([t['id'] for t in tarefas._carregar_tarefas()], ['b1', 'b2', 'c1'])
+        self.assertTrue(os.path.exists(os.path.join(tarefas.PASTA_ARQUIVO_TAREFAS, '20200102.txt')))
+        # Nada mais a arquivar
+        self.assertEqual(tarefas.arquivar_tarefas_concluidas(dias=7), 0)
+
+    def test_atendimento_arquivado_ainda_e_encontrado(self):
+        tarefas.arquivar_tarefas_concluidas(dias=7)
+
+        self.assertEqual(tarefas._repositorio_tarefas().por_atendimento('velho'), [])  # só as ativas
+        self.assertEqual(sorted(t['id'] for t in tarefas.buscar_tarefas_por_atendimento('velho')), ['a1', 'a2'])
+        self.assertEqual(tarefas.buscar_tarefas_por_atendimento('inexistente'), [])
+
+    def test_historico_une_ativas_e_arquivadas(self):
+        tarefas.arquivar_tarefas_concluidas(dias=7)
+
+        self.assertEqual(sorted(t['id'] for t in tarefas.carregar_historico_tarefas()),
+                         ['a1', 'a2', 'b1', 'b2', 'c1'])
+        self.assertEqual([t['id'] for t in tarefas.iterar_tarefas_arquivadas(inicio=date(2021, 1, 1))], [])
+        self.assertEqual(sorted(t['id'] for t in tarefas.iterar_tarefas_arquivadas(fim=date(2020, 1, 1))),
+                         ['a1', 'a2'])
+        self.assertEqual([t['id'] for t in tarefas.iterar_tarefas_arquivadas(fim=date(2019, 12, 31))], [])
+
+        # Queda entre gravar o arquivo e tarefas.txt: a cópia não aparece duas vezes
+        tarefas._anexar_ao_arquivo('20200102', [tarefas._carregar_tarefas()[0]])
+        self.assertEqual(len(tarefas.carregar_historico_tarefas()), 5)
+
+    def test_relatorio_de_concluidas_inclui_o_arquivo(self):
+        tarefas.arquivar_tarefas_concluidas(dias=7)
+
+        def relatorio(**periodo):
+            saida = io.StringIO()
+            with redirect_stdout(saida):
+                relatorios.gerar_relatorio_concluidos(**periodo)
+            return saida.getvalue()
+
+        self.assertIn('Total concluídas: 3', relatorio())
+        self.assertIn('Tarefa a1', relatorio(fim=date(2020, 12, 31)))
+        # a1 foi concluída em 01/01, mas o atendimento só encerrou em 02/01
+        self.assertIn('Tarefa a1', relatorio(inicio=date(2020, 1, 1), fim=date(2020, 1, 1)))
+        self.assertIn('Total concluídas: 2', relatorio(inicio=date(2020, 1, 1), fim=date(2020, 1, 1)))
+        self.assertIn('Total concluídas: 1', relatorio(inicio=date(2021, 1, 1)))
+
+
+class TestFormatoTarefas(unittest.TestCase):
+
+    TRIAGEM = {'pressao': '12x8', 'temperatura': 37.5, 'obs': 'dor | febre\nà noite'}
+
+    def setUp(self):
+        self.pasta = tempfile.mkdtemp()
+        self.originais = (tarefas.ARQUIVO_TAREFAS, tarefas.ARQUIVO_JOURNAL_TAREFAS,
+                          tarefas.PASTA_ARQUIVO_TAREFAS, tarefas.USAR_JOURNAL)
+        tarefas.ARQUIVO_TAREFAS = os.path.join(self.pasta, 'tarefas.txt')
+        tarefas.ARQUIVO_JOURNAL_TAREFAS = os.path.join(self.pasta, 'tarefas.journal')
+        tarefas.PASTA_ARQUIVO_TAREFAS = os.path.join(self.pasta, 'arquivo')
+        tarefas.limpar_cache_tarefas()
+
+    def tearDown(self):
+        (tarefas.ARQUIVO_TAREFAS, tarefas.ARQUIVO_JOURNAL_TAREFAS,
+         tarefas.PASTA_ARQUIVO_TAREFAS, tarefas.USAR_JOURNAL) = self.originais
+        tarefas.limpar_cache_tarefas()
+        shutil.rmtree(self.pasta, ignore_errors=True)
+
+    def _gravar_v1(self, caminho, tarefas_v1, cabecalho=True):
+        """Grava como a versão antiga: str(dict) e cabeçalho sem marcador."""
+        with open(caminho, 'w', encoding='utf-8') as f:
+            if cabecalho: f.write('|'.join(tarefas.COLUNAS_TAREFAS) + '\n')
+            for prefixo, t in tarefas_v1:
+                f.write(prefixo + tarefas._tarefa_para_linha(t, 1) + '\n')
+
+    def _reler(self):
+        tarefas.limpar_cache_tarefas()
+        return tarefas._carregar_tarefas()
+
+    def test_dict_gravado_em_json_sem_literal_eval(self):
+        tarefas._salvar_tarefas([{'id': 'a', 'dados_triagem': self.TRIAGEM,
+                                  'observacoes': "{'nao': 'é dict'}", 'descricao': '<STR>literal'}])
+        with open(tarefas.ARQUIVO_TAREFAS, encoding='utf-8') as f:
+            self.assertTrue(f.readline().startswith(f'#v{tarefas.VERSAO_FORMATO_TAREFAS}|'))
+            self.assertIn('"pressao":"12x8"', f.read())
+
+        with patch.object(tarefas.ast, 'literal_eval', side_effect=AssertionError):
+            relida = self._reler()[0]
+        self.assertEqual(relida['dados_triagem'], self.TRIAGEM)
+        self.assertEqual(relida['observacoes'], "{'nao': 'é dict'}")
+        self.assertEqual(relida['descricao'], '<STR>literal')
+
+    def test_dict_aninhado_da_copia_nao_altera_o_cache(self):
+        tarefas._salvar_tarefas([{'id': 'a', 'sinais_vitais': {'pa': {'max': 12, 'min': 8}, 'fc': [80]}}])
+        copia = tarefas._carregar_tarefas()[0]
+        copia['sinais_vitais']['pa']['max'] = 18
+        copia['sinais_vitais']['fc'].append(120)
+        projetada = next(tarefas.iter_tarefas(colunas=['sinais_vitais']))
+        projetada['sinais_vitais']['pa']['min'] = 0
+
+        self.assertEqual(tarefas._carregar_tarefas()[0]['sinais_vitais'], {'pa': {'max': 12, 'min': 8}, 'fc': [80]})
+
+    def test_arquivo_antigo_continua_legivel(self):
+        self._gravar_v1(tarefas.ARQUIVO_TAREFAS, [('', {'id': 'a', 'dados_triagem': self.TRIAGEM})])
+        self._gravar_v1(tarefas.ARQUIVO_JOURNAL_TAREFAS,
+                        [('U|', {'id': 'b', 'sinais_vitais': {'fc': 80}})], cabecalho=False)
+        self.assertEqual([(t['id'], t['dados_triagem'], t['sinais_vitais']) for t in self._reler()],
+                         [('a', self.TRIAGEM, None), ('b', None, {'fc': 80})])
+
+        # Journal antigo continua recebendo linhas na versão dele
+        tarefas.USAR_JOURNAL = True
+        lista = tarefas._carregar_tarefas()
+        lista.append({'id': 'c', 'sinais_vitais': {'fc': 90}})
+        tarefas._salvar_tarefas(lista)
+        with open(tarefas.ARQUIVO_JOURNAL_TAREFAS, encoding='utf-8') as f:
+            self.assertNotIn('V|', f.read())
+        self.assertEqual(self._reler()[2]['sinais_vitais'], {'fc': 90})
+
+    def test_migracao_converte_todos_os_arquivos(self):
+        self._gravar_v1(tarefas.ARQUIVO_TAREFAS, [('', {'id': 'a', 'dados_triagem': self.TRIAGEM,
+                                                       'observacoes': '{texto}'})])
+        self._gravar_v1(tarefas.ARQUIVO_JOURNAL_TAREFAS,
+                        [('U|', {'id': 'b', 'titulo': 'B'}), ('D|', {'id': 'a'})], cabecalho=False)
+        os.makedirs(tarefas.PASTA_ARQUIVO_TAREFAS)
+        arquivada = os.path.join(tarefas.PASTA_ARQUIVO_TAREFAS, '20200101.txt')
+        self._gravar_v1(arquivada, [('', {'id': 'z', 'dados_triagem': {'x': 1}})])
+        antes = ([t.como_dict() for t in self._reler()], list(tarefas.iterar_tarefas_arquivadas()))
+
+        self.assertEqual(tarefas.migrar_formato_tarefas(),
+                         [tarefas.ARQUIVO_TAREFAS, tarefas.ARQUIVO_JOURNAL_TAREFAS, arquivada])
+        self.assertEqual(tarefas.migrar_formato_tarefas(), [])  # já convertidos
+
+        with patch.object(tarefas.ast, 'literal_eval', side_effect=AssertionError):
+            depois = ([t.como_dict() for t in self._reler()], list(tarefas.iterar_tarefas_arquivadas()))
+        self.assertEqual(depois, antes)
+        self.assertEqual(depois[1][0]['dados_triagem'], {'x': 1})
+
+
+class TestIterTarefas(unittest.TestCase):
+
+    def setUp(self):
+        self.pasta = tempfile.mkdtemp()
+        self.originais = (tarefas.ARQUIVO_TAREFAS, tarefas.ARQUIVO_JOURNAL_TAREFAS, tarefas.PASTA_ARQUIVO_TAREFAS)
+        tarefas.ARQUIVO_TAREFAS = os.path.join(self.pasta, 'tarefas.txt')
+        tarefas.ARQUIVO_JOURNAL_TAREFAS = os.path.join(self.pasta, 'tarefas.journal')
+        tarefas.PASTA_ARQUIVO_TAREFAS = os.path.join(self.pasta, 'arquivo')
+        tarefas._salvar_tarefas([
+            {'id': f't{i}', 'titulo': f'Tarefa {i}', 'setor': 'médico' if i % 2 else 'farmácia',
+             'status': tarefas.STATUS_PENDENTE, 'dados_triagem': {'ordem': i}}
+            for i in range(6)
+        ])
+        tarefas.limpar_cache_tarefas()
+
+    def tearDown(self):
+        tarefas.ARQUIVO_TAREFAS, tarefas.ARQUIVO_JOURNAL_TAREFAS, tarefas.PASTA_ARQUIVO_TAREFAS = self.originais
+        tarefas.limpar_cache_tarefas()
+        shutil.rmtree(self.pasta, ignore_errors=True)
+
+    def _conferir(self):
+        self.assertEqual(list(tarefas.iter_tarefas(lambda t: t['setor'] == 'médico', colunas=['id', 'titulo'])),
+                         [{'id': f't{i}', 'titulo': f'Tarefa {i}'} for i in (1, 3, 5)])
+        self.assertEqual([t['id'] for t in tarefas.iter_tarefas()], [f't{i}' for i in range(6)])
+        self.assertIsInstance(next(tarefas.iter_tarefas()), tarefas.Tarefa)
+
+    def test_disco_sem_carregar_o_cache(self):
+        self._conferir()
+        self.assertIsNone(tarefas._cache_tarefas['assinatura'])
+
+    def test_cache_carregado(self):
+        tarefas._carregar_tarefas()
+        self._conferir()
+
+        linha = next(tarefas.iter_tarefas(colunas=['dados_triagem']))
+        linha['dados_triagem']['ordem'] = 99
+        self.assertEqual(tarefas._carregar_tarefas()[0]['dados_triagem'], {'ordem': 0})
+
+    def test_para_na_primeira_encontrada(self):
+        vistas = []
+        def predicado(t):
+            vistas.append(t['id'])
+            return t['id'] == 't1'
+        self.assertEqual(next(tarefas.iter_tarefas(predicado))['id'], 't1')
+        self.assertEqual(vistas, ['t0', 't1'])
+
+    def test_so_as_colunas_pedidas_sao_decodificadas(self):
+        with patch.object(tarefas, '_unescape', wraps=tarefas._unescape) as unescape:
+            list(tarefas.iter_tarefas(colunas=['id']))
+        self.assertEqual(unescape.call_count, 6)
+
+    def test_historico_sem_repetir_ids(self):
+        os.makedirs(tarefas.PASTA_ARQUIVO_TAREFAS)
+        arquivadas = [{'id': 'a1', 'status': tarefas.STATUS_CONCLUIDA}, {'id': 't0'}]
+        tarefas._anexar_ao_arquivo('20200101', arquivadas)
+        tarefas._anexar_ao_arquivo('20200101', arquivadas)  # cópia repetida (queda no meio)
+
+        self.assertEqual([t['status'] for t in tarefas.iter_tarefas(colunas=['status'], historico=True)][-2:],
+                         [tarefas.STATUS_PENDENTE, tarefas.STATUS_CONCLUIDA])
+        self.assertEqual(len(list(tarefas.iter_tarefas(historico=True))), 7)
+        self.assertEqual(len(list(tarefas.iter_tarefas(historico=True, inicio=date(2021, 1, 1)))), 6)
+
+    def test_coluna_desconhecida(self):
+        with self.assertRaises(ValueError):
+            list(tarefas.iter_tarefas(colunas=['nao_existe']))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from datetime import date
+from unittest.mock import patch
+
+import relatorios
+import tarefas
+
+
+def _tarefa(i, status, setor, criacao, conclusao=None, prazo=None, concluida_por=None, responsavel='sistema'):
+    return {'id': f't{i}', 'titulo': f'Tarefa {i}', 'status': status, 'setor': setor,
+            'data_criacao': criacao, 'data_conclusao': conclusao, 'prazo': prazo,
+            'concluida_por': concluida_por, 'responsavel': responsavel}
+
+
+class TestTabelaRelatorios(unittest.TestCase):
+
+    def setUp(self):
+        self.pasta = tempfile.mkdtemp()
+        self.originais = (tarefas.ARQUIVO_TAREFAS, tarefas.ARQUIVO_JOURNAL_TAREFAS, tarefas.PASTA_ARQUIVO_TAREFAS)
+        tarefas.ARQUIVO_TAREFAS = os.path.join(self.pasta, 'tarefas.txt')
+        tarefas.ARQUIVO_JOURNAL_TAREFAS = os.path.join(self.pasta, 'tarefas.journal')
+        tarefas.PASTA_ARQUIVO_TAREFAS = os.path.join(self.pasta, 'arquivo')
+        tarefas.limpar_cache_tarefas()
+        relatorios._tabelas.clear()
+
+        concluida, pendente = tarefas.STATUS_CONCLUIDA, tarefas.STATUS_PENDENTE
+        tarefas._salvar_tarefas([
+            _tarefa(0, concluida, 'médico', '01/01/2024', '03/01/2024', concluida_por='u1'),
+            _tarefa(1, concluida, 'Farmácia', '01/02/2024', '01/02/2024', concluida_por='u2'),
+            _tarefa(2, concluida, 'médico', '10/03/2025', '20/03/2025', concluida_por='u1'),
+            _tarefa(3, concluida, 'médico', None, None, concluida_por='sistema'),
+            _tarefa(4, pendente, 'médico', '01/01/2024', prazo='01/01/2024'),
+            _tarefa(5, pendente, 'farmácia', '01/01/2024', prazo='01/01/2099', responsavel='u2'),
+            _tarefa(6, tarefas.STATUS_CANCELADA, 'médico', '01/01/2024'),
+            _tarefa(7, 'done', 'enfermagem', '05/05/2025', '06/05/2025', concluida_por='u3'),
+        ])
+
+    def tearDown(self):
+        tarefas.ARQUIVO_TAREFAS, tarefas.ARQUIVO_JOURNAL_TAREFAS, tarefas.PASTA_ARQUIVO_TAREFAS = self.originais
+        tarefas.limpar_cache_tarefas()
+        relatorios._tabelas.clear()
+        shutil.rmtree(self.pasta, ignore_errors=True)
+
+    def _conferir_selecao(self):
+        tabela = relatorios.tabela_tarefas()
+        concluida = (relatorios.CODIGO_CONCLUIDA,)
+        self.assertEqual(tabela.selecionar(concluida), [0, 1, 2, 3, 7])
+        self.assertEqual(tabela.selecionar(concluida, inicio=date(2025, 1, 1)), [2, 7])
+        self.assertEqual(tabela.selecionar(concluida, fim=date(2024, 2, 1)), [0, 1])
+        self.assertEqual(tabela.selecionar(concluida, setor='MÉDICO', pessoa='u2', incluir_concluida_por=True),
+                         [0, 1, 2, 3])
+        self.assertEqual(tabela.selecionar((relatorios.CODIGO_PENDENTE,), setor='farmácia', pessoa='x'), [5])
+        self.assertEqual(tabela.dias_de_execucao([0, 1, 2, 3]), (12, 3))
+        self.assertEqual(tabela.vencidas([4, 5], date(2026, 1, 1)), {4})
+        self.assertEqual(tabela.contagem_por_pessoa([0, 1, 2, 3, 7]),
+                         [('u1', 2), ('u2', 1), ('sistema', 1), ('u3', 1)])
+
+    def _saidas(self):
+        saida = io.StringIO()
+        with redirect_stdout(saida):
+            relatorios.gerar_relatorio_concluidos()
+            relatorios.gerar_relatorio_concluidos({'id': 'u2', 'nome': 'Bia', 'setor': 'farmácia'},
+                                                  inicio=date(2024, 1, 1), fim=date(2024, 12, 31))
+            relatorios.gerar_relatorio_pendentes()
+            relatorios.gerar_relatorio_produtividade()
+        return saida.getvalue()
+
+    def test_selecao_em_python_puro(self):
+        with patch.object(relatorios, 'numpy', None):
+            self._conferir_selecao()
+
+    @unittest.skipIf(relatorios.numpy is None, 'NumPy não instalado')
+    def test_selecao_com_numpy(self):
+        self._conferir_selecao()
+
+    @unittest.skipIf(relatorios.numpy is None, 'NumPy não instalado')
+    def test_numpy_e_python_puro_geram_o_mesmo_relatorio(self):
+        com_numpy = self._saidas()
+        with patch.object(relatorios, 'numpy', None):
+            self.assertEqual(self._saidas(), com_numpy)
+
+    def test_relatorios(self):
+        saida = self._saidas()
+        self.assertIn('Total concluídas: 5', saida)
+        self.assertIn('Tempo médio de execução: 3 dias', saida)
+        self.assertIn('Total Pendentes: 2', saida)
+        self.assertIn('Total Atrasadas: 1', saida)
+        self.assertIn('Tarefa 4                  | médico       | 01/01/2024 [ATRASADO!]', saida)
+        self.assertIn('Total de entregas manuais: 4', saida)
+
+    def test_tabela_so_e_refeita_quando_os_dados_mudam(self):
+        tabela = relatorios.tabela_tarefas()
+        self.assertIs(relatorios.tabela_tarefas(), tabela)
+
+        lista = tarefas._carregar_tarefas()
+        lista[4]['status'] = tarefas.STATUS_CONCLUIDA
+        tarefas._salvar_tarefas(lista)
+        nova = relatorios.tabela_tarefas()
+        self.assertIsNot(nova, tabela)
+        self.assertEqual(nova.selecionar((relatorios.CODIGO_PENDENTE,)), [5])
+
+
+if __name__ == '__main__':
+    unittest.main()
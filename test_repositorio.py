@@ -0,0 +1,187 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from datetime import date
+
+import tarefas
+import usuarios
+from utils import repositorio
+from web import atendimentos
+
+
+class TestBackendSQLite(unittest.TestCase):
+
+    def setUp(self):
+        self.pasta = tempfile.mkdtemp()
+        self.originais = (repositorio.BACKEND, repositorio.ARQUIVO_SQLITE)
+        repositorio.BACKEND = repositorio.BACKEND_SQLITE
+        repositorio.ARQUIVO_SQLITE = os.path.join(self.pasta, 'taskflow.db')
+
+    def tearDown(self):
+        repositorio.fechar_conexoes()
+        repositorio.BACKEND, repositorio.ARQUIVO_SQLITE = self.originais
+        shutil.rmtree(self.pasta, ignore_errors=True)
+
+    def test_banco_em_wal_com_indices(self):
+        con = repositorio.conexao()
+        self.assertEqual(con.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+
+        indices = {linha[1] for linha in con.execute('PRAGMA index_list(tarefas)')}
+        self.assertTrue({'idx_tarefas_atendimento', 'idx_tarefas_setor_status',
+                         'idx_tarefas_responsavel'} <= indices)
+        indices_usuarios = {linha[1] for linha in con.execute('PRAGMA index_list(usuarios)')}
+        self.assertIn('idx_usuarios_login', indices_usuarios)
+
+    def test_tarefas_salvar_carregar_e_consultas(self):
+        tarefas._salvar_tarefas([
+            {'id': 'r1', 'setor': 'recepção', 'status': 'Concluída', 'atendimento_token': 'tk1',
+             'responsavel': 'sistema', 'concluida_por': 'u1', 'dados_triagem': {'pa': '12/8'}},
+            {'id': 'm1', 'setor': 'médico', 'status': 'Pendente', 'atendimento_token': 'tk1',
+             'responsavel': 'dr1'},
+            {'id': 'f1', 'setor': 'Farmacia', 'status': 'Pendente', 'atendimento_token': 'tk2'},
+        ])
+
+        carregadas = tarefas._carregar_tarefas()
+        self.assertEqual([t['id'] for t in carregadas], ['r1', 'm1', 'f1'])
+        self.assertEqual(carregadas[0]['dados_triagem'], {'pa': '12/8'})
+        self.assertEqual(set(carregadas[0]), set(tarefas.COLUNAS_TAREFAS))
+
+        self.assertEqual([t['id'] for t in tarefas.buscar_tarefas_por_atendimento('tk1')], ['r1', 'm1'])
+        self.assertEqual([t['id'] for t in tarefas.buscar_tarefas_por_setor('farmácia', 'pendente')], ['f1'])
+        self.assertEqual([t['id'] for t in tarefas.buscar_tarefas_por_responsavel('u1')], ['r1'])
+        self.assertEqual(tarefas._buscar_tarefa_por_id('m1')['responsavel'], 'dr1')
+
+        carregadas[1]['status'] = tarefas.STATUS_CONCLUIDA
+        tarefas._salvar_tarefas(carregadas[1:])
+        self.assertEqual([(t['id'], t['status']) for t in tarefas._carregar_tarefas()],
+                         [('m1', tarefas.STATUS_CONCLUIDA), ('f1', 'Pendente')])
+
+    def _em_outra_thread(self, funcao):
+        def _rodar():
+            try:
+                funcao()
+            finally:
+                repositorio.fechar_conexoes()
+        thread = threading.Thread(target=_rodar)
+        thread.start()
+        return thread
+
+    def test_salvar_nao_apaga_tarefa_criada_por_outra_thread(self):
+        tarefas._salvar_tarefas([{'id': 'a', 'setor': 'recepção', 'status': 'Pendente'}])
+        lista = tarefas._carregar_tarefas()
+
+        def _outra():
+            outra_lista = tarefas._carregar_tarefas()
+            outra_lista.append({'id': 'b', 'setor': 'médico', 'status': 'Pendente'})
+            salvou.append(tarefas._salvar_tarefas(outra_lista))
+        salvou = []
+        self._em_outra_thread(_outra).join()
+        self.assertEqual(salvou, [True])
+
+        lista[0]['status'] = tarefas.STATUS_CONCLUIDA
+        self.assertTrue(tarefas._salvar_tarefas(lista))
+        self.assertEqual([(t['id'], t['status']) for t in tarefas._carregar_tarefas()],
+                         [('a', tarefas.STATUS_CONCLUIDA), ('b', 'Pendente')])
+
+    def test_transacao_serializa_carregar_alterar_salvar(self):
+        tarefas._salvar_tarefas([{'id': 'a', 'setor': 'recepção', 'status': 'Pendente'}])
+        dentro = threading.Event()
+
+        def _acrescentar(marca, esperar=None):
+            with tarefas.transacao_tarefas():
+                lista = tarefas._carregar_tarefas()
+                if esperar is not None:
+                    esperar.set()
+                    threading.Event().wait(0.2)  # a outra thread tenta entrar agora
+                lista[0]['descricao'] = (lista[0]['descricao'] or '') + marca
+                tarefas._salvar_tarefas(lista)
+
+        primeira = self._em_outra_thread(lambda: _acrescentar('x', dentro))
+        dentro.wait(5)
+        segunda = self._em_outra_thread(lambda: _acrescentar('y'))
+        primeira.join()
+        segunda.join()
+        self.assertEqual(tarefas._carregar_tarefas()[0]['descricao'], 'xy')
+
+    def test_usuarios_gravados_por_outro_worker(self):
+        originais = dict(usuarios.usuarios)
+        try:
+            usuarios.usuarios.clear()
+            ana = usuarios.cadastrar_usuario('Ana', 'ana', 'ana@x.com', '123', 'Recepção')
+            self.assertIsNotNone(usuarios.buscar_usuario_por_login('ana'))
+
+            # Outro worker (outra conexão, sem passar por este dict) cadastra a
+            # Bia e regrava a tabela sem a Ana
+            bia = {'id': 'bia', 'nome': 'Bia', 'login': 'bia', 'setor': 'médico'}
+            self._em_outra_thread(lambda: usuarios._REPOSITORIO_SQLITE.salvar_todos({'bia': bia})).join()
+
+            self.assertEqual(usuarios.buscar_usuario_por_login('bia')['id'], 'bia')
+            self.assertIsNone(usuarios.buscar_usuario_por_login('ana'))
+            self.assertIsNone(usuarios.obter_usuario(ana['id']))
+        finally:
+            usuarios.usuarios.clear()
+            usuarios.usuarios.update(originais)
+
+    def test_login_repetido_fica_com_o_primeiro_registro(self):
+        repo = usuarios._REPOSITORIO_SQLITE
+        repo.salvar_todos({'original': {'id': 'original', 'login': 'admin', 'nome': 'Admin'},
+                           'intruso': {'id': 'intruso', 'login': 'admin', 'nome': 'Outro'}})
+        self.assertEqual(repo.por_login('admin')['id'], 'original')
+        self.assertIsNone(repo.por_login('ninguem'))
+
+    def test_resumo_tarefas(self):
+        tarefas._salvar_tarefas([
+            {'id': 'a', 'setor': 'Farmácia', 'status': tarefas.STATUS_CONCLUIDA, 'data_criacao': '01/01/2025'},
+            {'id': 'b', 'setor': 'farmacia', 'status': tarefas.STATUS_PENDENTE, 'data_criacao': '01/01/2025'},
+            {'id': 'c', 'setor': 'médico', 'status': tarefas.STATUS_PENDENTE, 'data_criacao': '02/01/2025',
+             'responsavel': 'dr1'},
+        ])
+        total, concluidas, recentes = tarefas.resumo_tarefas()
+        self.assertEqual((total, concluidas, [t['id'] for t in recentes]), (3, 1, ['c', 'b', 'a']))
+        total, concluidas, recentes = tarefas.resumo_tarefas(lambda setor, responsavel: setor == 'farmacia', 1)
+        self.assertEqual((total, concluidas, [t['id'] for t in recentes]), (2, 1, ['b']))
+        self.assertEqual(tarefas.resumo_tarefas(lambda setor, responsavel: responsavel == 'dr1')[:2], (1, 0))
+
+    def test_pagina_tarefas(self):
+        tarefas._salvar_tarefas([
+            {'id': f't{i}', 'setor': 'médico' if i % 2 else 'farmácia', 'status': tarefas.STATUS_PENDENTE,
+             'data_criacao': f'{i + 1:02d}/01/2025', 'titulo': f'Paciente {i}'} for i in range(7)
+        ])
+        pagina, apos = tarefas.pagina_tarefas(quantidade=3, setor='Médico')
+        self.assertEqual([t['id'] for t in pagina], ['t5', 't3', 't1'])
+        self.assertIsNone(apos)
+        pagina, apos = tarefas.pagina_tarefas(quantidade=2)
+        self.assertEqual([t['id'] for t in pagina], ['t6', 't5'])
+        pagina, apos = tarefas.pagina_tarefas(apos=apos, quantidade=2, inicio=date(2025, 1, 2), busca='paciente')
+        self.assertEqual([t['id'] for t in pagina], ['t4', 't3'])
+        pagina, apos = tarefas.pagina_tarefas(apos=apos, quantidade=2, inicio=date(2025, 1, 2))
+        self.assertEqual(([t['id'] for t in pagina], apos), (['t2', 't1'], None))
+
+    def test_usuarios_e_atendimentos(self):
+        originais = dict(usuarios.usuarios)
+        try:
+            usuarios.usuarios.clear()
+            novo = usuarios.cadastrar_usuario('Ana', 'ana', 'ana@x.com', '123', 'Recepção')
+            usuarios.usuarios.clear()
+            usuarios._load_usuarios_from_file()
+            self.assertEqual(usuarios.obter_usuario(novo['id'])['login'], 'ana')
+        finally:
+            usuarios.usuarios.clear()
+            usuarios.usuarios.update(originais)
+
+        atendimento = atendimentos.criar_atendimento('123', 'Ana', 'dr1', 'Cardiologia')
+        self.assertEqual(atendimentos.obter_atendimento(atendimento['token'])['nome_paciente'], 'Ana')
+        self.assertIsNone(atendimentos.obter_atendimento('inexistente'))
+
+        # Senha do dia: continua a contagem já gravada e incrementa numa linha da tabela
+        repo = atendimentos._repositorio_atendimentos()
+        dia = atendimento['data_checkin'][:10]
+        self.assertTrue(atendimento['senha'].endswith('-001'))
+        self.assertEqual(repo.proxima_senha(dia), 2)
+        self.assertEqual(repo.proxima_senha('01/01/2000'), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
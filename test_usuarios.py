@@ -0,0 +1,202 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import usuarios
+
+
+class TestIndicesUsuarios(unittest.TestCase):
+
+    def setUp(self):
+        self.pasta = tempfile.mkdtemp()
+        self.originais = (usuarios.USUARIOS_FILE, dict(usuarios.usuarios))
+        usuarios.USUARIOS_FILE = os.path.join(self.pasta, 'usuarios.txt')
+        usuarios.usuarios.clear()
+        usuarios._load_usuarios_from_file()
+
+    def tearDown(self):
+        usuarios.USUARIOS_FILE = self.originais[0]
+        usuarios._aliases.clear()
+        usuarios.usuarios.clear()
+        usuarios.usuarios.update(self.originais[1])
+        usuarios._load_usuarios_from_file()
+        shutil.rmtree(self.pasta, ignore_errors=True)
+
+    def _paciente(self, cpf, nome='Paciente'):
+        return usuarios.cadastrar_usuario(nome, cpf, f'{cpf}@paciente.taskflow', cpf, 'paciente')
+
+    def test_login_e_cpf_sem_varredura(self):
+        medico = usuarios.cadastrar_usuario('House', 'house', 'h@x.com', '123', 'Médico')
+        paciente = self._paciente('12345678900')
+
+        self.assertIs(usuarios.buscar_usuario_por_login('house'), medico)
+        self.assertIs(usuarios.buscar_usuario_por_cpf('123.456.789-00'), paciente)
+        self.assertIs(usuarios.buscar_usuario_por_cpf('12345678900'), paciente)
+        self.assertIsNone(usuarios.buscar_usuario_por_cpf('house'))
+        # Antes a busca era por substring: parte do CPF achava o paciente
+        self.assertIsNone(usuarios.buscar_usuario_por_cpf('1234'))
+
+    def test_indices_sobrevivem_a_releitura_do_arquivo(self):
+        self._paciente('11111111111', 'Ana')
+        usuarios.usuarios.clear()
+        self.assertIsNone(usuarios.usuarios.por_cpf.get('11111111111'))
+
+        usuarios._load_usuarios_from_file()
+        self.assertEqual(usuarios.buscar_usuario_por_cpf('11111111111')['nome'], 'Ana')
+        self.assertEqual(usuarios.realizar_login('11111111111', '11111111111')['nome'], 'Ana')
+
+    def test_login_duplicado_fica_com_o_primeiro_registro(self):
+        linhas = [usuarios._usuario_para_linha({'id': id_usuario, 'nome': nome, 'login': 'admin', 'setor': 'admin',
+                                                'senha': usuarios._hash_senha(senha)})
+                  for id_usuario, nome, senha in (('original', 'Admin', 'certa'), ('intruso', 'Outro', 'nova'))]
+        with open(usuarios.USUARIOS_FILE, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(linhas) + '\n')
+        usuarios._load_usuarios_from_file()
+
+        self.assertEqual(usuarios.buscar_usuario_por_login('admin')['id'], 'original')
+        self.assertEqual(usuarios.realizar_login('admin', 'certa')['id'], 'original')
+        self.assertIsNone(usuarios.realizar_login('admin', 'nova'))
+
+        # Alterar o original mantém a entrada; remover o mais novo também
+        usuarios.usuarios['original'] = dict(usuarios.usuarios['original'], nome='Admin 2')
+        self.assertEqual(usuarios.buscar_usuario_por_login('admin')['nome'], 'Admin 2')
+        del usuarios.usuarios['intruso']
+        self.assertEqual(usuarios.buscar_usuario_por_login('admin')['id'], 'original')
+
+        # Remover o primeiro com outro ainda no dict: o outro passa a valer
+        usuarios.usuarios['intruso'] = {'id': 'intruso', 'login': 'admin', 'nome': 'Outro'}
+        del usuarios.usuarios['original']
+        self.assertEqual(usuarios.buscar_usuario_por_login('admin')['id'], 'intruso')
+
+    def test_login_existente_nao_e_sobrescrito(self):
+        admin = usuarios.cadastrar_usuario('Admin', 'admin', 'a@x.com', 'certa', 'Admin')
+        with self.assertRaisesRegex(ValueError, 'Login já existe'):
+            usuarios.cadastrar_usuario('Outro', 'admin', 'o@x.com', 'nova', 'Médico')
+
+        self.assertEqual(usuarios.realizar_login('admin', 'certa'), admin)
+        self.assertIsNone(usuarios.realizar_login('admin', 'nova'))
+        self.assertEqual(usuarios.buscar_usuario_por_login('admin')['setor'], 'admin')
+        with open(usuarios.USUARIOS_FILE, encoding='utf-8') as f:
+            self.assertEqual(len(f.readlines()), 1)
+
+        # Pelo cadastro público (sem login) também não
+        from web.app import app
+        cliente = app.test_client()
+        cliente.post('/cadastro', data={'nome': 'Outro', 'login': 'admin', 'email': 'o@x.com',
+                                        'senha': 'nova', 'setor': 'recepção'})
+        self.assertIsNone(usuarios.realizar_login('admin', 'nova'))
+        self.assertEqual(usuarios.realizar_login('admin', 'certa')['id'], admin['id'])
+
+    def test_totem_atualiza_so_os_dados_do_paciente(self):
+        paciente = usuarios.cadastrar_paciente('Ana', '123.456.789-00')
+        self.assertEqual((paciente['login'], paciente['setor']), ('12345678900', 'paciente'))
+
+        atualizado = usuarios.cadastrar_paciente('Ana Souza', '12345678900')
+        self.assertEqual(atualizado['id'], paciente['id'])
+        self.assertEqual(atualizado['nome'], 'Ana Souza')
+        self.assertEqual(atualizado['senha'], paciente['senha'])
+        self.assertEqual(len(usuarios.listar_usuarios()), 1)
+
+        # Funcionário com o CPF como login não é tocado pelo totem
+        funcionario = usuarios.cadastrar_usuario('Bia', '98765432100', 'b@x.com', 'segredo', 'Farmácia')
+        self.assertIs(usuarios.cadastrar_paciente('Intrusa', '98765432100'), funcionario)
+        self.assertEqual(usuarios.realizar_login('98765432100', 'segredo')['nome'], 'Bia')
+
+        usuarios.usuarios.clear()
+        usuarios._load_usuarios_from_file()
+        self.assertEqual(usuarios.obter_usuario(paciente['id'])['nome'], 'Ana Souza')
+
+    def test_compactacao_mescla_duplicados_antigos(self):
+        # Cadastros duplicados antigos (ids diferentes, mesmo login)
+        linhas = [usuarios._usuario_para_linha({'id': f'id{i}', 'nome': f'Ana {i}', 'login': 'ana',
+                                                'setor': 'recepção', 'senha': 'x'}) for i in range(3)]
+        linhas.append(usuarios._usuario_para_linha({'id': 'bia', 'nome': 'Bia', 'login': 'bia', 'senha': 'x'}))
+        with open(usuarios.USUARIOS_FILE, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(linhas) + '\n')
+        usuarios._load_usuarios_from_file()
+        self.assertEqual(len(usuarios.listar_usuarios()), 4)
+
+        self.assertEqual(usuarios.compactar_usuarios(), 2)
+        self.assertEqual(sorted(u['id'] for u in usuarios.listar_usuarios()), ['bia', 'id0'])
+        # Quem guardou o id removido (ex.: responsável de tarefa) ainda acha o usuário
+        self.assertEqual(usuarios.obter_usuario('id2')['nome'], 'Ana 0')
+
+        usuarios.usuarios.clear()
+        usuarios._aliases.clear()
+        usuarios._load_usuarios_from_file()
+        self.assertEqual(sorted(u['id'] for u in usuarios.listar_usuarios()), ['bia', 'id0'])
+        self.assertEqual(usuarios.obter_usuario('id1')['id'], 'id0')
+
+
+
+class TestAppendUsuarios(unittest.TestCase):
+
+    def setUp(self):
+        self.pasta = tempfile.mkdtemp()
+        self.originais = (usuarios.USUARIOS_FILE, dict(usuarios.usuarios),
+                          usuarios.USAR_APPEND_USUARIOS, usuarios.LIMITE_LINHAS_OBSOLETAS_USUARIOS)
+        usuarios.USUARIOS_FILE = os.path.join(self.pasta, 'usuarios.txt')
+        usuarios.USAR_APPEND_USUARIOS = True
+        usuarios.usuarios.clear()
+        usuarios._load_usuarios_from_file()
+
+    def tearDown(self):
+        (usuarios.USUARIOS_FILE, _, usuarios.USAR_APPEND_USUARIOS,
+         usuarios.LIMITE_LINHAS_OBSOLETAS_USUARIOS) = self.originais
+        usuarios._aliases.clear()
+        usuarios.usuarios.clear()
+        usuarios.usuarios.update(self.originais[1])
+        usuarios._load_usuarios_from_file()
+        shutil.rmtree(self.pasta, ignore_errors=True)
+
+    def _linhas_no_arquivo(self):
+        with open(usuarios.USUARIOS_FILE, encoding='utf-8') as f:
+            return f.read().splitlines()
+
+    def _reler(self):
+        usuarios.usuarios.clear()
+        usuarios._load_usuarios_from_file()
+        return {u['id']: u for u in usuarios.listar_usuarios()}
+
+    def test_salvar_todos_anexa_so_o_que_mudou(self):
+        ana = usuarios.cadastrar_usuario('Ana', 'ana', 'a@x.com', '1', 'Recepção')
+        bia = usuarios.cadastrar_usuario('Bia', 'bia', 'b@x.com', '1', 'Médico')
+        usuarios.cadastrar_usuario('Caio', 'caio', 'c@x.com', '1', 'Farmácia')
+
+        usuarios.usuarios[bia['id']]['disponivel'] = 'false'
+        del usuarios.usuarios[ana['id']]
+        usuarios._save_usuarios_to_file()
+
+        linhas = self._linhas_no_arquivo()
+        self.assertEqual(len(linhas), 5)
+        self.assertTrue(linhas[-1].startswith(usuarios._MARCA_REMOVIDO + '|' + ana['id']))
+
+        relidos = self._reler()
+        self.assertEqual(sorted(u['login'] for u in relidos.values()), ['bia', 'caio'])
+        self.assertEqual(relidos[bia['id']]['disponivel'], 'false')
+
+        # Nada mudou: nada é anexado
+        usuarios._save_usuarios_to_file()
+        self.assertEqual(len(self._linhas_no_arquivo()), 5)
+
+    def test_compactacao_em_segundo_plano(self):
+        usuarios.LIMITE_LINHAS_OBSOLETAS_USUARIOS = 3
+        for i in range(6):
+            usuarios.cadastrar_paciente(f'Ana {i}', '11111111111')
+        usuarios._compactacao_usuarios['thread'].join(timeout=5)
+
+        self.assertLessEqual(len(self._linhas_no_arquivo()), 3)
+        self.assertEqual([u['nome'] for u in self._reler().values()], ['Ana 5'])
+
+    def test_modo_reescrita(self):
+        usuarios.USAR_APPEND_USUARIOS = False
+        usuarios.cadastrar_paciente('Ana', '11111111111')
+        usuarios.cadastrar_paciente('Ana 2', '11111111111')
+
+        self.assertEqual(len(self._linhas_no_arquivo()), 1)
+        self.assertEqual([u['nome'] for u in self._reler().values()], ['Ana 2'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,334 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import json
+
+import tarefas
+from utils import arquivos
+from web import atendimentos, workflow
+
+
+class _BaseWorkflow(unittest.TestCase):
+
+    ARQUIVOS = [(tarefas, 'ARQUIVO_TAREFAS', 'tarefas.txt'),
+                (tarefas, 'ARQUIVO_JOURNAL_TAREFAS', 'tarefas.journal'),
+                (atendimentos, 'PASTA_ATENDIMENTOS', 'atendimentos'),
+                (atendimentos, 'ARQUIVO_ATENDIMENTOS', 'atendimentos.txt'),
+                (atendimentos, 'ARQUIVO_EVENTOS', 'eventos.txt'),
+                (atendimentos, 'ARQUIVO_SENHAS', 'senhas.txt')]
+
+    def _limpar_caches(self):
+        tarefas.limpar_cache_tarefas()
+        atendimentos.limpar_cache_atendimentos()
+
+    def setUp(self):
+        self.pasta = tempfile.mkdtemp()
+        self.originais = [getattr(modulo, nome) for modulo, nome, _ in self.ARQUIVOS]
+        for modulo, nome, arquivo in self.ARQUIVOS:
+            setattr(modulo, nome, os.path.join(self.pasta, arquivo))
+        self._limpar_caches()
+
+        self.atendimento = atendimentos.criar_atendimento('123', 'Maria', 'dr1', 'Cardiologia')
+        self.token = self.atendimento['token']
+        workflow.criar_workflow_automatico(self.token, 'Maria', 'dr1', 'Dr. Um')
+
+    def tearDown(self):
+        for (modulo, nome, _), original in zip(self.ARQUIVOS, self.originais):
+            setattr(modulo, nome, original)
+        self._limpar_caches()
+        shutil.rmtree(self.pasta, ignore_errors=True)
+
+    def _pendente(self, setor):
+        for t in workflow.obter_tarefas_atendimento(self.token):
+            if t['setor'] == setor and t['status'] == tarefas.STATUS_PENDENTE:
+                return t
+        return None
+
+
+class TestTransicaoWorkflow(_BaseWorkflow):
+
+    def test_cada_transicao_grava_uma_vez(self):
+        passos = [('recepção', 'encaminhar_medico', 'médico'),
+                  ('médico', 'solicitar_medicamento', 'farmácia'),
+                  ('farmácia', 'dispensar_medicamento', 'enfermagem')]
+        for setor, acao, proximo in passos:
+            atual = self._pendente(setor)
+            with patch.object(tarefas, '_salvar_tarefas', wraps=tarefas._salvar_tarefas) as salvar, \
+                 patch.object(tarefas, '_carregar_tarefas', wraps=tarefas._carregar_tarefas) as carregar, \
+                 patch.object(atendimentos, 'atualizar_status_atendimento') as status:
+                self.assertIsNotNone(workflow.avancar_workflow(atual['id'], acao))
+
+            self.assertEqual(salvar.call_count, 1)
+            self.assertEqual(carregar.call_count, 1)
+            self.assertEqual(status.call_count, 1)
+            self.assertIsNotNone(self._pendente(proximo))
+
+        medico = [t for t in workflow.obter_tarefas_atendimento(self.token) if t['setor'] == 'médico'][0]
+        self.assertEqual(medico['responsavel'], 'dr1')
+
+    def test_transicao_atualiza_status_do_atendimento(self):
+        self.assertEqual(atendimentos.obter_status_atendimento(self.token)['status'], 'em_andamento')
+        workflow.avancar_workflow(self._pendente('recepção')['id'], 'encaminhar_medico')
+
+        estado = atendimentos.obter_status_atendimento(self.token)
+        self.assertEqual((estado['status'], estado['etapa']), ('em_atendimento', 'medico'))
+        self.assertEqual(atendimentos.obter_atendimento(self.token)['etapa'], 'medico')
+
+        workflow.avancar_workflow(self._pendente('médico')['id'], 'alta')
+        self.assertEqual(atendimentos.obter_status_atendimento(self.token)['status'], 'concluido')
+
+    def test_tarefa_manual_nao_mexe_em_atendimento(self):
+        with tarefas.transacao_tarefas():
+            lista = tarefas._carregar_tarefas()
+            lista.append({'id': 'manual', 'titulo': 'Repor estoque', 'setor': 'farmácia',
+                          'tipo_tarefa': 'Manual', 'status': tarefas.STATUS_PENDENTE})
+            tarefas._salvar_tarefas(lista)
+
+        with patch.object(atendimentos, 'atualizar_status_atendimento') as status:
+            self.assertIsNotNone(workflow.avancar_workflow('manual', 'finalizar_atendimento'))
+        status.assert_not_called()
+        self.assertEqual(tarefas._buscar_tarefa_por_id('manual', tarefas._carregar_tarefas())['status'],
+                         tarefas.STATUS_CONCLUIDA)
+
+    def test_nada_e_gravado_se_tarefa_nao_existe(self):
+        with patch.object(tarefas, '_salvar_tarefas') as salvar:
+            self.assertIsNone(workflow.avancar_workflow('inexistente', 'alta'))
+        salvar.assert_not_called()
+
+    def test_falha_ao_gravar_nao_conta_como_feito(self):
+        atual = self._pendente('recepção')
+        with patch.object(tarefas, '_salvar_tarefas', return_value=False):
+            self.assertIsNone(workflow.avancar_workflow(atual['id'], 'encaminhar_medico'))
+        self.assertIsNotNone(self._pendente('recepção'))
+        self.assertIsNone(self._pendente('médico'))
+        self.assertEqual(atendimentos.obter_status_atendimento(self.token)['status'], 'em_andamento')
+
+        # A rota avisa o erro em vez de "encaminhado"
+        from web.app import app
+        cliente = app.test_client()
+        with cliente.session_transaction() as sessao:
+            sessao.update({'usuario_id': 'u1', 'usuario_nome': 'Ana', 'usuario_setor': 'recepção'})
+        with patch.object(tarefas, '_salvar_tarefas', return_value=False):
+            cliente.post(f"/tarefas/{atual['id']}/acao", data={'acao': 'encaminhar_medico'})
+        with cliente.session_transaction() as sessao:
+            self.assertEqual([categoria for categoria, _ in sessao['_flashes']], ['danger'])
+        self.assertIsNotNone(self._pendente('recepção'))
+
+    def test_transacao_manual(self):
+        transacao = workflow.TransicaoWorkflow()
+        atual = self._pendente('recepção')
+        transacao.concluir(atual['id'], 'u1')
+        workflow.adicionar_tarefa_farmacia(self.token, 'Maria', transacao=transacao)
+
+        # Nada vai para o disco antes de confirmar
+        self.assertIsNotNone(self._pendente('recepção'))
+        self.assertTrue(transacao.confirmar())
+        self.assertIsNone(self._pendente('recepção'))
+        self.assertIsNotNone(self._pendente('farmácia'))
+
+
+@patch.object(workflow, 'iniciar_vigia')  # a vigia é exercitada chamando verificar_mudancas_tarefas
+class TestAcompanhamentoAtendimento(_BaseWorkflow):
+
+    def test_versao_muda_so_para_o_atendimento_alterado(self, _vigia):
+        outro = atendimentos.criar_atendimento('456', 'João', 'dr1', 'Cardiologia')['token']
+        workflow.criar_workflow_automatico(outro, 'João', 'dr1', 'Dr. Um')
+        antes, antes_outro = workflow.versao_atendimento(self.token), workflow.versao_atendimento(outro)
+
+        workflow.avancar_workflow(self._pendente('recepção')['id'], 'encaminhar_medico')
+        self.assertNotEqual(workflow.versao_atendimento(self.token), antes)
+        self.assertEqual(workflow.versao_atendimento(outro), antes_outro)
+
+    def test_gravacao_de_outro_worker_chega_pela_verificacao(self, _vigia):
+        tarefas._carregar_tarefas()
+        antes = workflow.versao_atendimento(self.token)
+
+        # Outro processo conclui a tarefa direto no arquivo
+        lista = tarefas._ler_snapshot()
+        lista[0]['status'] = tarefas.STATUS_CONCLUIDA
+        arquivos.escrever_atomico(tarefas.ARQUIVO_TAREFAS,
+                                  [tarefas._cabecalho_tarefas()] + [tarefas._tarefa_para_linha(t) + '\n' for t in lista])
+        self.assertEqual(workflow.versao_atendimento(self.token), antes)
+
+        tarefas.verificar_mudancas_tarefas()
+        self.assertNotEqual(workflow.versao_atendimento(self.token), antes)
+
+    def test_manda_o_estado_e_depois_so_o_que_mudou(self, _vigia):
+        eventos = workflow.acompanhar_atendimento(self.token, espera=0.05)
+        inicial = next(eventos)
+        self.assertEqual((inicial['etapa'], inicial['progresso'], inicial['etapa_index']), ('recepção', 10, 0))
+        self.assertEqual(inicial['tempo_estimado'], atendimentos.calcular_tempo_estimado(1))
+        self.assertIsNone(next(eventos))  # nada mudou: keep-alive
+
+        workflow.avancar_workflow(self._pendente('recepção')['id'], 'encaminhar_medico')
+        mudou = next(eventos)
+        self.assertEqual((mudou['etapa'], mudou['progresso'], mudou['etapa_index']), ('médico', 50, 1))
+        self.assertEqual([t['setor'] for t in mudou['tarefas']], ['recepção', 'médico'])
+        self.assertNotIn('tempo_estimado', mudou)
+        eventos.close()
+
+    def test_rota_sse(self, _vigia):
+        from web.app import app
+        cliente = app.test_client()
+        self.assertEqual(cliente.get('/paciente/inexistente/eventos').status_code, 404)
+
+        resposta = cliente.get(f'/paciente/{self.token}/eventos', buffered=False)
+        self.assertEqual(resposta.mimetype, 'text/event-stream')
+        partes = iter(resposta.response)
+        self.assertTrue(next(partes).startswith(b'retry:'))
+        dados = next(partes).decode('utf-8')
+        self.assertTrue(dados.startswith('data: '))
+        self.assertEqual(json.loads(dados[6:])['etapa'], 'recepção')
+        resposta.close()
+
+    def test_limite_de_conexoes_sse(self, _vigia):
+        from web import app as modulo_app
+        cliente = modulo_app.app.test_client()
+        url = f'/paciente/{self.token}/eventos'
+        with patch.object(modulo_app, 'MAXIMO_CONEXOES_SSE', 1):
+            aberta = cliente.get(url, buffered=False)
+            self.assertEqual(aberta.status_code, 200)
+            # Acima do limite: 503 na hora, sem prender outra thread
+            recusada = cliente.get(url, buffered=False)
+            self.assertEqual(recusada.status_code, 503)
+            self.assertEqual(recusada.headers['Retry-After'], '30')
+            # A consulta com ETag continua respondendo
+            self.assertEqual(cliente.get(f'/api/atendimento/{self.token}/status').status_code, 200)
+
+            aberta.close()  # fechar (mesmo sem ler nada) libera a vaga
+            self.assertEqual(modulo_app._conexoes_sse['abertas'], 0)
+            outra = cliente.get(url, buffered=False)
+            self.assertEqual(outra.status_code, 200)
+            outra.close()
+
+
+@patch.object(workflow, 'iniciar_vigia')
+class TestStatusAtendimentoApi(_BaseWorkflow):
+
+    def setUp(self):
+        super().setUp()
+        from web.app import app
+        self.cliente = app.test_client()
+        self.url = f'/api/atendimento/{self.token}/status'
+
+    def test_json_com_etag(self, _vigia):
+        resposta = self.cliente.get(self.url)
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(resposta.json['etapa'], 'recepção')
+        self.assertEqual(resposta.json['progresso'], 10)
+        self.assertEqual(resposta.headers['Cache-Control'], 'no-cache')
+        self.assertEqual(self.cliente.get('/api/atendimento/inexistente/status').status_code, 404)
+
+    def test_304_sem_ler_nada_enquanto_nao_muda(self, _vigia):
+        etag = self.cliente.get(self.url).headers['ETag']
+        with patch.object(workflow, 'estado_atendimento') as estado:
+            resposta = self.cliente.get(self.url, headers={'If-None-Match': etag})
+        self.assertEqual(resposta.status_code, 304)
+        self.assertEqual(resposta.headers['ETag'], etag)
+        estado.assert_not_called()
+
+        workflow.avancar_workflow(self._pendente('recepção')['id'], 'encaminhar_medico')
+        resposta = self.cliente.get(self.url, headers={'If-None-Match': etag})
+        self.assertEqual(resposta.status_code, 200)
+        self.assertNotEqual(resposta.headers['ETag'], etag)
+        self.assertEqual(resposta.json['etapa'], 'médico')
+
+    def test_token_desconhecido_e_404_mesmo_com_etag(self, _vigia):
+        etag = f'"{workflow.etag_atendimento("inexistente")}"'
+        resposta = self.cliente.get('/api/atendimento/inexistente/status', headers={'If-None-Match': etag})
+        self.assertEqual(resposta.status_code, 404)
+        # ETag guardada, mas o cliente tem outra: corpo e ETag do mesmo estado
+        resposta = self.cliente.get(self.url, headers={'If-None-Match': '"outra"'})
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(resposta.headers['ETag'], f'"{workflow.etag_estado(resposta.json)}"')
+
+    def test_mesma_etag_em_outro_worker(self, _vigia):
+        etag = self.cliente.get(self.url).headers['ETag']
+        # Outro worker: versões contadas de outro jeito, mesmos dados
+        with patch.object(workflow, '_versoes', {self.token: 7}), \
+             patch.object(workflow, '_versao_geral', [3]), patch.object(workflow, '_etags', {}):
+            self.assertEqual(f'"{workflow.etag_atendimento(self.token)}"', etag)
+            self.assertEqual(self.cliente.get(self.url, headers={'If-None-Match': etag}).status_code, 304)
+
+    def test_gravacao_de_outro_worker_vale_na_hora(self, _vigia):
+        etag = self.cliente.get(self.url).headers['ETag']
+        # Outro processo conclui a tarefa da recepção direto no arquivo (vigia parada)
+        with open(tarefas.ARQUIVO_TAREFAS, encoding='utf-8') as f:
+            texto = f.read()
+        alterado = texto.replace(f'|{tarefas.STATUS_PENDENTE}|', f'|{tarefas.STATUS_CONCLUIDA}|')
+        self.assertNotEqual(alterado, texto)
+        arquivos.escrever_atomico(tarefas.ARQUIVO_TAREFAS, [alterado])
+
+        resposta = self.cliente.get(self.url, headers={'If-None-Match': etag})
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(resposta.json['progresso'], 100)
+        self.assertEqual(resposta.headers['ETag'], f'"{workflow.etag_atendimento(self.token)}"')
+
+
+@patch.object(workflow, 'iniciar_vigia')
+class TestFilaDosSetores(_BaseWorkflow):
+
+    def _recepcao(self, t):
+        return t.get('setor') == 'recepção'
+
+    def _painel(self):
+        return len(tarefas.buscar_tarefas_por_setor('recepção'))
+
+    def test_eventos_de_criacao_e_conclusao(self, _vigia):
+        marca, total = workflow.foto_painel(self._painel)
+        self.assertEqual(total, 1)
+        eventos = workflow.acompanhar_fila(self._recepcao, self._painel, desde=marca, espera=0.05)
+        self.assertIsNone(next(eventos))  # retomou da marca: nada a mandar
+
+        outro = atendimentos.criar_atendimento('456', 'João', 'dr1', 'Cardiologia')['token']
+        workflow.criar_workflow_automatico(outro, 'João', 'dr1', 'Dr. Um')
+        criada = next(eventos)
+        self.assertEqual((criada['tipo'], criada['total'], criada['concluidas']), ('criada', 1, 0))
+        self.assertEqual(criada['nova']['atendimento_token'], outro)
+
+        # A tarefa do médico criada na transição não passa no filtro do painel
+        workflow.avancar_workflow(self._pendente('recepção')['id'], 'encaminhar_medico')
+        concluida = next(eventos)
+        self.assertEqual((concluida['tipo'], concluida['total'], concluida['concluidas']), ('concluida', 0, 1))
+        self.assertIsNone(next(eventos))
+        eventos.close()
+
+    def test_sem_marca_valida_manda_o_painel_inteiro(self, _vigia):
+        marca, _ = workflow.foto_painel(self._painel)
+        for desde in (None, 'outro-0', marca.split('-')[0] + '-999999'):
+            eventos = workflow.acompanhar_fila(self._recepcao, self._painel, desde=desde, espera=0.05)
+            self.assertEqual(next(eventos)['painel'], 1)
+            eventos.close()
+
+        # Mudança que não dá para detalhar (lote grande, SQLite): painel inteiro de novo
+        eventos = workflow.acompanhar_fila(self._recepcao, self._painel, desde=marca, espera=0.05)
+        with patch.object(workflow, 'LOTE_MAXIMO_FILAS', 0):
+            workflow.criar_workflow_automatico(self.token, 'Maria', 'dr1', 'Dr. Um')
+        estado = next(eventos)
+        self.assertEqual((estado['tipo'], estado['painel']), ('estado', 2))
+        eventos.close()
+
+    def test_rota_sse_do_painel(self, _vigia):
+        from web.app import app
+        cliente = app.test_client()
+        with cliente.session_transaction() as sessao:
+            sessao.update({'usuario_id': 'u1', 'usuario_nome': 'Ana', 'usuario_setor': 'farmácia'})
+        self.assertEqual(cliente.get('/dashboard/geral/eventos').status_code, 403)
+
+        pagina = cliente.get('/dashboard/farmacia').get_data(as_text=True)
+        self.assertIn('"/dashboard/farmacia/eventos"', pagina)
+        self.assertRegex(pagina, r'var ultima = "[0-9a-f]+-\d+";')
+
+        resposta = cliente.get('/dashboard/farmacia/eventos', buffered=False)
+        partes = iter(resposta.response)
+        self.assertTrue(next(partes).startswith(b'retry:'))
+        dados = next(partes).decode('utf-8').split('data: ', 1)[1]
+        self.assertEqual(json.loads(dados)['tipo'], 'estado')
+        resposta.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
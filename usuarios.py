@@ -2,9 +2,109 @@ import uuid # Para gerar IDs únicos
 import hashlib # Para hash de senhas
 import unicodedata # Para normalização de strings
 import os
+import threading
+from utils import arquivos, repositorio
+
+def _normalizar_cpf(texto: str) -> str:
+    """Só os dígitos do CPF ('123.456.789-00' -> '12345678900')."""
+    if not texto: return ''
+    return ''.join(c for c in str(texto) if c.isdigit())
+
+def _cpf_do_usuario(u: dict) -> str:
+    # Pacientes do totem usam o CPF como login (e em <cpf>@paciente.taskflow)
+    for campo in (u.get('login') or '', (u.get('email') or '').split('@')[0]):
+        limpo = campo.replace('.', '').replace('-', '').strip()
+        if limpo.isdigit():
+            return limpo
+    return ''
+
+class _Usuarios(dict):
+    """
+    dict id -> usuário que mantém junto os índices login -> usuário e
+    CPF -> usuário, para login e check-in não percorrerem todos os usuários.
+    Qualquer escrita no dict (cadastro, releitura do arquivo) atualiza os índices.
+
+    Login (ou CPF) repetido: o índice fica com o primeiro registro, como a
+    busca linear de antes. Um cadastro posterior com o mesmo login nunca
+    toma o lugar do original.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.por_login = {}
+        self.por_cpf = {}
+
+    def _chaves(self, u: dict) -> tuple:
+        return ((self.por_login, u.get('login')), (self.por_cpf, _cpf_do_usuario(u)))
+
+    def _indexar(self, u: dict) -> None:
+        for indice, chave in self._chaves(u):
+            if chave and chave not in indice:
+                indice[chave] = u
+
+    def _desindexar(self, u: dict, substituto: dict | None = None) -> None:
+        """
+        Tira `u` dos índices. `substituto` é o registro que ficou no mesmo id
+        (mesma posição no dict): com a mesma chave, ele herda a entrada.
+        Senão o próximo registro com a chave, se houver, passa a valer.
+        """
+        novas = self._chaves(substituto) if substituto is not None else ((None, None), (None, None))
+        for i, ((indice, chave), (_, nova)) in enumerate(zip(self._chaves(u), novas)):
+            if not chave or indice.get(chave) is not u: continue
+            if nova == chave:
+                indice[chave] = substituto
+                continue
+            del indice[chave]
+            # Caso raro (duplicado antigo): varre para achar o próximo
+            for outro in self.values():
+                if self._chaves(outro)[i][1] == chave:
+                    indice[chave] = outro
+                    break
+
+    def __setitem__(self, id_usuario, u):
+        antigo = self.get(id_usuario)
+        super().__setitem__(id_usuario, u)
+        if antigo is not None:
+            self._desindexar(antigo, u)
+        self._indexar(u)
+
+    def __delitem__(self, id_usuario):
+        u = self[id_usuario]
+        super().__delitem__(id_usuario)
+        self._desindexar(u)
+
+    def update(self, *args, **kwargs):
+        for id_usuario, u in dict(*args, **kwargs).items():
+            self[id_usuario] = u
+
+    def __ior__(self, outro):
+        self.update(outro)
+        return self
+
+    def setdefault(self, id_usuario, padrao=None):
+        if id_usuario not in self:
+            self[id_usuario] = padrao
+        return self[id_usuario]
+
+    def pop(self, id_usuario, *padrao):
+        if id_usuario in self:
+            u = self[id_usuario]
+            del self[id_usuario]
+            return u
+        return super().pop(id_usuario, *padrao)
+
+    def popitem(self):
+        id_usuario, u = super().popitem()
+        self._desindexar(u)
+        return id_usuario, u
+
+    def clear(self):
+        super().clear()
+        self.por_login.clear()
+        self.por_cpf.clear()
 
 # Armazena múltiplos usuários por id
-usuarios = {}
+usuarios = _Usuarios()
 
 # Arquivo de persistência
 USUARIOS_FILE = 'usuarios.txt'
@@ -19,61 +119,275 @@ def _unescape(field: str) -> str:
     return field.replace('<PIPE>', '|').replace('<NL>', '\n')
 
 # --- FUNÇÕES DE PERSISTÊNCIA ---
+def _usuario_para_linha(u: dict) -> str:
+    parts = [
+        u.get('id', ''),
+        _escape(u.get('nome', '')),
+        _escape(u.get('email', '')),
+        _escape(u.get('login', '')),
+        _escape(u.get('setor', '')),
+        _escape(u.get('senha', '')),
+        _escape(u.get('data_cadastro', '')),
+        _escape(u.get('crm', '')),
+        _escape(u.get('especialidade', '')),
+        _escape(u.get('disponivel', '')),
+    ]
+    return '|'.join(parts)
+
+def _linha_para_usuario(line: str) -> dict | None:
+    parts = line.split('|')
+    # Garante que temos campos suficientes (mínimo 6 para funcionar login)
+    if len(parts) < 6: return None
+
+    # Preenche com strings vazias se faltar campo no final da linha
+    while len(parts) < 10:
+        parts.append('')
+
+    return {
+        'id': parts[0],
+        'nome': _unescape(parts[1]),
+        'email': _unescape(parts[2]),
+        'login': _unescape(parts[3]),
+        'setor': _unescape(parts[4]),
+        'senha': _unescape(parts[5]),
+        'data_cadastro': _unescape(parts[6]),
+        'crm': _unescape(parts[7]),
+        'especialidade': _unescape(parts[8]),
+        'disponivel': _unescape(parts[9]),
+    }
+
+# Registro de remoção: "<REMOVIDO>|<id>|<id que ficou no lugar>". Tem menos
+# de 6 campos, então versões antigas do loader simplesmente o ignoram.
+_MARCA_REMOVIDO = '<REMOVIDO>'
+
+# Modo append (opcional, como o journal das tarefas): cadastro e alteração
+# viram uma linha anexada a usuarios.txt e a leitura fica com a última linha
+# de cada id. Quando as linhas obsoletas passam do limite, a compactação
+# roda numa thread, fora da requisição.
+USAR_APPEND_USUARIOS = os.environ.get('TASKFLOW_USUARIOS_APPEND', '0') == '1'
+LIMITE_LINHAS_OBSOLETAS_USUARIOS = int(os.environ.get('TASKFLOW_USUARIOS_LIMITE', '1000'))
+
+# id removido (duplicado mesclado) -> id que ficou no lugar
+_aliases = {}
+
+def _linhas_remocao() -> list:
+    return [f"{_MARCA_REMOVIDO}|{antigo}|{novo}\n" for antigo, novo in _aliases.items()]
+
+class _RepositorioUsuariosTexto(repositorio.RepositorioUsuarios):
+    """usuarios.txt: uma linha por usuário, campos separados por pipe."""
+
+    def carregar(self) -> dict:
+        if not os.path.exists(USUARIOS_FILE):
+            return {}
+        with arquivos.trava(USUARIOS_FILE, exclusiva=False):
+            return _ler_usuarios_desde(0)['usuarios']
+
+    def salvar_todos(self, dados: dict) -> None:
+        with arquivos.trava(USUARIOS_FILE):
+            if not USAR_APPEND_USUARIOS:
+                _reescrever_usuarios(dados)
+                return
+            # Anexa só quem mudou desde a última gravação/leitura, e a
+            # remoção de quem saiu do dicionário
+            atualizar_usuarios()
+            with _diretorio_lock:
+                linhas = []
+                for u in list(dados.values()):
+                    linha = _usuario_para_linha(u) + '\n'
+                    if _versoes.get(u['id']) != hash(linha):
+                        linhas.append(linha)
+                for id_usuario in [i for i in _versoes if i not in dados]:
+                    linhas.append(f"{_MARCA_REMOVIDO}|{id_usuario}|\n")
+                _anexar_usuarios(linhas)
+
+    def salvar(self, usuario: dict, dados: dict) -> None:
+        # Antes, sob a trava exclusiva, traz o que outros workers gravaram,
+        # para não perder nada nem reler a própria escrita depois.
+        with arquivos.trava(USUARIOS_FILE):
+            atualizar_usuarios()
+            dados[usuario['id']] = usuario
+            if not USAR_APPEND_USUARIOS:
+                _reescrever_usuarios(dados)
+                return
+            with _diretorio_lock:
+                _anexar_usuarios([_usuario_para_linha(usuario) + '\n'])
+
+_REPOSITORIO_TEXTO = _RepositorioUsuariosTexto()
+_REPOSITORIO_SQLITE = repositorio.RepositorioUsuariosSQLite()
+
+def _repositorio_usuarios() -> repositorio.RepositorioUsuarios:
+    """Backend escolhido em utils.repositorio.BACKEND (texto ou sqlite)."""
+    if repositorio.usando_sqlite(): return _REPOSITORIO_SQLITE
+    return _REPOSITORIO_TEXTO
+
 def _save_usuarios_to_file() -> None:
     try:
-        with open(USUARIOS_FILE, 'w', encoding='utf-8') as f:
-            for u in usuarios.values():
-                parts = [
-                    u.get('id', ''),
-                    _escape(u.get('nome', '')),
-                    _escape(u.get('email', '')),
-                    _escape(u.get('login', '')),
-                    _escape(u.get('setor', '')),
-                    _escape(u.get('senha', '')),
-                    _escape(u.get('data_cadastro', '')),
-                    _escape(u.get('crm', '')),
-                    _escape(u.get('especialidade', '')),
-                    _escape(u.get('disponivel', '')),
-                ]
-                f.write('|'.join(parts) + '\n')
+        _repositorio_usuarios().salvar_todos(usuarios)
     except Exception as e:
         print(f"Erro ao salvar usuários: {e}")
 
-def _load_usuarios_from_file() -> None:
-    if not os.path.exists(USUARIOS_FILE):
-        return
+def _salvar_usuario(usuario: dict) -> None:
+    try:
+        _repositorio_usuarios().salvar(usuario, usuarios)
+    except Exception as e:
+        print(f"Erro ao salvar usuários: {e}")
 
+def _load_usuarios_from_file() -> None:
     try:
-        with open(USUARIOS_FILE, 'r', encoding='utf-8') as f:
-            for line in f:
-                line = line.strip()
-                if not line: continue
-                
-                parts = line.split('|')
-                # Garante que temos campos suficientes (mínimo 6 para funcionar login)
-                if len(parts) < 6: continue
-                
-                # Preenche com strings vazias se faltar campo no final da linha
-                while len(parts) < 10:
-                    parts.append('')
-
-                id_u = parts[0]
-                
-                usuarios[id_u] = {
-                    'id': id_u,
-                    'nome': _unescape(parts[1]),
-                    'email': _unescape(parts[2]),
-                    'login': _unescape(parts[3]),
-                    'setor': _unescape(parts[4]),
-                    'senha': _unescape(parts[5]),
-                    'data_cadastro': _unescape(parts[6]),
-                    'crm': _unescape(parts[7]),
-                    'especialidade': _unescape(parts[8]),
-                    'disponivel': _unescape(parts[9]),
-                }
+        if repositorio.usando_sqlite():
+            _versao_sqlite.conexao = None
+            atualizar_usuarios()
+            return
+        with _diretorio_lock:
+            _diretorio.update(assinatura=None, offset=0, linhas=0)
+            _versoes.clear()
+        atualizar_usuarios()
     except Exception as e:
         print(f"Erro ao carregar usuários: {e}")
 
+# --- DIRETÓRIO DE USUÁRIOS ENTRE WORKERS ---
+# Cada worker do gunicorn tem sua cópia de `usuarios`. Antes de cada consulta
+# o stat de usuarios.txt diz se outro worker gravou: se o arquivo só cresceu
+# (cadastro anexado), lê apenas as linhas novas; se foi trocado (os.replace),
+# relê tudo. Ordem das travas: arquivo primeiro, depois _diretorio_lock.
+
+_diretorio_lock = threading.RLock()
+_diretorio = {'assinatura': None, 'offset': 0, 'linhas': 0}
+_versoes = {}  # id -> hash da última linha gravada do usuário
+# No SQLite o aviso é o PRAGMA data_version, que só muda quando *outra*
+# conexão grava. Cada thread tem a sua conexão, então a marca é por thread.
+_versao_sqlite = threading.local()
+_compactacao_usuarios = {'thread': None}
+
+def _assinatura_usuarios():
+    try:
+        st = os.stat(USUARIOS_FILE)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+def _ler_usuarios_desde(inicio: int) -> dict:
+    """
+    Lê usuarios.txt a partir do byte `inicio`. Vale a última linha de cada id.
+    Retorna {'usuarios', 'removidos' (id -> id que ficou), 'versoes', 'linhas', 'offset'}.
+    """
+    with open(USUARIOS_FILE, 'rb') as f:
+        f.seek(inicio)
+        dados = f.read()
+    fim = dados.rfind(b'\n') + 1  # ignora uma linha final ainda incompleta
+    lidos = {}
+    removidos = {}
+    versoes = {}
+    quantidade = 0
+    for line in dados[:fim].decode('utf-8').split('\n'):
+        line = line.strip()
+        if not line: continue
+        quantidade += 1
+        if line.startswith(_MARCA_REMOVIDO + '|'):
+            parts = line.split('|')
+            lidos.pop(parts[1], None)
+            versoes.pop(parts[1], None)
+            removidos[parts[1]] = parts[2] if len(parts) > 2 else ''
+            continue
+        u = _linha_para_usuario(line)
+        if u is not None:
+            lidos[u['id']] = u
+            versoes[u['id']] = hash(line + '\n')
+            removidos.pop(u['id'], None)
+    return {'usuarios': lidos, 'removidos': removidos, 'versoes': versoes,
+            'linhas': quantidade, 'offset': inicio + fim}
+
+def _substituir_usuarios(lidos: dict) -> None:
+    """Deixa em `usuarios` só o que está em `lidos`, sem esvaziar o dict no meio."""
+    for id_usuario in [i for i in list(usuarios) if i not in lidos]:
+        usuarios.pop(id_usuario, None)
+    usuarios.update(lidos)
+
+def _atualizar_usuarios_sqlite() -> None:
+    con = repositorio.conexao()
+    versao = con.execute('PRAGMA data_version').fetchone()[0]
+    if getattr(_versao_sqlite, 'conexao', None) is con and _versao_sqlite.valor == versao: return
+    # Conexão nova (thread nova ou reaberta) não sabe o que perdeu: relê tudo
+    lidos = _REPOSITORIO_SQLITE.carregar()
+    with _diretorio_lock:
+        _substituir_usuarios(lidos)
+    _versao_sqlite.conexao, _versao_sqlite.valor = con, versao
+
+def atualizar_usuarios() -> None:
+    """Traz para `usuarios` o que foi gravado em usuarios.txt (ou no SQLite) por outro processo."""
+    if repositorio.usando_sqlite():
+        _atualizar_usuarios_sqlite()
+        return
+    with _diretorio_lock:
+        if _assinatura_usuarios() == _diretorio['assinatura']: return
+    with arquivos.trava(USUARIOS_FILE, exclusiva=False), _diretorio_lock:
+        assinatura = _assinatura_usuarios()
+        anterior = _diretorio['assinatura']
+        if assinatura == anterior: return
+        incremental = (anterior is not None and assinatura is not None
+                       and assinatura[0] == anterior[0] and assinatura[1] >= _diretorio['offset'])
+        if not incremental:
+            _versoes.clear()
+            _diretorio['linhas'] = 0
+        if assinatura is None:
+            lido = {'usuarios': {}, 'removidos': {}, 'versoes': {}, 'linhas': 0, 'offset': 0}
+        else:
+            lido = _ler_usuarios_desde(_diretorio['offset'] if incremental else 0)
+        if incremental:
+            usuarios.update(lido['usuarios'])
+        else:
+            # Releitura inteira: quem saiu do arquivo sai também da memória
+            _substituir_usuarios(lido['usuarios'])
+        for antigo, novo in lido['removidos'].items():
+            usuarios.pop(antigo, None)
+            _versoes.pop(antigo, None)
+            if novo:
+                _aliases[antigo] = novo
+        _versoes.update(lido['versoes'])
+        _diretorio['linhas'] += lido['linhas']
+        _diretorio['assinatura'] = assinatura
+        _diretorio['offset'] = lido['offset']
+
+def _anexar_usuarios(linhas: list) -> None:
+    """Anexa linhas já formatadas. Chamar com a trava exclusiva e _diretorio_lock."""
+    if not linhas: return
+    dados = ''.join(linhas).encode('utf-8')
+    with open(USUARIOS_FILE, 'ab') as f:
+        f.write(dados)
+    for linha in linhas:
+        if linha.startswith(_MARCA_REMOVIDO + '|'):
+            _versoes.pop(linha.split('|')[1], None)
+        else:
+            _versoes[linha.split('|', 1)[0]] = hash(linha)
+    _diretorio['offset'] += len(dados)
+    _diretorio['linhas'] += len(linhas)
+    _diretorio['assinatura'] = _assinatura_usuarios()
+    # Obsoletas: linhas de versões antigas e remoções sem destino
+    if _diretorio['linhas'] - len(_versoes) - len(_aliases) > LIMITE_LINHAS_OBSOLETAS_USUARIOS:
+        _agendar_compactacao_usuarios()
+
+def _reescrever_usuarios(dados: dict) -> None:
+    """Reescreve usuarios.txt inteiro (troca atômica). Chamar com a trava exclusiva."""
+    with _diretorio_lock:
+        linhas = [_usuario_para_linha(u) + '\n' for u in list(dados.values())]
+        arquivos.escrever_atomico(USUARIOS_FILE, linhas + _linhas_remocao())
+        if dados is usuarios:
+            _versoes.clear()
+            _versoes.update((linha.split('|', 1)[0], hash(linha)) for linha in linhas)
+            _diretorio['linhas'] = len(linhas) + len(_aliases)
+            _diretorio['assinatura'] = _assinatura_usuarios()
+            _diretorio['offset'] = _diretorio['assinatura'][1]
+        else:
+            _diretorio['assinatura'] = None
+
+def _agendar_compactacao_usuarios() -> None:
+    """Roda compactar_usuarios numa thread separada, fora do caminho da requisição."""
+    thread = _compactacao_usuarios['thread']
+    if thread is not None and thread.is_alive(): return
+    thread = threading.Thread(target=compactar_usuarios, daemon=True)
+    _compactacao_usuarios['thread'] = thread
+    thread.start()
+
 def _hash_senha(senha: str) -> str:
     return hashlib.sha256(senha.encode('utf-8')).hexdigest()
 
@@ -110,42 +424,108 @@ def cadastrar_usuario(nome: str | None = None, login: str | None = None, email:
     key = _normalize(setor)
     setor_normalizado = allowed.get(key, setor) # Usa o que digitou se não achar no mapa
 
-    # Verifica se login já existe
-    if buscar_usuario_por_login(login):
-        print(f"AVISO: O login '{login}' já está em uso. Atualizando dados...")
-        # (Opcional: poderia levantar erro, mas aqui atualiza)
+    # Trava exclusiva: dois workers cadastrando o mesmo login não criam dois ids
+    with arquivos.trava(USUARIOS_FILE):
+        # Login existente nunca é sobrescrito (senha e setor são do dono)
+        if buscar_usuario_por_login(login):
+            raise ValueError("Login já existe")
 
-    novo_id = str(uuid.uuid4())
-    
-    novo_usuario = {
-        'id': novo_id,
-        'nome': nome,
-        'email': email,
-        'login': login,
-        'setor': setor_normalizado,
-        'senha': _hash_senha(senha),
-        'data_cadastro': '',
-        'crm': crm or '',
-        'especialidade': especialidade or '',
-        'disponivel': 'true' if disponivel else 'false',
-    }
-    
-    usuarios[novo_id] = novo_usuario
-    _save_usuarios_to_file()
+        novo_id = str(uuid.uuid4())
+        
+        novo_usuario = {
+            'id': novo_id,
+            'nome': nome,
+            'email': email,
+            'login': login,
+            'setor': setor_normalizado,
+            'senha': _hash_senha(senha),
+            'data_cadastro': '',
+            'crm': crm or '',
+            'especialidade': especialidade or '',
+            'disponivel': 'true' if disponivel else 'false',
+        }
+        
+        usuarios[novo_id] = novo_usuario
+        _salvar_usuario(novo_usuario)
     return novo_usuario
 
+def cadastrar_paciente(nome: str, cpf: str, email: str | None = None) -> dict:
+    """
+    Cadastro do totem: cria o paciente (login e senha inicial = CPF) ou, se o
+    CPF já é de um paciente, atualiza só os dados dele (nome, email) no mesmo
+    id. Senha e setor nunca mudam aqui, e cadastros que não são de paciente
+    (funcionário com o CPF como login) ficam como estão.
+    """
+    cpf = _normalizar_cpf(cpf)
+    if not (nome and cpf):
+        raise ValueError("Nome e CPF são obrigatórios.")
+    with arquivos.trava(USUARIOS_FILE):
+        existente = buscar_usuario_por_cpf(cpf)
+        if existente is None:
+            return cadastrar_usuario(nome=nome, login=cpf, senha=cpf,
+                                     email=email or f"{cpf}@paciente.taskflow", setor='paciente')
+        if existente.get('setor') != 'paciente':
+            return existente
+        atualizado = dict(existente, nome=nome, email=email or existente.get('email', ''))
+        if atualizado != existente:
+            # Persiste como uma linha anexada (a última linha de cada id vale)
+            usuarios[atualizado['id']] = atualizado
+            _salvar_usuario(atualizado)
+        return atualizado
+
+def compactar_usuarios() -> int:
+    """
+    Mescla logins duplicados (cadastros antigos, de antes da checagem de
+    login) e reescreve usuarios.txt com uma linha por usuário. Fica o
+    primeiro registro de cada login, o mesmo que o login já usa; os ids
+    removidos viram registros <REMOVIDO> apontando para ele, para
+    obter_usuario continuar achando quem os referencia em tarefas.
+    
+    Returns:
+        Quantidade de registros duplicados removidos
+    """
+    with arquivos.trava(USUARIOS_FILE):
+        atualizar_usuarios()
+        primeiro_por_login = {}
+        for u in list(usuarios.values()):
+            if u.get('login'):
+                primeiro_por_login.setdefault(u['login'], u['id'])
+        duplicados = [u['id'] for u in list(usuarios.values())
+                      if u.get('login') and primeiro_por_login[u['login']] != u['id']]
+        for id_duplicado in duplicados:
+            _aliases[id_duplicado] = primeiro_por_login[usuarios.pop(id_duplicado)['login']]
+        # Aliases encadeados (a -> b -> c) passam a apontar direto para o final
+        for antigo in _aliases:
+            while _aliases[antigo] in _aliases:
+                _aliases[antigo] = _aliases[_aliases[antigo]]
+        if repositorio.usando_sqlite():
+            _save_usuarios_to_file()
+        else:
+            _reescrever_usuarios(usuarios)
+    return len(duplicados)
+
 def obter_usuario(id_usuario: str) -> dict | None:
-    return usuarios.get(id_usuario)
+    atualizar_usuarios()
+    usuario = usuarios.get(id_usuario)
+    if usuario is None and id_usuario in _aliases:
+        usuario = usuarios.get(_aliases[id_usuario])
+    return usuario
 
 def listar_usuarios() -> list[dict]:
+    atualizar_usuarios()
     return list(usuarios.values())
 
 def buscar_usuario_por_login(login: str) -> dict | None:
     if not login: return None
-    for u in usuarios.values():
-        if u.get('login') == login:
-            return u
-    return None
+    atualizar_usuarios()
+    return usuarios.por_login.get(login)
+
+def buscar_usuario_por_cpf(cpf: str) -> dict | None:
+    """Paciente pelo CPF, com ou sem pontuação."""
+    chave = _normalizar_cpf(cpf)
+    if not chave: return None
+    atualizar_usuarios()
+    return usuarios.por_cpf.get(chave)
 
 def realizar_login(login: str | None = None, senha: str | None = None) -> dict | None:
     if login is None:
@@ -172,10 +552,15 @@ def realizar_login(login: str | None = None, senha: str | None = None) -> dict |
 
 def listar_especialidades() -> list[str]:
     especialidades = set()
-    for u in usuarios.values():
+    for u in listar_usuarios():
         if u.get('setor') == 'médico' and u.get('especialidade'):
             especialidades.add(u.get('especialidade'))
     return sorted(list(especialidades))
 
 # Carrega ao iniciar
-_load_usuarios_from_file()
\ No newline at end of file
+_load_usuarios_from_file()
+
+if __name__ == '__main__':
+    # Compactação avulsa: python usuarios.py
+    removidos = compactar_usuarios()
+    print(f"✓ {len(usuarios)} usuários; {removidos} cadastros duplicados mesclados.")
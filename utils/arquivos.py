@@ -5,6 +5,95 @@ Responsável por salvar e carregar dados de usuários e tarefas em formato texto
 """
 
 import os
+import mmap
+import bisect
+import tempfile
+import threading
+from array import array
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: sem travas entre processos
+    fcntl = None
+
+
+# --- TRAVAS ENTRE PROCESSOS ---
+# Cada arquivo de dados tem um <arquivo>.lock ao lado. Leitores pegam trava
+# compartilhada e escritores trava exclusiva (flock), o que permite rodar o
+# gunicorn com vários workers na mesma máquina. A trava é reentrante dentro
+# da mesma thread.
+
+_travas_da_thread = threading.local()
+
+
+@contextmanager
+def trava(nome_arquivo: str, exclusiva: bool = True):
+    """
+    Trava o arquivo para leitura (compartilhada) ou escrita (exclusiva).
+    
+    Args:
+        nome_arquivo: Arquivo de dados protegido
+        exclusiva: True para escrita, False para leitura
+    """
+    if fcntl is None:
+        yield
+        return
+
+    caminho = os.path.abspath(nome_arquivo) + '.lock'
+    abertas = getattr(_travas_da_thread, 'abertas', None)
+    if abertas is None:
+        abertas = _travas_da_thread.abertas = {}
+
+    atual = abertas.get(caminho)
+    if atual is not None:
+        # Já travado por esta thread. Promover leitura para escrita não é
+        # atômico no flock (outro processo pode gravar no meio, e o que foi
+        # lido sob a trava compartilhada fica velho): quem vai gravar pega a
+        # trava exclusiva desde o início.
+        if exclusiva and not atual['exclusiva']:
+            raise RuntimeError(f"Trava de escrita pedida dentro de uma trava de leitura: {nome_arquivo}")
+        yield
+        return
+
+    fd = os.open(caminho, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX if exclusiva else fcntl.LOCK_SH)
+        abertas[caminho] = {'fd': fd, 'exclusiva': exclusiva}
+        try:
+            yield
+        finally:
+            del abertas[caminho]
+            fcntl.flock(fd, fcntl.LOCK_UN)
+    finally:
+        os.close(fd)
+
+
+def escrever_atomico(nome_arquivo: str, linhas) -> None:
+    """
+    Grava as linhas num arquivo temporário da mesma pasta e troca pelo
+    original com os.replace. Quem lê vê o arquivo antigo ou o novo, nunca
+    um arquivo pela metade.
+    
+    Args:
+        nome_arquivo: Arquivo de destino
+        linhas: Iterável de strings (já com '\n')
+    """
+    pasta = os.path.dirname(os.path.abspath(nome_arquivo))
+    fd, temporario = tempfile.mkstemp(dir=pasta, prefix='.' + os.path.basename(nome_arquivo) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            for linha in linhas:
+                f.write(linha)
+        try:
+            os.chmod(temporario, os.stat(nome_arquivo).st_mode & 0o777)
+        except OSError:
+            os.chmod(temporario, 0o644)
+        os.replace(temporario, nome_arquivo)
+    except BaseException:
+        if os.path.exists(temporario):
+            os.remove(temporario)
+        raise
 
 
 def carregar_dados(nome_arquivo: str) -> list:
@@ -23,8 +112,9 @@ def carregar_dados(nome_arquivo: str) -> list:
         return []
         
     try:
-        with open(nome_arquivo, 'r', encoding='utf-8') as f:
-            linhas = f.readlines()
+        with trava(nome_arquivo, exclusiva=False):
+            with open(nome_arquivo, 'r', encoding='utf-8') as f:
+                linhas = f.readlines()
             
         if not linhas:
             return []
@@ -76,18 +166,18 @@ def salvar_dados(dados: list, nome_arquivo: str) -> bool:
     try:
         if not dados:
             # Se a lista está vazia, cria apenas o arquivo vazio
-            with open(nome_arquivo, 'w', encoding='utf-8') as f:
-                pass
+            with trava(nome_arquivo):
+                escrever_atomico(nome_arquivo, [])
             return True
         
         # Pega os cabeçalhos (chaves) do primeiro registro
         cabecalhos = list(dados[0].keys())
         
-        with open(nome_arquivo, 'w', encoding='utf-8') as f:
-            # Escreve a linha de cabeçalho
-            f.write('|'.join(cabecalhos) + '\n')
+        def _linhas():
+            # Linha de cabeçalho
+            yield '|'.join(cabecalhos) + '\n'
             
-            # Escreve cada registro
+            # Cada registro
             for registro in dados:
                 valores = []
                 for cabecalho in cabecalhos:
@@ -95,7 +185,11 @@ def salvar_dados(dados: list, nome_arquivo: str) -> bool:
                     # Converte None para string 'None'
                     valores.append(str(valor) if valor is not None else 'None')
                 
-                f.write('|'.join(valores) + '\n')
+                yield '|'.join(valores) + '\n'
+        
+        # Grava em arquivo temporário e troca de uma vez, com trava exclusiva
+        with trava(nome_arquivo):
+            escrever_atomico(nome_arquivo, _linhas())
         
         return True
         
@@ -105,4 +199,149 @@ def salvar_dados(dados: list, nome_arquivo: str) -> bool:
     
     except Exception as e:
         print(f'Erro ao processar dados para salvar: {e}')
-        return False
\ No newline at end of file
+        return False
+
+
+# --- LEITURA MAPEADA EM MEMÓRIA (mmap) ---
+# Para buscas pontuais em arquivos grandes: em vez de montar um dict por
+# linha como carregar_dados, mapeia o arquivo, guarda só o offset de cada
+# linha e decodifica um registro quando ele é pedido. Vale para arquivos
+# gravados por salvar_dados, que sempre troca o arquivo inteiro
+# (os.replace): o mapeamento antigo continua íntegro e a próxima
+# abrir_mapeado() vê o inode novo. Hoje só medicos.obter_medico usa, e
+# nenhuma rota do app chama obter_medico ainda (médicos vêm de usuarios).
+
+# Os mesmos bytes que bytes.strip() corta
+_BRANCOS = b' \t\n\r\x0b\x0c'
+
+class ArquivoMapeado:
+    """
+    Sequência somente leitura dos registros de um arquivo pipe com
+    cabeçalho: len(), [i] (dict, como em carregar_dados), fatias e for.
+    """
+
+    def __init__(self, nome_arquivo: str):
+        self.nome_arquivo = nome_arquivo
+        self.cabecalhos = []
+        self._inicios = array('q')
+        self._fins = array('q')
+        self._dados = b''
+        if not os.path.exists(nome_arquivo): return
+        with trava(nome_arquivo, exclusiva=False):
+            with open(nome_arquivo, 'rb') as f:
+                if os.fstat(f.fileno()).st_size:
+                    self._dados = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._indexar()
+
+    def _indexar(self) -> None:
+        dados, tamanho = self._dados, len(self._dados)
+        inicio = 0
+        primeira = True
+        while inicio < tamanho:
+            fim = dados.find(b'\n', inicio)
+            if fim < 0: fim = tamanho
+            # Mesmo corte de carregar_dados (linha.strip()), só que andando
+            # os offsets no próprio mmap, sem copiar a linha
+            a, b = inicio, fim
+            while a < b and dados[a] in _BRANCOS: a += 1
+            while b > a and dados[b - 1] in _BRANCOS: b -= 1
+            if primeira:
+                self.cabecalhos = dados[a:b].decode('utf-8').split('|')
+                primeira = False
+            elif a < b:
+                self._inicios.append(a)
+                self._fins.append(b)
+            inicio = fim + 1
+
+    def __len__(self):
+        return len(self._inicios)
+
+    def __getitem__(self, posicao):
+        if isinstance(posicao, slice):
+            return [self._registro(i) for i in range(*posicao.indices(len(self)))]
+        if posicao < 0: posicao += len(self)
+        if not 0 <= posicao < len(self): raise IndexError(posicao)
+        return self._registro(posicao)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self._registro(i)
+
+    def _campos(self, posicao: int):
+        """Gera (inicio, fim) de cada campo da linha, sem copiar bytes."""
+        dados, inicio, fim = self._dados, self._inicios[posicao], self._fins[posicao]
+        while True:
+            separador = dados.find(b'|', inicio, fim)
+            if separador < 0:
+                yield inicio, fim
+                return
+            yield inicio, separador
+            inicio = separador + 1
+
+    def _registro(self, posicao: int) -> dict:
+        registro = dict.fromkeys(self.cabecalhos)
+        for cabecalho, (a, b) in zip(self.cabecalhos, self._campos(posicao)):
+            valor = self._dados[a:b].decode('utf-8')
+            # Converte 'None' string para None real
+            registro[cabecalho] = None if valor == 'None' else valor
+        return registro
+
+    def buscar(self, campo: str, valor: str):
+        """Primeiro registro com `campo` igual a `valor` (comparando bytes: só ele é decodificado)."""
+        if campo not in self.cabecalhos: return None
+        coluna = self.cabecalhos.index(campo)
+        alvo = str(valor).encode('utf-8')
+        if not alvo or b'|' in alvo or b'\n' in alvo:
+            # Valor que não dá para achar direto nos bytes: linha a linha
+            for posicao in range(len(self)):
+                for i, (a, b) in enumerate(self._campos(posicao)):
+                    if i == coluna:
+                        if self._dados[a:b] == alvo: return self._registro(posicao)
+                        break
+            return None
+        # Procura os bytes do valor no arquivo todo (find em C) e confere se a
+        # ocorrência é o campo inteiro, na coluna certa
+        dados = self._dados
+        inicio = self._inicios[0] if len(self) else len(dados)
+        while True:
+            achado = dados.find(alvo, inicio)
+            if achado < 0: return None
+            inicio = achado + 1
+            posicao = bisect.bisect_right(self._inicios, achado) - 1
+            if posicao < 0: continue
+            linha_inicio, linha_fim = self._inicios[posicao], self._fins[posicao]
+            fim = achado + len(alvo)
+            if fim > linha_fim or (fim != linha_fim and dados[fim] != ord('|')): continue
+            campo_inicio = linha_inicio
+            for _ in range(coluna):
+                campo_inicio = dados.find(b'|', campo_inicio, achado) + 1
+                if not campo_inicio: break
+            if campo_inicio == achado:
+                return self._registro(posicao)
+
+
+_mapeados = {}  # caminho -> (assinatura do arquivo, ArquivoMapeado)
+_mapeados_lock = threading.Lock()
+
+
+def abrir_mapeado(nome_arquivo: str) -> ArquivoMapeado:
+    """
+    ArquivoMapeado do arquivo, reaproveitado enquanto ele não muda no disco
+    (mtime, tamanho e inode): os offsets das linhas são calculados uma vez.
+    """
+    caminho = os.path.abspath(nome_arquivo)
+    try:
+        st = os.stat(caminho)
+        assinatura = (st.st_mtime_ns, st.st_size, st.st_ino)
+    except OSError:
+        assinatura = None
+    with _mapeados_lock:
+        guardado = _mapeados.get(caminho)
+        if guardado and guardado[0] == assinatura:
+            return guardado[1]
+    mapeado = ArquivoMapeado(nome_arquivo)
+    # No Windows um arquivo mapeado não pode ser substituído: não fica guardado
+    if assinatura is not None and os.name != 'nt':
+        with _mapeados_lock:
+            _mapeados[caminho] = (assinatura, mapeado)
+    return mapeado
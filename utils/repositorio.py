@@ -0,0 +1,701 @@
+"""
+Camada de repositório da persistência.
+Desenvolvido por: Dev 4
+Define as interfaces usadas por tarefas.py, usuarios.py e web/atendimentos.py
+e a implementação em SQLite. A implementação em arquivos texto continua em
+cada módulo; o backend ativo é escolhido pela variável TASKFLOW_BACKEND.
+"""
+
+import heapq
+import json
+import os
+import sqlite3
+import threading
+import unicodedata
+from contextlib import contextmanager
+
+BACKEND_TEXTO = 'texto'
+BACKEND_SQLITE = 'sqlite'
+
+# Backend ativo: 'texto' (padrão, arquivos .txt) ou 'sqlite'
+BACKEND = os.environ.get('TASKFLOW_BACKEND', BACKEND_TEXTO).strip().lower()
+ARQUIVO_SQLITE = os.environ.get('TASKFLOW_SQLITE_ARQUIVO', 'taskflow.db')
+
+
+def usando_sqlite() -> bool:
+    """Indica se o backend configurado é o SQLite."""
+    return BACKEND == BACKEND_SQLITE
+
+
+def normalizar_chave(texto) -> str:
+    """
+    Normaliza textos usados como chave de busca (setor, status...).
+
+    Remove acentos, espaços nas pontas e converte para minúsculas, de modo que
+    'Farmácia', 'farmacia' e ' FARMÁCIA ' resultem na mesma chave.
+    """
+    if texto is None:
+        return ''
+    return unicodedata.normalize('NFKD', str(texto)).encode('ASCII', 'ignore').decode().lower().strip()
+
+
+def grupo_tarefa(tarefa: dict) -> tuple:
+    """(setor normalizado, responsavel): a unidade dos contadores e das tarefas recentes dos painéis."""
+    return (normalizar_chave(tarefa.get('setor')), tarefa.get('responsavel') or '')
+
+
+_dias_ordenaveis = {}  # 'dd/mm/AAAA' -> AAAAMMDD (poucas datas distintas, muitas tarefas)
+
+
+def chave_recencia(tarefa: dict, posicao: int) -> tuple:
+    """
+    Ordena as tarefas da mais antiga para a mais recente: pela data de
+    criação (dd/mm/AAAA) e, no mesmo dia, pela posição de inserção.
+    """
+    data = str(tarefa.get('data_criacao') or '')[:10]
+    dia = _dias_ordenaveis.get(data)
+    if dia is None:
+        digitos = data[6:10] + data[3:5] + data[0:2]
+        dia = _dias_ordenaveis[data] = int(digitos) if len(digitos) == 8 and digitos.isdigit() else 0
+    return (dia, posicao)
+
+
+def dia_ordenavel(data) -> int:
+    """datetime.date -> AAAAMMDD, a mesma escala do primeiro item de chave_recencia."""
+    return data.year * 10000 + data.month * 100 + data.day
+
+
+def filtro_pagina(incluir=None, setor=None, status=None, busca=None):
+    """
+    filtro(tarefa) dos filtros de RepositorioTarefas.pagina(), menos o
+    período (que cada backend aplica pela chave de recência).
+    """
+    setor = normalizar_chave(setor) if setor else None
+    status = normalizar_chave(status) if status else None
+    busca = normalizar_chave(busca) if busca else None
+
+    def filtro(tarefa):
+        if setor is not None and normalizar_chave(tarefa.get('setor')) != setor: return False
+        if status is not None and normalizar_chave(tarefa.get('status')) != status: return False
+        if incluir is not None and not incluir(*grupo_tarefa(tarefa)): return False
+        if busca is not None:
+            texto = ' '.join(str(tarefa.get(campo) or '') for campo in ('titulo', 'descricao', 'paciente_nome'))
+            if busca not in normalizar_chave(texto): return False
+        return True
+    return filtro
+
+
+def cursor_pagina(tarefa: dict) -> str:
+    """Cursor 'AAAAMMDD.id' da última tarefa de uma página; o mesmo em qualquer worker."""
+    return f"{chave_recencia(tarefa, 0)[0]}.{tarefa.get('id') or ''}"
+
+
+def ler_cursor(cursor):
+    """(dia, id) de um cursor_pagina(); None se ele não tem o formato."""
+    dia, _, id_tarefa = (cursor or '').partition('.')
+    if not dia.isdigit():
+        return None
+    return int(dia), id_tarefa
+
+
+# --- INTERFACES ---
+
+class RepositorioTarefas:
+    """Contrato de armazenamento das tarefas."""
+
+    def carregar(self) -> list:
+        """Retorna todas as tarefas, na ordem de criação."""
+        raise NotImplementedError
+
+    def salvar(self, tarefas: list) -> bool:
+        """Persiste a lista de tarefas (o que sumiu dela desde o carregar() é removido)."""
+        raise NotImplementedError
+
+    def iterar(self):
+        """Tarefas uma a uma, na ordem de criação (sem montar a lista inteira quando o backend permite)."""
+        return iter(self.carregar())
+
+    def obter(self, id_tarefa: str):
+        for tarefa in self.carregar():
+            if tarefa.get('id') == id_tarefa:
+                return tarefa
+        return None
+
+    def por_atendimento(self, atendimento_token: str) -> list:
+        return [t for t in self.carregar() if t.get('atendimento_token') == atendimento_token]
+
+    def por_setor(self, setor: str, status: str = None) -> list:
+        chave_setor = normalizar_chave(setor)
+        chave_status = normalizar_chave(status) if status is not None else None
+        return [
+            t for t in self.carregar()
+            if normalizar_chave(t.get('setor')) == chave_setor
+            and (chave_status is None or normalizar_chave(t.get('status')) == chave_status)
+        ]
+
+    def por_responsavel(self, id_usuario: str) -> list:
+        """Tarefas atribuídas ao usuário ou concluídas por ele."""
+        return [
+            t for t in self.carregar()
+            if t.get('responsavel') == id_usuario or t.get('concluida_por') == id_usuario
+        ]
+
+    def por_setor_ou_responsavel(self, setor: str, id_usuario: str) -> list:
+        """União de por_setor(setor) e por_responsavel(id_usuario), sem repetição."""
+        chave_setor = normalizar_chave(setor)
+        return [
+            t for t in self.carregar()
+            if normalizar_chave(t.get('setor')) == chave_setor
+            or t.get('responsavel') == id_usuario or t.get('concluida_por') == id_usuario
+        ]
+
+    def contar(self, incluir) -> dict:
+        """
+        Status normalizado -> quantidade, contando só as tarefas cujo
+        grupo_tarefa() é aceito por incluir(setor, responsavel).
+        """
+        contagem = {}
+        for tarefa in self.iterar():
+            if incluir(*grupo_tarefa(tarefa)):
+                status = normalizar_chave(tarefa.get('status'))
+                contagem[status] = contagem.get(status, 0) + 1
+        return contagem
+
+    def recentes(self, incluir, quantidade: int = 10) -> list:
+        """As `quantidade` tarefas mais recentes (chave_recencia) desses grupos, da mais nova para a mais antiga."""
+        itens = ((chave_recencia(t, i), t) for i, t in enumerate(self.iterar()) if incluir(*grupo_tarefa(t)))
+        return [t for _, t in heapq.nlargest(quantidade, itens, key=lambda item: item[0])]
+
+    def pagina(self, incluir=None, apos=None, quantidade: int = 50, setor=None, status=None,
+               inicio=None, fim=None, busca=None) -> tuple:
+        """
+        Uma página de tarefas, da mais recente para a mais antiga
+        (chave_recencia), e o cursor da próxima (None na última).
+
+        Args:
+            incluir: incluir(setor, responsavel) dos grupos visíveis (ver grupo_tarefa)
+            apos: cursor devolvido pela página anterior
+            setor, status: iguais a (normalizados)
+            inicio, fim: datetime.date; período da data de criação, inclusivo
+            busca: trecho do título, da descrição ou do nome do paciente
+        """
+        filtro = filtro_pagina(incluir, setor, status, busca)
+        menor = dia_ordenavel(inicio) if inicio else None
+        maior = dia_ordenavel(fim) if fim else None
+        cursor = ler_cursor(apos)
+        limite = None
+        itens = []
+        for i, tarefa in enumerate(self.iterar()):
+            chave = chave_recencia(tarefa, i)
+            if cursor is not None and cursor[1] and tarefa.get('id') == cursor[1]:
+                limite = chave
+            if (menor is None or chave[0] >= menor) and (maior is None or chave[0] <= maior) and filtro(tarefa):
+                itens.append((chave, tarefa))
+        if cursor is not None and limite is None:
+            limite = (cursor[0] + 1, -1)  # a tarefa do cursor sumiu: recomeça o dia dela
+        if limite is not None:
+            itens = [item for item in itens if item[0] < limite]
+        itens = heapq.nlargest(quantidade + 1, itens, key=lambda item: item[0])
+        return fechar_pagina([t for _, t in itens], quantidade)
+
+
+def fechar_pagina(tarefas: list, quantidade: int) -> tuple:
+    """(página, cursor da próxima) a partir de até quantidade + 1 tarefas."""
+    if len(tarefas) <= quantidade:
+        return tarefas, None
+    return tarefas[:quantidade], cursor_pagina(tarefas[quantidade - 1])
+
+
+class RepositorioUsuarios:
+    """Contrato de armazenamento dos usuários."""
+
+    def carregar(self) -> dict:
+        """Retorna um dicionário id -> usuário."""
+        raise NotImplementedError
+
+    def salvar_todos(self, usuarios: dict) -> None:
+        """Substitui o conteúdo armazenado pelo dicionário informado."""
+        raise NotImplementedError
+
+    def salvar(self, usuario: dict, usuarios: dict) -> None:
+        """
+        Persiste um usuário novo ou alterado.
+
+        Args:
+            usuario: Registro que mudou
+            usuarios: Dicionário completo em memória (para quem precisa reescrever tudo)
+        """
+        self.salvar_todos(usuarios)
+
+
+class RepositorioAtendimentos:
+    """Contrato de armazenamento dos atendimentos."""
+
+    def carregar(self) -> list:
+        raise NotImplementedError
+
+    def inserir(self, atendimento: dict) -> None:
+        raise NotImplementedError
+
+    def iterar(self):
+        """Atendimentos um a um (para relatórios que não precisam da lista inteira)."""
+        return iter(self.carregar())
+
+    def obter(self, token: str):
+        for atendimento in self.carregar():
+            if atendimento.get('token') == token:
+                return atendimento
+        return None
+
+    def atualizar_status(self, token: str, status: str, etapa: str, momento: str) -> None:
+        """
+        Registra a mudança de status/etapa de um atendimento.
+
+        Args:
+            token: Token do atendimento
+            status: Novo status ('em_atendimento', 'concluido'...)
+            etapa: Etapa atual do fluxo ('medico', 'farmacia'...)
+            momento: Data/hora da mudança
+        """
+        raise NotImplementedError
+
+    def estado(self, token: str):
+        """Status, etapa e momento da última mudança do atendimento (None se não existir)."""
+        atendimento = self.obter(token)
+        if not atendimento:
+            return None
+        return {'status': atendimento.get('status'), 'etapa': atendimento.get('etapa'),
+                'status_em': atendimento.get('status_em')}
+
+    def proxima_senha(self, dia: str) -> int:
+        """
+        Reserva o próximo número da senha do dia.
+
+        Args:
+            dia: Data no formato dd/mm/aaaa (prefixo de data_checkin)
+
+        Returns:
+            Número sequencial (1, 2, 3...) único dentro do dia
+        """
+        return len([a for a in self.carregar() if (a.get('data_checkin') or '').startswith(dia)]) + 1
+
+
+# --- SQLITE ---
+
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS tarefas (
+    ordem INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT UNIQUE,
+    atendimento_token TEXT,
+    setor TEXT,
+    status TEXT,
+    responsavel TEXT,
+    concluida_por TEXT,
+    dados TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_tarefas_atendimento ON tarefas(atendimento_token);
+CREATE INDEX IF NOT EXISTS idx_tarefas_setor_status ON tarefas(setor, status);
+CREATE INDEX IF NOT EXISTS idx_tarefas_responsavel ON tarefas(responsavel);
+CREATE INDEX IF NOT EXISTS idx_tarefas_concluida_por ON tarefas(concluida_por);
+
+CREATE TABLE IF NOT EXISTS usuarios (
+    ordem INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL UNIQUE,
+    login TEXT,
+    dados TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_usuarios_login ON usuarios(login);
+
+CREATE TABLE IF NOT EXISTS atendimentos (
+    ordem INTEGER PRIMARY KEY AUTOINCREMENT,
+    token TEXT NOT NULL UNIQUE,
+    dados TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS senhas (
+    dia TEXT PRIMARY KEY,
+    ultima INTEGER NOT NULL
+);
+"""
+
+# Uma conexão por thread (e por arquivo), reaproveitada entre requisições.
+# O sqlite3 mantém um cache de comandos preparados por conexão, então as
+# consultas abaixo (texto fixo + parâmetros) são compiladas uma vez só.
+_conexoes = threading.local()
+
+
+def conexao(caminho: str = None) -> sqlite3.Connection:
+    """
+    Retorna a conexão SQLite da thread atual, criando-a se necessário.
+
+    Args:
+        caminho: Arquivo do banco (padrão: ARQUIVO_SQLITE)
+
+    Returns:
+        Conexão em modo WAL com o esquema já criado
+    """
+    caminho = caminho or ARQUIVO_SQLITE
+    por_caminho = getattr(_conexoes, 'por_caminho', None)
+    if por_caminho is None:
+        por_caminho = _conexoes.por_caminho = {}
+
+    con = por_caminho.get(caminho)
+    if con is None:
+        con = sqlite3.connect(caminho, timeout=30, cached_statements=256)
+        con.execute('PRAGMA journal_mode=WAL')
+        con.execute('PRAGMA synchronous=NORMAL')
+        con.executescript(_ESQUEMA)
+        por_caminho[caminho] = con
+    return con
+
+
+def fechar_conexoes() -> None:
+    """Fecha as conexões abertas pela thread atual."""
+    por_caminho = getattr(_conexoes, 'por_caminho', None) or {}
+    for con in por_caminho.values():
+        con.close()
+    por_caminho.clear()
+    lidas = getattr(_conexoes, 'lidas', None)
+    if lidas is not None:
+        lidas.clear()
+
+
+@contextmanager
+def transacao(caminho: str = None):
+    """
+    BEGIN IMMEDIATE na conexão da thread: segura a trava de escrita do
+    banco durante um ciclo carregar-alterar-salvar inteiro, contra outras
+    threads e outros processos. Dentro de outra transação só repassa.
+    """
+    con = conexao(caminho)
+    if con.in_transaction:
+        yield con
+        return
+    con.execute('BEGIN IMMEDIATE')
+    try:
+        yield con
+    except BaseException:
+        con.rollback()
+        raise
+    con.commit()
+
+
+@contextmanager
+def _escrita(con: sqlite3.Connection):
+    """Commit no fim, a não ser que uma transacao() aberta por quem chamou vá fazê-lo."""
+    if con.in_transaction:
+        try:
+            yield
+        except sqlite3.Error:
+            con.rollback()
+            raise
+        return
+    with con:
+        yield
+
+
+def _lidas_da_thread(caminho: str = None) -> dict:
+    """id -> JSON de cada tarefa lida por carregar() nesta thread (base do próximo salvar)."""
+    lidas = getattr(_conexoes, 'lidas', None)
+    if lidas is None:
+        lidas = _conexoes.lidas = {}
+    return lidas.setdefault(caminho or ARQUIVO_SQLITE, {})
+
+
+def _json(registro: dict) -> str:
+    return json.dumps(registro, ensure_ascii=False)
+
+
+class RepositorioTarefasSQLite(RepositorioTarefas):
+    """
+    Tarefas na tabela `tarefas`. O registro completo fica em `dados` (JSON);
+    as colunas usadas em filtros são copiadas para colunas indexadas.
+    """
+
+    def __init__(self, normalizar=None):
+        # Função aplicada a cada tarefa antes de gravar (mantém os mesmos
+        # valores que o backend texto devolveria após salvar e reler)
+        self.normalizar = normalizar or dict
+
+    def _linhas(self, sql: str, parametros=()) -> list:
+        return [json.loads(dados) for (dados,) in conexao().execute(sql, parametros)]
+
+    def carregar(self) -> list:
+        # Guarda o que foi lido: salvar() grava só a diferença para isto
+        lidas = _lidas_da_thread()
+        lidas.clear()
+        tarefas = []
+        for id_tarefa, dados in conexao().execute('SELECT id, dados FROM tarefas ORDER BY ordem'):
+            # Tarefas antigas sem id ficam todas sob a chave None
+            lidas[id_tarefa] = dados
+            tarefas.append(json.loads(dados))
+        return tarefas
+
+    def iterar(self):
+        for (dados,) in conexao().execute('SELECT dados FROM tarefas ORDER BY ordem'):
+            yield json.loads(dados)
+
+    def salvar(self, tarefas: list) -> bool:
+        """
+        Grava a diferença entre `tarefas` e o que esta thread leu no último
+        carregar(): upsert das tarefas novas ou alteradas e DELETE das que
+        saíram da lista. Tarefas que outra thread/processo criou depois
+        dessa leitura não estão na base e ficam intactas. Para o ciclo
+        inteiro ser atômico, usar dentro de transacao().
+        """
+        try:
+            con = conexao()
+            lidas = _lidas_da_thread()
+            alteradas = []
+            sem_id = []
+            ids = {}
+            for tarefa in tarefas:
+                tarefa = self.normalizar(tarefa)
+                dados = _json(tarefa)
+                if not tarefa.get('id'):
+                    sem_id.append(tarefa)
+                    continue
+                ids[tarefa['id']] = dados
+                if lidas.get(tarefa['id']) != dados:
+                    alteradas.append(self._parametros(tarefa, dados))
+            removidas = [(id_tarefa,) for id_tarefa in lidas if id_tarefa is not None and id_tarefa not in ids]
+
+            with _escrita(con):
+                con.executemany(
+                    'INSERT INTO tarefas (id, atendimento_token, setor, status, responsavel, concluida_por, dados) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?) '
+                    'ON CONFLICT(id) DO UPDATE SET atendimento_token = excluded.atendimento_token, '
+                    'setor = excluded.setor, status = excluded.status, responsavel = excluded.responsavel, '
+                    'concluida_por = excluded.concluida_por, dados = excluded.dados',
+                    alteradas
+                )
+                con.executemany('DELETE FROM tarefas WHERE id = ?', removidas)
+                if sem_id or None in lidas:
+                    # Sem id não há como casar linha a linha: as lidas são trocadas pelas da lista
+                    con.execute('DELETE FROM tarefas WHERE id IS NULL')
+                    con.executemany(
+                        'INSERT INTO tarefas (id, atendimento_token, setor, status, responsavel, concluida_por, dados) '
+                        'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                        [self._parametros(t, _json(t)) for t in sem_id]
+                    )
+            # A base passa a ser o que foi gravado (próximo salvar sem reler)
+            lidas.clear()
+            lidas.update(ids)
+            if sem_id:
+                lidas[None] = None
+            return True
+        except sqlite3.Error as e:
+            print(f"Erro ao salvar tarefas no SQLite: {e}")
+            return False
+
+    @staticmethod
+    def _parametros(tarefa: dict, dados: str) -> tuple:
+        return (
+            tarefa.get('id'),
+            tarefa.get('atendimento_token'),
+            normalizar_chave(tarefa.get('setor')),
+            normalizar_chave(tarefa.get('status')),
+            tarefa.get('responsavel'),
+            tarefa.get('concluida_por'),
+            dados,
+        )
+
+    def obter(self, id_tarefa: str):
+        linhas = self._linhas('SELECT dados FROM tarefas WHERE id = ?', (id_tarefa,))
+        return linhas[0] if linhas else None
+
+    def por_atendimento(self, atendimento_token: str) -> list:
+        return self._linhas(
+            'SELECT dados FROM tarefas WHERE atendimento_token = ? ORDER BY ordem', (atendimento_token,)
+        )
+
+    def por_setor(self, setor: str, status: str = None) -> list:
+        if status is None:
+            return self._linhas(
+                'SELECT dados FROM tarefas WHERE setor = ? ORDER BY ordem', (normalizar_chave(setor),)
+            )
+        return self._linhas(
+            'SELECT dados FROM tarefas WHERE setor = ? AND status = ? ORDER BY ordem',
+            (normalizar_chave(setor), normalizar_chave(status))
+        )
+
+    def por_responsavel(self, id_usuario: str) -> list:
+        return self._linhas(
+            'SELECT dados FROM tarefas WHERE responsavel = ? OR concluida_por = ? ORDER BY ordem',
+            (id_usuario, id_usuario)
+        )
+
+    def por_setor_ou_responsavel(self, setor: str, id_usuario: str) -> list:
+        return self._linhas(
+            'SELECT dados FROM tarefas WHERE setor = ? OR responsavel = ? OR concluida_por = ? ORDER BY ordem',
+            (normalizar_chave(setor), id_usuario, id_usuario)
+        )
+
+    def contar(self, incluir) -> dict:
+        contagem = {}
+        for setor, responsavel, status, quantidade in conexao().execute(
+                'SELECT setor, responsavel, status, COUNT(*) FROM tarefas GROUP BY setor, responsavel, status'):
+            if incluir(setor or '', responsavel or ''):
+                contagem[status or ''] = contagem.get(status or '', 0) + quantidade
+        return contagem
+
+    def pagina(self, incluir=None, apos=None, quantidade: int = 50, setor=None, status=None,
+               inicio=None, fim=None, busca=None) -> tuple:
+        # Como em recentes(): de trás para frente na ordem de inserção, com
+        # setor/status/cursor no índice e o resto filtrado até fechar a página
+        condicoes, parametros = [], []
+        if setor:
+            condicoes.append('setor = ?')
+            parametros.append(normalizar_chave(setor))
+        if status:
+            condicoes.append('status = ?')
+            parametros.append(normalizar_chave(status))
+        cursor = ler_cursor(apos)
+        if cursor is not None:
+            linha = conexao().execute('SELECT ordem FROM tarefas WHERE id = ?', (cursor[1],)).fetchone()
+            if linha is not None:
+                condicoes.append('ordem < ?')
+                parametros.append(linha[0])
+        sql = 'SELECT dados FROM tarefas'
+        if condicoes:
+            sql += ' WHERE ' + ' AND '.join(condicoes)
+        filtro = filtro_pagina(incluir, busca=busca)
+        menor = dia_ordenavel(inicio) if inicio else None
+        maior = dia_ordenavel(fim) if fim else None
+        encontradas = []
+        for (dados,) in conexao().execute(sql + ' ORDER BY ordem DESC', parametros):
+            tarefa = json.loads(dados)
+            dia = chave_recencia(tarefa, 0)[0]
+            if cursor is not None and dia > cursor[0]:
+                continue  # a tarefa do cursor sumiu: pula os dias já mostrados
+            if (menor is None or dia >= menor) and (maior is None or dia <= maior) and filtro(tarefa):
+                encontradas.append(tarefa)
+                if len(encontradas) > quantidade:
+                    break
+        return fechar_pagina(encontradas, quantidade)
+
+    def recentes(self, incluir, quantidade: int = 10) -> list:
+        # A data de criação é sempre o dia da inserção: a ordem de inserção,
+        # de trás para frente, já é a de recência e dispensa ler a tabela toda
+        encontradas = []
+        for setor, responsavel, dados in conexao().execute(
+                'SELECT setor, responsavel, dados FROM tarefas ORDER BY ordem DESC'):
+            if incluir(setor or '', responsavel or ''):
+                encontradas.append(json.loads(dados))
+                if len(encontradas) == quantidade:
+                    break
+        return encontradas
+
+
+class RepositorioUsuariosSQLite(RepositorioUsuarios):
+    """Usuários na tabela `usuarios`, com índice por login."""
+
+    def carregar(self) -> dict:
+        resultado = {}
+        for (dados,) in conexao().execute('SELECT dados FROM usuarios ORDER BY ordem'):
+            usuario = json.loads(dados)
+            resultado[usuario['id']] = usuario
+        return resultado
+
+    def salvar_todos(self, usuarios: dict) -> None:
+        con = conexao()
+        with con:
+            con.execute('DELETE FROM usuarios')
+            con.executemany(
+                'INSERT INTO usuarios (id, login, dados) VALUES (?, ?, ?)',
+                [(u['id'], u.get('login'), _json(u)) for u in usuarios.values()]
+            )
+
+    def salvar(self, usuario: dict, usuarios: dict = None) -> None:
+        con = conexao()
+        with con:
+            con.execute(
+                'INSERT INTO usuarios (id, login, dados) VALUES (?, ?, ?) '
+                'ON CONFLICT(id) DO UPDATE SET login = excluded.login, dados = excluded.dados',
+                (usuario['id'], usuario.get('login'), _json(usuario))
+            )
+
+    def por_login(self, login: str):
+        # Login repetido (cadastro antigo): vale o primeiro, como em usuarios._Usuarios
+        linha = conexao().execute(
+            'SELECT dados FROM usuarios WHERE login = ? ORDER BY ordem LIMIT 1', (login,)
+        ).fetchone()
+        return json.loads(linha[0]) if linha else None
+
+
+class RepositorioAtendimentosSQLite(RepositorioAtendimentos):
+    """Atendimentos na tabela `atendimentos`, com chave única no token."""
+
+    def carregar(self) -> list:
+        return [json.loads(dados) for (dados,) in conexao().execute('SELECT dados FROM atendimentos ORDER BY ordem')]
+
+    def inserir(self, atendimento: dict) -> None:
+        con = conexao()
+        with con:
+            con.execute(
+                'INSERT INTO atendimentos (token, dados) VALUES (?, ?)',
+                (atendimento['token'], _json(atendimento))
+            )
+
+    def obter(self, token: str):
+        linha = conexao().execute('SELECT dados FROM atendimentos WHERE token = ?', (token,)).fetchone()
+        return json.loads(linha[0]) if linha else None
+
+    def atualizar_status(self, token: str, status: str, etapa: str, momento: str) -> None:
+        con = conexao()
+        with con:
+            con.execute(
+                "UPDATE atendimentos SET dados = json_set(dados, '$.status', ?, '$.etapa', ?, '$.status_em', ?) "
+                'WHERE token = ?',
+                (status, etapa, momento, token)
+            )
+
+    def proxima_senha(self, dia: str) -> int:
+        # Um único comando: o incremento é atômico entre workers. A primeira
+        # senha do dia continua a contagem de atendimentos já gravados nele.
+        con = conexao()
+        with con:
+            return con.execute(
+                'INSERT INTO senhas (dia, ultima) VALUES (?, '
+                "(SELECT count(*) FROM atendimentos WHERE json_extract(dados, '$.data_checkin') LIKE ? || '%') + 1) "
+                'ON CONFLICT(dia) DO UPDATE SET ultima = ultima + 1 RETURNING ultima',
+                (dia, dia)
+            ).fetchone()[0]
+
+
+def migrar_texto_para_sqlite() -> dict:
+    """
+    Copia os dados dos arquivos texto para o banco SQLite (ARQUIVO_SQLITE).
+
+    Útil para comparar os dois backends com os mesmos dados.
+
+    Returns:
+        Quantidade de registros copiados por tipo
+    """
+    import tarefas
+    import usuarios
+    from web import atendimentos
+
+    lista_tarefas = tarefas._REPOSITORIO_TEXTO.carregar()
+    dict_usuarios = usuarios._REPOSITORIO_TEXTO.carregar()
+    lista_atendimentos = atendimentos._REPOSITORIO_TEXTO.carregar()
+
+    tarefas._REPOSITORIO_SQLITE.salvar(lista_tarefas)
+    usuarios._REPOSITORIO_SQLITE.salvar_todos(dict_usuarios)
+    repo_atendimentos = atendimentos._REPOSITORIO_SQLITE
+    for atendimento in lista_atendimentos:
+        if repo_atendimentos.obter(atendimento['token']) is None:
+            repo_atendimentos.inserir(atendimento)
+
+    return {
+        'tarefas': len(lista_tarefas),
+        'usuarios': len(dict_usuarios),
+        'atendimentos': len(lista_atendimentos),
+    }
+
+
+if __name__ == '__main__':
+    import sys
+    sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+    print(f"Migrando dados para {ARQUIVO_SQLITE}...")
+    print(migrar_texto_para_sqlite())
@@ -5,8 +5,10 @@ Sistema de rastreamento de pacientes em tempo real
 
 import sys
 import os
+import threading
 from datetime import datetime
-from flask import Flask, render_template, request, redirect, url_for, session, jsonify, flash
+import json
+from flask import Flask, render_template, request, redirect, url_for, session, jsonify, flash, Response, stream_with_context
 
 # Adiciona o diretório pai ao path para importar os módulos
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
@@ -19,6 +21,7 @@ import relatorios
 import web.atendimentos as atendimentos
 import web.qrcode_generator as qrcode_generator
 import web.workflow as workflow
+from utils.repositorio import normalizar_chave, grupo_tarefa
 
 app = Flask(__name__)
 app.secret_key = 'taskflow-hospital-secret-key-2025'  # Mudar em produção
@@ -27,6 +30,39 @@ app.secret_key = 'taskflow-hospital-secret-key-2025'  # Mudar em produção
 app.config['SESSION_TYPE'] = 'filesystem'
 app.config['PERMANENT_SESSION_LIFETIME'] = 3600  # 1 hora
 
+# Cada conexão SSE ocupa uma thread: depois deste tempo (s) ela é encerrada
+# e o EventSource do navegador reconecta sozinho
+DURACAO_SSE = float(os.environ.get('TASKFLOW_SSE_DURACAO', '300'))
+
+# Máximo de conexões SSE abertas ao mesmo tempo por worker. Acima dele a
+# resposta é 503: o app do paciente passa à consulta com ETag e o dashboard
+# tenta de novo mais tarde, deixando as outras threads para as demais rotas
+# (login, totem, ações). Deve ficar bem abaixo do --threads do gunicorn.
+MAXIMO_CONEXOES_SSE = int(os.environ.get('TASKFLOW_SSE_MAXIMO', '16'))
+_conexoes_sse = {'abertas': 0}
+_conexoes_sse_lock = threading.Lock()
+
+
+def _resposta_sse(eventos):
+    """Response text/event-stream do gerador `eventos`, ou 503 se o worker já está no limite."""
+    with _conexoes_sse_lock:
+        if _conexoes_sse['abertas'] >= MAXIMO_CONEXOES_SSE:
+            return jsonify({'erro': 'Muitas conexões abertas'}), 503, {'Retry-After': '30'}
+        _conexoes_sse['abertas'] += 1
+    liberada = []
+
+    def _liberar():
+        with _conexoes_sse_lock:
+            if not liberada:
+                liberada.append(True)
+                _conexoes_sse['abertas'] -= 1
+
+    # call_on_close roda mesmo se o cliente sair antes do primeiro evento
+    resposta = Response(stream_with_context(eventos), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    resposta.call_on_close(_liberar)
+    return resposta
+
 
 # ==================== ROTAS PÚBLICAS ====================
 
@@ -50,17 +86,12 @@ def totem_buscar():
     if not senha:
         return jsonify({'erro': 'Digite uma senha válida'}), 400
     
-    todas_tarefas = tarefas._carregar_tarefas()
-    
-    # Busca por ID parcial
-    paciente_encontrado = None
-    for t in todas_tarefas:
-        if t.get('id', '').startswith(senha) or senha in t.get('id', ''):
-            paciente_encontrado = t
-            break
+    # Busca por ID parcial (para na primeira tarefa encontrada)
+    paciente_encontrado = next(tarefas.iter_tarefas(lambda t: senha in (t.get('id') or '')), None)
     
     if not paciente_encontrado:
         return jsonify({'erro': 'Paciente não encontrado'}), 404
+    paciente_encontrado = dict(paciente_encontrado)
     
     # Adiciona informação do responsável
     usuario = usuarios.obter_usuario(paciente_encontrado.get('responsavel', ''))
@@ -84,23 +115,18 @@ def totem_checkin_verificar():
     cpf = request.form.get('cpf', '').replace('.', '').replace('-', '')
     nome = request.form.get('nome')
     
-    # Busca usuário por CPF
-    usuario_encontrado = usuarios.buscar_usuario_por_login(cpf)
-    
-    if not usuario_encontrado:
-        # Se não existe, cadastra automaticamente agora mesmo
-        if nome:
-            usuarios.cadastrar_usuario(
-                nome=nome,
-                login=cpf,
-                senha=cpf,  # Senha inicial é o próprio CPF
-                email=f"{cpf}@paciente.taskflow",
-                setor="paciente"
-            )
-        else:
-            # Fallback se por acaso o nome não vier (não deve acontecer pelo required no HTML)
-            flash('Nome é obrigatório para novos pacientes', 'danger')
+    if nome:
+        # Cadastra o paciente agora mesmo (senha inicial é o próprio CPF) ou
+        # atualiza nome/email de quem já é paciente; senha e setor não mudam
+        try:
+            usuarios.cadastrar_paciente(nome, cpf)
+        except ValueError as e:
+            flash(str(e), 'danger')
             return redirect(url_for('totem_checkin'))
+    elif not usuarios.buscar_usuario_por_cpf(cpf):
+        # Fallback se por acaso o nome não vier (não deve acontecer pelo required no HTML)
+        flash('Nome é obrigatório para novos pacientes', 'danger')
+        return redirect(url_for('totem_checkin'))
     
     # Redireciona para seleção de especialidade/médico
     return redirect(url_for('totem_checkin_medico', cpf=cpf))
@@ -112,12 +138,7 @@ def totem_checkin_medico(cpf):
     especialidade = request.args.get('especialidade')
     
     # Busca usuário
-    todos_usuarios = usuarios.listar_usuarios()
-    usuario_encontrado = None
-    for u in todos_usuarios:
-        if cpf in u.get('login', '') or cpf in u.get('email', ''):
-            usuario_encontrado = u
-            break
+    usuario_encontrado = usuarios.buscar_usuario_por_cpf(cpf)
     
     if not usuario_encontrado:
         return redirect(url_for('totem_checkin'))
@@ -149,12 +170,7 @@ def totem_checkin_confirmar():
     especialidade = request.form.get('especialidade')
     
     # Busca usuário
-    todos_usuarios = usuarios.listar_usuarios()
-    usuario_encontrado = None
-    for u in todos_usuarios:
-        if cpf in u.get('login', '') or cpf in u.get('email', ''):
-            usuario_encontrado = u
-            break
+    usuario_encontrado = usuarios.buscar_usuario_por_cpf(cpf)
     
     if not usuario_encontrado:
         flash('Usuário não encontrado', 'danger')
@@ -217,21 +233,9 @@ def paciente_app(token):
     medico = usuarios.obter_usuario(atendimento.get('medico_id'))
     medico_nome = medico.get('nome', 'Não informado') if medico else 'Não informado'
     
-    # Calcula progresso
-    progresso = workflow.calcular_progresso(token)
-    
-    # --- CÁLCULO DINÂMICO DA ETAPA ---
-    etapa_index = -1
-    todas_concluidas = True
-    for i, tarefa in enumerate(tarefas_atendimento):
-        if tarefa.get('status') != tarefas.STATUS_CONCLUIDA:
-            etapa_index = i
-            todas_concluidas = False
-            break
-            
-    if todas_concluidas and len(tarefas_atendimento) > 0:
-        etapa_index = len(tarefas_atendimento) + 1
-    # ---------------------------------
+    # Calcula progresso e etapa sobre a mesma lista de tarefas
+    progresso = workflow.calcular_progresso(token, tarefas_atendimento)
+    etapa_index = workflow.calcular_etapa_index(tarefas_atendimento)
     
     # Calcula tempo estimado
     tempo_estimado = atendimentos.calcular_tempo_estimado(int(atendimento.get('posicao_fila', 1)))
@@ -245,6 +249,53 @@ def paciente_app(token):
                          tempo_estimado=tempo_estimado)
 
 
+@app.route('/paciente/<token>/eventos')
+def paciente_eventos(token):
+    """
+    Server-Sent Events do app do paciente: manda o estado do atendimento
+    e depois só o que mudar (progresso, etapa, ETA, linha do tempo).
+    Entre uma transição e outra a conexão fica parada numa Condition.
+    """
+    if not atendimentos.obter_atendimento(token):
+        return jsonify({'erro': 'Atendimento não encontrado'}), 404
+
+    def _eventos():
+        yield 'retry: 3000\n\n'
+        for mudou in workflow.acompanhar_atendimento(token, duracao=DURACAO_SSE):
+            if mudou is None:
+                yield ': ping\n\n'  # keep-alive (e detecta cliente que saiu)
+            else:
+                yield f"data: {json.dumps(mudou, ensure_ascii=False)}\n\n"
+
+    return _resposta_sse(_eventos())
+
+
+@app.route('/api/atendimento/<token>/status')
+def status_atendimento(token):
+    """
+    Estado do atendimento em JSON (consulta periódica, alternativa ao SSE).
+    A ETag é o hash do próprio estado, igual em todos os workers: com
+    If-None-Match igual a ela responde 304, e enquanto o atendimento não
+    muda nem o estado é recalculado (ver workflow.estado_e_etag).
+    """
+    atendimento = atendimentos.obter_atendimento(token)
+    if not atendimento:
+        return jsonify({'erro': 'Atendimento não encontrado'}), 404
+    estado, etag = workflow.estado_e_etag(token, atendimento)
+    if request.if_none_match.contains(etag):
+        resposta = Response(status=304)
+    else:
+        if estado is None:
+            # ETag reaproveitada, mas o cliente não tem esse estado: o corpo
+            # e a ETag saem do mesmo cálculo
+            estado = workflow.estado_atendimento(token, atendimento)
+            etag = workflow.etag_estado(estado)
+        resposta = jsonify(estado)
+    resposta.set_etag(etag)
+    resposta.headers['Cache-Control'] = 'no-cache'
+    return resposta
+
+
 # ==================== ÁREA RESTRITA ====================
 
 def login_required(f):
@@ -365,15 +416,19 @@ def novo_usuario():
             flash('Preencha todos os campos obrigatórios', 'danger')
             return redirect(url_for('novo_usuario'))
         
-        # Cadastrar usuário
-        usuarios.cadastrar_usuario(
-            nome=nome,
-            login=login_user,
-            senha=senha,
-            email=email,
-            setor=setor,
-            especialidade=especialidade
-        )
+        try:
+            # Cadastrar usuário
+            usuarios.cadastrar_usuario(
+                nome=nome,
+                login=login_user,
+                senha=senha,
+                email=email,
+                setor=setor,
+                especialidade=especialidade
+            )
+        except ValueError as e:
+            flash(f'Erro ao cadastrar: {str(e)}', 'danger')
+            return redirect(url_for('novo_usuario'))
         flash(f'Usuário {nome} cadastrado com sucesso!', 'success')
         return redirect(url_for('dashboard'))
     
@@ -388,198 +443,194 @@ def logout():
     return redirect(url_for('index'))
 
 
+# ==================== PAINÉIS DOS SETORES ====================
+# Cada dashboard é um painel: um filtro das tarefas (quais aparecem) e os
+# contadores + 10 mais recentes. A página abre com a foto do painel e a
+# marca do log de eventos das filas (web.workflow); daí em diante o
+# navegador recebe por SSE só as tarefas criadas/concluídas e ajusta linhas
+# e contadores no lugar, sem recarregar nem refazer a contagem.
+
+_PAINEL_DO_SETOR = {'farmacia': 'farmacia', 'enfermagem': 'enfermagem', 'medico': 'medico'}
+
+
+def _painel_padrao():
+    """Painel que /dashboard mostra para o setor do usuário logado."""
+    return _PAINEL_DO_SETOR.get(normalizar_chave(session.get('usuario_setor')), 'geral')
+
+
+def _grupos_painel(painel):
+    """
+    incluir(setor, responsavel) do painel para o usuário logado, ou None se
+    ele não tem acesso. Os painéis são definidos por grupos (setor
+    normalizado, responsável), que é como as contagens são mantidas.
+    """
+    usuario_id = session.get('usuario_id')
+    permitido = _painel_padrao()
+    if painel != permitido and not (painel == 'medicos' and permitido == 'medico'):
+        return None
+    if painel in ('farmacia', 'enfermagem'):
+        return lambda setor, responsavel: setor == painel
+    if painel == 'medico':
+        # Tanto as atribuídas a ele quanto as do setor médico
+        return lambda setor, responsavel: responsavel == usuario_id or setor == 'medico'
+    if painel == 'medicos':
+        # As atribuídas a ele e as do setor ainda sem médico
+        return lambda setor, responsavel: responsavel == usuario_id or \
+            (setor == 'medico' and responsavel == 'sistema')
+    return lambda setor, responsavel: True
+
+
+def _filtro_painel(painel):
+    """filtro(tarefa) do painel para o usuário logado, ou None se ele não tem acesso."""
+    incluir = _grupos_painel(painel)
+    if incluir is None:
+        return None
+    return lambda tarefa: incluir(*grupo_tarefa(tarefa))
+
+
+def _carregar_painel(painel):
+    """(total, concluidas, recentes) do painel, dos contadores mantidos pelo repositório."""
+    return tarefas.resumo_tarefas(_grupos_painel(painel))
+
+
+def _renderizar_painel(painel, setor=None):
+    marca, (total, concluidas, tarefas_recentes) = workflow.foto_painel(lambda: _carregar_painel(painel))
+    return render_template('dashboard.html',
+                         total=total,
+                         concluidas=concluidas,
+                         pendentes=total - concluidas,
+                         tarefas_recentes=tarefas_recentes,
+                         tarefas=tarefas_recentes,  # Adiciona 'tarefas' também
+                         setor=setor,
+                         painel=painel,
+                         marca=marca)
+
+
 @app.route('/dashboard')
 @login_required
 def dashboard():
     """Dashboard principal (Recepção e Admin)"""
-    todas_tarefas = tarefas._carregar_tarefas()
-    
     # Filtra tarefas baseado no setor do usuário
-    usuario_setor = session.get('usuario_setor', '').lower()
-    
-    if usuario_setor in ['farmácia', 'farmacia']:
-        # Filtra tarefas da farmácia
-        tarefas_filtradas = [
-            t for t in todas_tarefas 
-            if t.get('setor', '').lower() in ['farmácia', 'farmacia']
-        ]
-    elif usuario_setor == 'enfermagem':
-        # Filtra tarefas de enfermagem
-        tarefas_filtradas = [
-            t for t in todas_tarefas 
-            if t.get('setor', '').lower() == 'enfermagem'
-        ]
-    elif usuario_setor == 'médico':
-        # Filtra tarefas do médico (tanto as atribuídas a ele quanto as do setor médico)
-        usuario_id = session.get('usuario_id')
-        tarefas_filtradas = [
-            t for t in todas_tarefas 
-            if t.get('responsavel') == usuario_id or t.get('setor', '').lower() in ['médico', 'medico']
-        ]
-    else:
-        # Recepção e outros veem todas
-        tarefas_filtradas = todas_tarefas
-    
-    # Estatísticas baseadas nas tarefas filtradas
-    total = len(tarefas_filtradas)
-    concluidas = len([t for t in tarefas_filtradas if t.get('status') == tarefas.STATUS_CONCLUIDA])
-    pendentes = total - concluidas
-    
-    # Tarefas recentes (últimas 10 invertidas)
-    tarefas_recentes = sorted(tarefas_filtradas, key=lambda x: x.get('data_criacao', ''), reverse=True)[:10]
-    
-    return render_template('dashboard.html', 
-                         total=total,
-                         concluidas=concluidas,
-                         pendentes=pendentes,
-                         tarefas_recentes=tarefas_recentes,
-                         tarefas=tarefas_recentes)  # Adiciona 'tarefas' também
+    return _renderizar_painel(_painel_padrao())
 
 
 @app.route('/dashboard/farmacia')
 @setor_required('farmácia')
 def dashboard_farmacia():
     """Dashboard da Farmácia"""
-    todas_tarefas = tarefas._carregar_tarefas()
-    
-    # Filtra apenas tarefas da farmácia
-    tarefas_farmacia = [
-        t for t in todas_tarefas 
-        if t.get('setor', '').lower() in ['farmácia', 'farmacia']
-    ]
-    
-    # Estatísticas
-    total = len(tarefas_farmacia)
-    concluidas = len([t for t in tarefas_farmacia if t.get('status') == tarefas.STATUS_CONCLUIDA])
-    pendentes = total - concluidas
-    
-    # Ordena por data de criação (mais recentes primeiro)
-    tarefas_recentes = sorted(tarefas_farmacia, key=lambda x: x.get('data_criacao', ''), reverse=True)[:10]
-    
-    return render_template('dashboard.html', 
-                         total=total,
-                         concluidas=concluidas,
-                         pendentes=pendentes,
-                         tarefas_recentes=tarefas_recentes,
-                         tarefas=tarefas_recentes,
-                         setor='Farmácia')
-
+    return _renderizar_painel('farmacia', setor='Farmácia')
 
 
 @app.route('/dashboard/enfermagem')
 @setor_required('enfermagem')
 def dashboard_enfermagem():
     """Dashboard da Enfermagem"""
-    todas_tarefas = tarefas._carregar_tarefas()
-    
-    # Filtra apenas tarefas de enfermagem
-    tarefas_enfermagem = [
-        t for t in todas_tarefas 
-        if t.get('setor', '').lower() == 'enfermagem'
-    ]
-    
-    # Estatísticas
-    total = len(tarefas_enfermagem)
-    concluidas = len([t for t in tarefas_enfermagem if t.get('status') == tarefas.STATUS_CONCLUIDA])
-    pendentes = total - concluidas
-    
-    # Ordena por data de criação
-    tarefas_recentes = sorted(tarefas_enfermagem, key=lambda x: x.get('data_criacao', ''), reverse=True)[:10]
-    
-    return render_template('dashboard.html', 
-                         total=total,
-                         concluidas=concluidas,
-                         pendentes=pendentes,
-                         tarefas_recentes=tarefas_recentes,
-                         tarefas=tarefas_recentes,
-                         setor='Enfermagem')
-
+    return _renderizar_painel('enfermagem', setor='Enfermagem')
 
 
 @app.route('/dashboard/medicos')
 @setor_required('médico')
 def dashboard_medicos():
     """Dashboard dos Médicos"""
-    todas_tarefas = tarefas._carregar_tarefas()
-    usuario_id = session.get('usuario_id')
-    
-    # Filtra tarefas do médico logado
-    tarefas_medicos = [
-        t for t in todas_tarefas 
-        if t.get('responsavel') == usuario_id or 
-           (t.get('setor', '').lower() in ['médico', 'medico'] and t.get('responsavel') == 'sistema')
-    ]
-    
-    # Estatísticas
-    total = len(tarefas_medicos)
-    concluidas = len([t for t in tarefas_medicos if t.get('status') == tarefas.STATUS_CONCLUIDA])
-    pendentes = total - concluidas
-    
-    # Ordena por data de criação
-    tarefas_recentes = sorted(tarefas_medicos, key=lambda x: x.get('data_criacao', ''), reverse=True)[:10]
-    
-    return render_template('dashboard.html', 
-                         total=total,
-                         concluidas=concluidas,
-                         pendentes=pendentes,
-                         tarefas_recentes=tarefas_recentes,
-                         tarefas=tarefas_recentes,
-                         setor='Médicos')
+    # Tarefas atribuídas ao médico logado e as do setor ainda sem médico
+    return _renderizar_painel('medicos', setor='Médicos')
+
+
+def _mensagem_painel(evento):
+    """Evento de workflow.acompanhar_fila no formato que dashboard.html aplica."""
+    if evento['tipo'] == 'estado':
+        total, concluidas, recentes = evento['painel']
+        return {'tipo': 'estado', 'total': total, 'concluidas': concluidas,
+                'linhas': render_template('_linhas_tarefas.html', tarefas=recentes)}
+    tarefa = evento['nova'] if evento['nova'] is not None else evento['antiga']
+    return {'tipo': evento['tipo'], 'id': tarefa.get('id'),
+            'total': evento['total'], 'concluidas': evento['concluidas'],
+            'linha': render_template('_linha_tarefa.html', tarefa=evento['nova'])
+                     if evento['nova'] is not None else None}
+
+
+@app.route('/dashboard/<painel>/eventos')
+@login_required
+def dashboard_eventos(painel):
+    """
+    Fila ao vivo do painel (Server-Sent Events): tarefas criadas, concluídas
+    ou alteradas que aparecem nele, com a linha já renderizada e quanto
+    muda cada contador. Retoma do Last-Event-ID (ou ?desde=, a marca com
+    que a página foi renderizada); se não der, manda o painel inteiro.
+    """
+    filtro = _filtro_painel(painel)
+    if filtro is None:
+        return jsonify({'erro': 'Acesso negado'}), 403
+    desde = request.headers.get('Last-Event-ID') or request.args.get('desde')
+
+    def _eventos():
+        yield 'retry: 3000\n\n'
+        for evento in workflow.acompanhar_fila(filtro, lambda: _carregar_painel(painel), desde,
+                                               duracao=DURACAO_SSE):
+            if evento is None:
+                yield ': ping\n\n'
+            else:
+                dados = json.dumps(_mensagem_painel(evento), ensure_ascii=False)
+                yield f"id: {evento['marca']}\ndata: {dados}\n\n"
+
+    return _resposta_sse(_eventos())
+
+
+POR_PAGINA_PACIENTES = 50
+SETORES_PACIENTES = ['recepção', 'médico', 'farmácia', 'enfermagem']
+FILTROS_PACIENTES = ('busca', 'status', 'setor', 'de', 'ate')
+
+
+def _data_do_filtro(nome):
+    """Data AAAA-MM-DD de um filtro da lista (input type=date); None se vazia ou inválida."""
+    valor = request.args.get(nome)
+    if not valor:
+        return None
+    try:
+        return datetime.strptime(valor, '%Y-%m-%d').date()
+    except ValueError:
+        flash(f'Data inválida ignorada: {valor}', 'warning')
+        return None
 
 
 @app.route('/pacientes')
 @login_required
 def pacientes():
-    """Lista de pacientes - CORRIGIDO"""
-    todas_tarefas = tarefas._carregar_tarefas()
-    
-    # Filtra baseado no setor do usuário
-    usuario_setor = session.get('usuario_setor', '').lower()
-    usuario_id = session.get('usuario_id')
-    
-    if usuario_setor in ['farmácia', 'farmacia']:
-        # Farmácia vê apenas suas tarefas
-        tarefas_filtradas = [
-            t for t in todas_tarefas 
-            if t.get('setor', '').lower() in ['farmácia', 'farmacia']
-        ]
-    elif usuario_setor == 'enfermagem':
-        # Enfermagem vê apenas suas tarefas
-        tarefas_filtradas = [
-            t for t in todas_tarefas 
-            if t.get('setor', '').lower() == 'enfermagem'
-        ]
-    elif usuario_setor == 'médico':
-        # Médico vê suas tarefas
-        tarefas_filtradas = [
-            t for t in todas_tarefas 
-            if t.get('responsavel') == usuario_id or 
-               (t.get('setor', '').lower() in ['médico', 'medico'])
-        ]
-    else:
-        # Recepção e admin veem todas
-        tarefas_filtradas = todas_tarefas
-    
-    # Adiciona informação do responsável para cada tarefa
-    for tarefa in tarefas_filtradas:
+    """Lista de pacientes: uma página por vez (cursor), com filtros e busca"""
+    filtros = {k: request.args.get(k).strip() for k in FILTROS_PACIENTES if (request.args.get(k) or '').strip()}
+
+    # Cada setor vê as tarefas do seu painel (farmácia, enfermagem, médico
+    # com as atribuídas a ele); recepção e admin veem todas
+    incluir = _grupos_painel(_painel_padrao())
+    pagina, proximo = tarefas.pagina_tarefas(
+        incluir, request.args.get('apos'), POR_PAGINA_PACIENTES,
+        setor=filtros.get('setor'), status=filtros.get('status'), busca=filtros.get('busca'),
+        inicio=_data_do_filtro('de'), fim=_data_do_filtro('ate'))
+
+    # Adiciona informação do responsável (uma consulta por pessoa da página)
+    responsaveis = {}
+    for tarefa in pagina:
         responsavel_id = tarefa.get('responsavel', '')
-        
+
         if responsavel_id == 'sistema':
             tarefa['responsavel_nome'] = 'Sistema'
             tarefa['responsavel_setor'] = tarefa.get('setor', 'N/A')
+            continue
+        if responsavel_id not in responsaveis:
+            responsaveis[responsavel_id] = usuarios.obter_usuario(responsavel_id)
+        usuario = responsaveis[responsavel_id]
+        if usuario:
+            tarefa['responsavel_nome'] = usuario.get('nome', 'Desconhecido')
+            tarefa['responsavel_setor'] = usuario.get('setor', 'N/A')
         else:
-            usuario = usuarios.obter_usuario(responsavel_id)
-            if usuario:
-                tarefa['responsavel_nome'] = usuario.get('nome', 'Desconhecido')
-                tarefa['responsavel_setor'] = usuario.get('setor', 'N/A')
-            else:
-                tarefa['responsavel_nome'] = 'Desconhecido'
-                tarefa['responsavel_setor'] = 'N/A'
-    
-    # Ordena por data de criação (mais recentes primeiro)
-    tarefas_filtradas = sorted(tarefas_filtradas, key=lambda x: x.get('data_criacao', ''), reverse=True)
-    
-    return render_template('pacientes.html', pacientes=tarefas_filtradas)
+            tarefa['responsavel_nome'] = 'Desconhecido'
+            tarefa['responsavel_setor'] = 'N/A'
+
+    return render_template('pacientes.html', pacientes=pagina, proximo=proximo,
+                           filtros=filtros, primeira_pagina=not request.args.get('apos'),
+                           status_opcoes=[tarefas.STATUS_PENDENTE, tarefas.STATUS_CONCLUIDA,
+                                          tarefas.STATUS_CANCELADA],
+                           setores=SETORES_PACIENTES)
 
 @app.route('/pacientes/novo', methods=['GET', 'POST'])
 @login_required
@@ -615,10 +666,12 @@ def novo_paciente():
             "data_conclusao": None
         }
         
-        todas_tarefas = tarefas._carregar_tarefas()
-        todas_tarefas.append(nova_tarefa)
+        with tarefas.transacao_tarefas():
+            todas_tarefas = tarefas._carregar_tarefas()
+            todas_tarefas.append(nova_tarefa)
+            salvou = tarefas._salvar_tarefas(todas_tarefas)
         
-        if tarefas._salvar_tarefas(todas_tarefas):
+        if salvou:
             flash(f'Paciente "{titulo}" cadastrado com sucesso!', 'success')
             return redirect(url_for('pacientes'))
         else:
@@ -633,25 +686,28 @@ def atualizar_paciente(id):
     """Atualizar status do paciente"""
     novo_status = request.form.get('status')
     
-    todas_tarefas = tarefas._carregar_tarefas()
-    
-    # Busca tarefa
-    tarefa = None
-    for t in todas_tarefas:
-        if t['id'] == id:
-            tarefa = t
-            break
-    
-    if not tarefa:
-        flash('Paciente não encontrado', 'danger')
-        return redirect(url_for('pacientes'))
-    
-    # Atualiza status
-    tarefa['status'] = novo_status
-    if novo_status == tarefas.STATUS_CONCLUIDA:
-        tarefa['data_conclusao'] = tarefas._data_atual()
+    with tarefas.transacao_tarefas():
+        todas_tarefas = tarefas._carregar_tarefas()
+        
+        # Busca tarefa
+        tarefa = None
+        for t in todas_tarefas:
+            if t['id'] == id:
+                tarefa = t
+                break
+        
+        if not tarefa:
+            flash('Paciente não encontrado', 'danger')
+            return redirect(url_for('pacientes'))
+        
+        # Atualiza status
+        tarefa['status'] = novo_status
+        if novo_status == tarefas.STATUS_CONCLUIDA:
+            tarefa['data_conclusao'] = tarefas._data_atual()
+        
+        salvou = tarefas._salvar_tarefas(todas_tarefas)
     
-    if tarefas._salvar_tarefas(todas_tarefas):
+    if salvou:
         flash('Status atualizado com sucesso!', 'success')
     else:
         flash('Erro ao atualizar status', 'danger')
@@ -665,68 +721,26 @@ def realizar_acao_tarefa(id):
     """Realiza uma ação em uma tarefa e avança o workflow"""
     acao = request.form.get('acao')
     
-    todas_tarefas = tarefas._carregar_tarefas()
-    tarefa_atual = None
-    
-    for t in todas_tarefas:
-        if t['id'] == id:
-            tarefa_atual = t
-            break
+    # Conclui a tarefa, cria a próxima etapa e atualiza o atendimento
+    # numa única gravação
+    tarefa_atual = workflow.avancar_workflow(id, acao)
     
     if not tarefa_atual:
-        flash('Tarefa não encontrada', 'danger')
+        if tarefas._buscar_tarefa_por_id(id):
+            flash('Erro ao salvar a ação. Tente novamente.', 'danger')
+        else:
+            flash('Tarefa não encontrada', 'danger')
         return redirect(url_for('dashboard'))
     
-    # Marca tarefa atual como concluída
-    tarefa_atual['status'] = tarefas.STATUS_CONCLUIDA
-    tarefa_atual['data_conclusao'] = tarefas._data_atual()
-    tarefas._salvar_tarefas(todas_tarefas)
-    
-    atendimento_token = tarefa_atual.get('atendimento_token')
-    
-    # Extrai nome do paciente do título (formato "Titulo - Nome")
-    nome_paciente = tarefa_atual['titulo'].split(' - ')[-1] if ' - ' in tarefa_atual['titulo'] else "Paciente"
-    
-    if acao == 'encaminhar_medico':
-        # ALTERAÇÃO: Busca o médico que foi escolhido no Atendimento original
-        atendimento = atendimentos.obter_atendimento(atendimento_token)
-        medico_id = atendimento.get('medico_id') if atendimento else None
-        
-        # Tenta extrair especialidade (mantido)
-        desc = tarefa_atual.get('descricao', '')
-        especialidade = "Clínico Geral"
-        if "Especialidade desejada: " in desc:
-            try:
-                especialidade = desc.split("Especialidade desejada: ")[1].split(".")[0]
-            except:
-                pass
-        
-        # Cria tarefa já atribuída ao médico certo
-        workflow.adicionar_tarefa_medico(atendimento_token, nome_paciente, especialidade, responsavel_id=medico_id)
-        atendimentos.atualizar_status_atendimento(atendimento_token, 'em_atendimento', 'medico')
-        flash('Paciente encaminhado para o médico.', 'success')
-        
-    elif acao == 'alta':
-        # Médico -> Alta
-        atendimentos.atualizar_status_atendimento(atendimento_token, 'concluido', 'concluido')
-        flash('Atendimento finalizado (Alta).', 'success')
-        
-    elif acao == 'solicitar_medicamento':
-        # Médico -> Farmácia
-        workflow.adicionar_tarefa_farmacia(atendimento_token, nome_paciente)
-        atendimentos.atualizar_status_atendimento(atendimento_token, 'em_atendimento', 'farmacia')
-        flash('Solicitação enviada para a Farmácia.', 'success')
-        
-    elif acao == 'dispensar_medicamento':
-        # Farmácia -> Enfermagem
-        workflow.adicionar_tarefa_enfermagem(atendimento_token, nome_paciente)
-        atendimentos.atualizar_status_atendimento(atendimento_token, 'em_atendimento', 'enfermagem')
-        flash('Medicamentos dispensados. Encaminhado para Enfermagem.', 'success')
-        
-    elif acao == 'finalizar_atendimento':
-        # Enfermagem -> Alta
-        atendimentos.atualizar_status_atendimento(atendimento_token, 'concluido', 'concluido')
-        flash('Procedimento realizado. Atendimento finalizado.', 'success')
+    mensagens = {
+        'encaminhar_medico': 'Paciente encaminhado para o médico.',
+        'alta': 'Atendimento finalizado (Alta).',
+        'solicitar_medicamento': 'Solicitação enviada para a Farmácia.',
+        'dispensar_medicamento': 'Medicamentos dispensados. Encaminhado para Enfermagem.',
+        'finalizar_atendimento': 'Procedimento realizado. Atendimento finalizado.',
+    }
+    if acao in mensagens:
+        flash(mensagens[acao], 'success')
     
     return redirect(url_for('dashboard'))
 
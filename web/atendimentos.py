@@ -1,29 +1,622 @@
 import os
+import gzip
 import json
-from datetime import datetime
+import shutil
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
 from uuid import uuid4
 
+from utils import arquivos, repositorio
+
+PASTA_ATENDIMENTOS = os.environ.get('TASKFLOW_ATENDIMENTOS_PASTA', 'atendimentos')
+ARQUIVO_SENHAS = "senhas_atendimento.txt"  # "dd/mm/aaaa|última senha do dia"
+EVENTOS_POR_SNAPSHOT = int(os.environ.get('TASKFLOW_EVENTOS_SNAPSHOT', '500'))
+DIAS_SEM_COMPACTAR = int(os.environ.get('TASKFLOW_ATENDIMENTOS_DIAS', '7'))
+PARTICOES_EM_MEMORIA = 8
+
+# Formato antigo (arquivo único): migrado para as partições no primeiro uso
 ARQUIVO_ATENDIMENTOS = "atendimentos.txt"
+ARQUIVO_EVENTOS = "atendimentos_eventos.txt"
 
-def _carregar_atendimentos():
-    if not os.path.exists(ARQUIVO_ATENDIMENTOS):
+# --- PARTIÇÕES POR DIA ---
+# Cada dia de check-in tem seus arquivos em PASTA_ATENDIMENTOS:
+#   AAAAMMDD.jsonl          check-ins (um JSON por linha, somente append)
+#   AAAAMMDD.eventos.jsonl  mudanças de status desses atendimentos
+#   AAAAMMDD.estados.json   snapshot do estado mais recente de cada token
+#   tokens.idx              "token|AAAAMMDD" de todos os atendimentos (append)
+#   tokens.ord              tokens.idx ordenado por token, refeito na rotação
+# A consulta de um token começa pela partição de hoje (índice token -> offset
+# em memória); só tokens de outros dias passam pelo tokens.idx. Partições com
+# mais de DIAS_SEM_COMPACTAR dias viram .gz em rotacionar_atendimentos() e
+# continuam legíveis (iterar_atendimentos percorre tudo em streaming).
+
+_NUNCA = ('nunca lido',)
+
+def _caminho(dia, sufixo):
+    return os.path.join(PASTA_ATENDIMENTOS, f"{dia}.{sufixo}")
+
+def _arquivo_indice_tokens():
+    return os.path.join(PASTA_ATENDIMENTOS, 'tokens.idx')
+
+def _arquivo_tokens_ordenados():
+    return os.path.join(PASTA_ATENDIMENTOS, 'tokens.ord')
+
+def _hoje():
+    return datetime.now().strftime('%Y%m%d')
+
+def _dia_de(data_checkin):
+    """'dd/mm/aaaa ...' -> 'AAAAMMDD' (hoje se a data não for reconhecida)."""
+    try:
+        return datetime.strptime((data_checkin or '')[:10], '%d/%m/%Y').strftime('%Y%m%d')
+    except ValueError:
+        return _hoje()
+
+def _abrir(dia, sufixo):
+    """Arquivo da partição em modo binário: o normal ou, se arquivado, o .gz."""
+    try:
+        return open(_caminho(dia, sufixo), 'rb')
+    except FileNotFoundError:
+        pass
+    try:
+        return gzip.open(_caminho(dia, sufixo) + '.gz', 'rb')
+    except FileNotFoundError:
+        return None
+
+def _linhas_gz(caminho):
+    """Linhas de um .gz; arquivo ausente ou truncado termina a leitura."""
+    try:
+        with gzip.open(caminho, 'rb') as f:
+            for linha in f:
+                if linha.strip():
+                    yield linha
+    except (FileNotFoundError, EOFError):
+        return
+
+def _dias_existentes():
+    try:
+        nomes = os.listdir(PASTA_ATENDIMENTOS)
+    except FileNotFoundError:
         return []
+    dias = {nome[:8] for nome in nomes
+            if nome[:8].isdigit() and nome[8:] in ('.jsonl', '.jsonl.gz')}
+    return sorted(dias)
+
+def _acompanhar(caminho, controle, reiniciar, aplicar):
+    """Lê de `caminho` só as linhas completas anexadas desde a última chamada.
+
+    controle guarda 'assinatura' (inode, tamanho, mtime) e 'offset'. Se o
+    arquivo sumir, for trocado ou truncado, reiniciar(stat ou None) zera o
+    estado do chamador e devolve o offset de onde recomeçar.
+    aplicar(posicao, linha) recebe cada linha (bytes) não vazia.
+    """
+    try:
+        st = os.stat(caminho)
+    except FileNotFoundError:
+        if controle['assinatura'] is not None:
+            reiniciar(None)
+        controle.update(assinatura=None, offset=0)
+        return
+    assinatura = (st.st_ino, st.st_size, st.st_mtime_ns)
+    anterior = controle['assinatura']
+    if assinatura == anterior:
+        return
+    if anterior is None or anterior is _NUNCA or anterior[0] != st.st_ino or st.st_size < controle['offset']:
+        controle['offset'] = reiniciar(st)
+
+    posicao = controle['offset']
     try:
-        with open(ARQUIVO_ATENDIMENTOS, 'r', encoding='utf-8') as f:
-            return [json.loads(linha) for linha in f if linha.strip()]
+        with open(caminho, 'rb') as f:
+            f.seek(posicao)
+            for linha in f:
+                if not linha.endswith(b'\n'):
+                    break  # linha ainda sendo escrita por outro processo
+                if linha.strip():
+                    aplicar(posicao, linha)
+                posicao += len(linha)
+    except FileNotFoundError:
+        # Arquivado entre o stat e o open: a próxima chamada recomeça
+        controle.update(assinatura=_NUNCA, offset=0)
+        return
+    controle['offset'] = posicao
+    controle['assinatura'] = assinatura
+
+class _Particao:
+    """Check-ins e eventos de um dia: índice token -> offset e estado por token.
+
+    O status é um evento anexado ({token, status, etapa, em}); o estado mais
+    recente de cada token é montado a partir do snapshot do dia + eventos
+    posteriores. A cada EVENTOS_POR_SNAPSHOT eventos um snapshot é gravado
+    em segundo plano, para que a releitura ao iniciar um worker seja curta.
+    """
+
+    def __init__(self, dia):
+        self.dia = dia
+        self.lock = threading.RLock()
+        self.checkins = {'assinatura': _NUNCA, 'offset': 0}
+        self.posicoes = {}
+        self.eventos = {'assinatura': _NUNCA, 'offset': 0}
+        self.estados = {}
+        self.desde_snapshot = 0
+
+    # índice token -> offset (chamar com self.lock)
+
+    def _reiniciar_posicoes(self, st):
+        self.posicoes = {}
+        return 0
+
+    def _indexar(self, posicao, linha):
+        token = json.loads(linha).get('token')
+        if token:
+            self.posicoes[token] = posicao
+
+    def _atualizar_posicoes(self):
+        _acompanhar(_caminho(self.dia, 'jsonl'), self.checkins, self._reiniciar_posicoes, self._indexar)
+
+    def tem(self, token):
+        with self.lock:
+            self._atualizar_posicoes()
+            return token in self.posicoes
+
+    def obter(self, token):
+        with self.lock:
+            for _ in range(2):
+                self._atualizar_posicoes()
+                posicao = self.posicoes.get(token)
+                if posicao is None:
+                    break
+                try:
+                    with open(_caminho(self.dia, 'jsonl'), 'rb') as f:
+                        f.seek(posicao)
+                        atendimento = json.loads(f.readline())
+                except (OSError, ValueError):
+                    atendimento = None
+                if atendimento and atendimento.get('token') == token:
+                    return self._com_estado(atendimento)
+                # Arquivo trocado entre o stat e a leitura: refaz o índice
+                self.checkins['assinatura'] = _NUNCA
+            # Partição arquivada: varre o .gz do dia
+            marca = token.encode()
+            for linha in _linhas_gz(_caminho(self.dia, 'jsonl') + '.gz'):
+                if marca in linha:
+                    atendimento = json.loads(linha)
+                    if atendimento.get('token') == token:
+                        return self._com_estado(atendimento)
+            return None
+
+    def contar(self):
+        with self.lock:
+            self._atualizar_posicoes()
+            if self.posicoes:
+                return len(self.posicoes)
+        return sum(1 for _ in _linhas_gz(_caminho(self.dia, 'jsonl') + '.gz'))
+
+    # estado por token (chamar com self.lock)
+
+    def _ler_snapshot(self, st):
+        """Estados salvos e o offset de eventos que eles cobrem (vazio se o snapshot não for deste arquivo)."""
+        try:
+            with open(_caminho(self.dia, 'estados.json'), 'r', encoding='utf-8') as f:
+                snapshot = json.load(f)
+            # inode pode ser reaproveitado: confere também a primeira linha
+            if snapshot.get('inode') != st.st_ino or snapshot.get('inicio') != self._primeira_linha_eventos():
+                return {}, 0
+        except (OSError, ValueError):
+            return {}, 0
+        if snapshot.get('offset', 0) > st.st_size:
+            return {}, 0
+        return snapshot.get('estados', {}), snapshot.get('offset', 0)
+
+    def _primeira_linha_eventos(self):
+        with open(_caminho(self.dia, 'eventos.jsonl'), 'r', encoding='utf-8') as f:
+            return f.readline()
+
+    def _reiniciar_estados(self, st):
+        self.estados = {}
+        self.desde_snapshot = 0
+        # Eventos já arquivados valem antes dos que chegaram depois da rotação
+        for linha in _linhas_gz(_caminho(self.dia, 'eventos.jsonl') + '.gz'):
+            self._aplicar_evento(None, linha)
+        self.desde_snapshot = 0
+        if st is None:
+            return 0
+        estados, offset = self._ler_snapshot(st)
+        if offset:
+            self.estados = estados
+        return offset
+
+    def _aplicar_evento(self, posicao, linha):
+        evento = json.loads(linha)
+        self.estados[evento['token']] = {'status': evento.get('status'), 'etapa': evento.get('etapa'),
+                                         'status_em': evento.get('em')}
+        self.desde_snapshot += 1
+
+    def _atualizar_estados(self):
+        _acompanhar(_caminho(self.dia, 'eventos.jsonl'), self.eventos,
+                    self._reiniciar_estados, self._aplicar_evento)
+        if self.desde_snapshot >= EVENTOS_POR_SNAPSHOT and self.eventos['assinatura']:
+            _agendar_snapshot_estados(self)
+
+    def _com_estado(self, atendimento):
+        """Sobrepõe ao registro do check-in o status mais recente."""
+        self._atualizar_estados()
+        estado = self.estados.get(atendimento.get('token'))
+        if estado:
+            atendimento.update(estado)
+        return atendimento
+
+    def estado(self, token):
+        with self.lock:
+            self._atualizar_estados()
+            estado = self.estados.get(token)
+            return dict(estado) if estado else None
+
+    def gravar_snapshot(self):
+        """Grava o estado atual dos atendimentos do dia e até onde ele cobre os eventos."""
+        with self.lock:
+            self._atualizar_estados()
+            if self.eventos['assinatura'] in (None, _NUNCA):
+                return False
+            snapshot = {'inode': self.eventos['assinatura'][0], 'inicio': self._primeira_linha_eventos(),
+                        'offset': self.eventos['offset'], 'estados': dict(self.estados)}
+            self.desde_snapshot = 0
+        destino = _caminho(self.dia, 'estados.json')
+        with arquivos.trava(destino):
+            arquivos.escrever_atomico(destino, [json.dumps(snapshot)])
+        return True
+
+    def registros(self):
+        """Check-ins do dia (normal ou .gz) já com o status mais recente, em streaming."""
+        with self.lock:
+            self._atualizar_estados()
+            estados = dict(self.estados)
+        arquivo = _abrir(self.dia, 'jsonl')
+        if arquivo is None:
+            return
+        with arquivo:
+            try:
+                for linha in arquivo:
+                    if not linha.endswith(b'\n') or not linha.strip():
+                        continue
+                    atendimento = json.loads(linha)
+                    estado = estados.get(atendimento.get('token'))
+                    if estado:
+                        atendimento.update(estado)
+                    yield atendimento
+            except EOFError:
+                return
+
+_particoes_lock = threading.Lock()
+_particoes = OrderedDict()
+_snapshot_estados = {'thread': None}
+
+def _particao(dia):
+    """Partição do dia, mantendo em memória só as PARTICOES_EM_MEMORIA mais usadas."""
+    with _particoes_lock:
+        particao = _particoes.get(dia)
+        if particao is None:
+            particao = _particoes[dia] = _Particao(dia)
+            while len(_particoes) > PARTICOES_EM_MEMORIA:
+                _particoes.popitem(last=False)
+        else:
+            _particoes.move_to_end(dia)
+        return particao
+
+def _agendar_snapshot_estados(particao):
+    """Grava o snapshot numa thread separada, fora do caminho da requisição."""
+    thread = _snapshot_estados['thread']
+    if thread is not None and thread.is_alive(): return
+    thread = threading.Thread(target=particao.gravar_snapshot, daemon=True)
+    _snapshot_estados['thread'] = thread
+    thread.start()
+
+def gravar_snapshot_estados(dia=None):
+    return _particao(dia or _hoje()).gravar_snapshot()
+
+# --- ÍNDICE TOKEN -> DIA ---
+# Só é consultado para tokens que não estão na partição de hoje. tokens.idx
+# cresce com todos os atendimentos, então não fica inteiro em memória: a
+# rotação grava tokens.ord, com o mesmo conteúdo ordenado por token em
+# registros de largura fixa, e a consulta faz busca binária nele (seek).
+# Em memória fica só a cauda de tokens.idx anexada depois do tokens.ord.
+# O cabeçalho do tokens.ord diz de que tokens.idx (inode) ele é e até que
+# offset cobre; se o tokens.idx for outro, a cauda volta a ser o arquivo todo.
+
+_indice_lock = threading.RLock()
+_indice = {'assinatura': _NUNCA, 'offset': 0, 'dias': {}}
+# Cabeçalho do tokens.ord aberto (com o arquivo, que continua válido mesmo
+# se a rotação trocar o tokens.ord no meio da consulta)
+_ordenado = {'assinatura': _NUNCA, 'cabecalho': None, 'arquivo': None}
+_migracao = {'verificada': None}
+
+def _fechar_ordenado():
+    if _ordenado['arquivo'] is not None:
+        _ordenado['arquivo'].close()
+    _ordenado.update(assinatura=_NUNCA, cabecalho=None, arquivo=None)
+
+def limpar_cache_atendimentos():
+    with _particoes_lock:
+        _particoes.clear()
+    with _indice_lock:
+        _indice.update(assinatura=_NUNCA, offset=0, dias={})
+        _fechar_ordenado()
+    _migracao['verificada'] = None
+
+def _conferir_ordenado():
+    """Reabre o tokens.ord se a rotação gravou outro (chamar com _indice_lock)."""
+    caminho = _arquivo_tokens_ordenados()
+    try:
+        st = os.stat(caminho)
+        assinatura = (st.st_ino, st.st_size, st.st_mtime_ns)
+    except FileNotFoundError:
+        assinatura = None
+    if assinatura == _ordenado['assinatura']:
+        return
+    _fechar_ordenado()
+    _ordenado['assinatura'] = assinatura
+    # Tokens.ord novo cobre outro trecho do tokens.idx: a cauda é refeita
+    _indice['assinatura'] = _NUNCA
+    if assinatura is None:
+        return
+    try:
+        arquivo = open(caminho, 'rb')
+    except FileNotFoundError:
+        return
+    try:
+        cabecalho = json.loads(arquivo.readline())
+        cabecalho['inicio'] = arquivo.tell()
+    except ValueError:
+        arquivo.close()
+        return
+    _ordenado.update(cabecalho=cabecalho, arquivo=arquivo)
+
+def _reiniciar_indice(st):
+    _indice['dias'] = {}
+    cabecalho = _ordenado['cabecalho']
+    # O tokens.ord só vale para o mesmo tokens.idx, até onde ele cobre
+    if cabecalho and st is not None and st.st_ino == cabecalho['inode'] and st.st_size >= cabecalho['offset']:
+        return cabecalho['offset']
+    if cabecalho:
+        # tokens.ord de outro tokens.idx: fica de lado até a rotação gravar outro
+        assinatura = _ordenado['assinatura']
+        _fechar_ordenado()
+        _ordenado['assinatura'] = assinatura
+    return 0
+
+def _indexar_dia(posicao, linha):
+    token, _, dia = linha.decode('utf-8').strip().partition('|')
+    _indice['dias'][token] = dia
+
+def _buscar_ordenado(token):
+    """Busca binária do token no tokens.ord (chamar com _indice_lock)."""
+    cabecalho, arquivo = _ordenado['cabecalho'], _ordenado['arquivo']
+    if cabecalho is None:
+        return None
+    largura = cabecalho['largura']
+    alvo = token.encode('utf-8')
+    if len(alvo) > largura:
+        return None
+    alvo = alvo.ljust(largura)
+    tamanho = largura + 10  # token + '|' + AAAAMMDD + '\n'
+    baixo, alto = 0, cabecalho['quantidade']
+    while baixo < alto:
+        meio = (baixo + alto) // 2
+        arquivo.seek(cabecalho['inicio'] + meio * tamanho)
+        registro = arquivo.read(tamanho)
+        chave = registro[:largura]
+        if chave < alvo:
+            baixo = meio + 1
+        elif chave > alvo:
+            alto = meio
+        else:
+            return registro[largura + 1:largura + 9].decode('utf-8')
+    return None
+
+def _dia_indexado(token):
+    with _indice_lock:
+        _conferir_ordenado()
+        _acompanhar(_arquivo_indice_tokens(), _indice, _reiniciar_indice, _indexar_dia)
+        # A cauda é mais nova que o tokens.ord: vale primeiro
+        dia = _indice['dias'].get(token)
+        return dia if dia is not None else _buscar_ordenado(token)
+
+def ordenar_indice_tokens():
+    """Regrava tokens.ord a partir do tokens.idx atual. Retorna quantos tokens ele tem."""
+    caminho = _arquivo_indice_tokens()
+    try:
+        with open(caminho, 'rb') as f:
+            inode = os.fstat(f.fileno()).st_ino
+            dados = f.read()
+    except FileNotFoundError:
+        return 0
+    offset = dados.rfind(b'\n') + 1  # linha ainda sendo escrita fica para a cauda
+    dias = {}
+    for linha in dados[:offset].splitlines():
+        token, _, dia = linha.strip().partition(b'|')
+        if token and len(dia) == 8:
+            dias[token] = dia
+    largura = max(map(len, dias), default=0)
+    registros = sorted(token.ljust(largura) + b'|' + dia + b'\n' for token, dia in dias.items())
+    cabecalho = {'inode': inode, 'offset': offset, 'largura': largura, 'quantidade': len(registros)}
+    destino = _arquivo_tokens_ordenados()
+    with arquivos.trava(destino):
+        arquivos.escrever_atomico(destino, [json.dumps(cabecalho) + '\n'] +
+                                  [registro.decode('utf-8') for registro in registros])
+    return len(registros)
+
+def _dia_do_token(token):
+    """Dia da partição do token: hoje sem consultar o índice, senão pelo tokens.idx."""
+    hoje = _hoje()
+    if _particao(hoje).tem(token):
+        return hoje
+    return _dia_indexado(token)
+
+def _anexar(caminho, linhas):
+    os.makedirs(PASTA_ATENDIMENTOS, exist_ok=True)
+    with open(caminho, 'a', encoding='utf-8') as f:
+        f.write(''.join(linhas))
+
+def migrar_atendimentos_legados():
+    """Distribui atendimentos.txt e atendimentos_eventos.txt (formato antigo) pelas partições."""
+    os.makedirs(PASTA_ATENDIMENTOS, exist_ok=True)
+    with arquivos.trava(_arquivo_indice_tokens()):
+        dias = {}
+        if os.path.exists(ARQUIVO_ATENDIMENTOS):
+            por_dia = {}
+            with open(ARQUIVO_ATENDIMENTOS, 'r', encoding='utf-8') as f:
+                for linha in f:
+                    if not linha.strip():
+                        continue
+                    atendimento = json.loads(linha)
+                    dia = _dia_de(atendimento.get('data_checkin'))
+                    dias[atendimento.get('token')] = dia
+                    por_dia.setdefault(dia, []).append(json.dumps(atendimento) + '\n')
+            for dia, linhas in por_dia.items():
+                _anexar(_caminho(dia, 'jsonl'), linhas)
+            _anexar(_arquivo_indice_tokens(), [f"{token}|{dia}\n" for token, dia in dias.items()])
+            os.replace(ARQUIVO_ATENDIMENTOS, ARQUIVO_ATENDIMENTOS + '.migrado')
+        if os.path.exists(ARQUIVO_EVENTOS):
+            por_dia = {}
+            with open(ARQUIVO_EVENTOS, 'r', encoding='utf-8') as f:
+                for linha in f:
+                    if not linha.strip():
+                        continue
+                    token = json.loads(linha).get('token')
+                    dia = dias.get(token) or _dia_indexado(token) or _hoje()
+                    por_dia.setdefault(dia, []).append(linha if linha.endswith('\n') else linha + '\n')
+            for dia, linhas in por_dia.items():
+                _anexar(_caminho(dia, 'eventos.jsonl'), linhas)
+            os.replace(ARQUIVO_EVENTOS, ARQUIVO_EVENTOS + '.migrado')
+    limpar_cache_atendimentos()
+
+def _garantir_migracao():
+    chave = (ARQUIVO_ATENDIMENTOS, ARQUIVO_EVENTOS, PASTA_ATENDIMENTOS)
+    if _migracao['verificada'] == chave:
+        return
+    if os.path.exists(ARQUIVO_ATENDIMENTOS) or os.path.exists(ARQUIVO_EVENTOS):
+        migrar_atendimentos_legados()
+    _migracao['verificada'] = chave
+
+# --- ROTAÇÃO ---
+
+def _arquivar(caminho):
+    """Comprime `caminho` em `caminho`.gz (anexando a um .gz existente) e remove o original."""
+    with arquivos.trava(caminho):
+        if not os.path.exists(caminho):
+            return False
+        destino = caminho + '.gz'
+        temporario = destino + '.tmp'
+        if os.path.exists(destino):
+            shutil.copyfile(destino, temporario)
+        # Um .gz pode ter vários membros: o novo conteúdo vira mais um
+        with open(caminho, 'rb') as origem, gzip.open(temporario, 'ab') as saida:
+            shutil.copyfileobj(origem, saida)
+        os.replace(temporario, destino)
+        os.remove(caminho)
+    return True
+
+def rotacionar_atendimentos(dias=None):
+    """Arquiva em .gz as partições com mais de `dias` dias. Retorna os dias arquivados."""
+    _garantir_migracao()
+    dias = max(1, DIAS_SEM_COMPACTAR if dias is None else dias)
+    limite = (datetime.now() - timedelta(days=dias)).strftime('%Y%m%d')
+    arquivados = []
+    for dia in _dias_existentes():
+        if dia >= limite:
+            continue
+        arquivou = _arquivar(_caminho(dia, 'jsonl'))
+        arquivou = _arquivar(_caminho(dia, 'eventos.jsonl')) or arquivou
+        if os.path.exists(_caminho(dia, 'estados.json')):
+            os.remove(_caminho(dia, 'estados.json'))
+        if arquivou:
+            arquivados.append(dia)
+    ordenar_indice_tokens()
+    return arquivados
+
+class _RepositorioAtendimentosTexto(repositorio.RepositorioAtendimentos):
+    """Partições diárias em PASTA_ATENDIMENTOS (ver acima), somente append."""
+
+    def carregar(self):
+        return list(self.iterar())
+
+    def iterar(self):
+        _garantir_migracao()
+        for dia in _dias_existentes():
+            yield from _particao(dia).registros()
+
+    def inserir(self, dados):
+        _garantir_migracao()
+        dia = _dia_de(dados.get('data_checkin'))
+        _anexar(_caminho(dia, 'jsonl'), [json.dumps(dados) + '\n'])
+        _anexar(_arquivo_indice_tokens(), [f"{dados['token']}|{dia}\n"])
+
+    def atualizar_status(self, token, status, etapa, momento):
+        _garantir_migracao()
+        evento = {'token': token, 'status': status, 'etapa': etapa, 'em': momento}
+        caminho = _caminho(_dia_do_token(token) or _hoje(), 'eventos.jsonl')
+        # Trava só contra a rotação, que move este arquivo para o .gz
+        os.makedirs(PASTA_ATENDIMENTOS, exist_ok=True)
+        with arquivos.trava(caminho):
+            _anexar(caminho, [json.dumps(evento) + '\n'])
+
+    def estado(self, token):
+        _garantir_migracao()
+        dia = _dia_do_token(token)
+        estado = _particao(dia).estado(token) if dia else None
+        if estado:
+            return estado
+        # Sem eventos ainda: status do próprio check-in
+        return super().estado(token)
+
+    def proxima_senha(self, dia):
+        # Contador do dia em arquivo próprio, incrementado sob trava exclusiva:
+        # dois totens (workers) nunca recebem a mesma senha.
+        with arquivos.trava(ARQUIVO_SENHAS):
+            if os.path.exists(ARQUIVO_SENHAS):
+                with open(ARQUIVO_SENHAS, 'r', encoding='utf-8') as f:
+                    dia_salvo, _, ultima = f.read().strip().partition('|')
+                ultima = int(ultima) if dia_salvo == dia and ultima.isdigit() else 0
+            else:
+                # Primeiro uso: continua a contagem dos atendimentos do dia
+                _garantir_migracao()
+                ultima = _particao(_dia_de(dia)).contar()
+            arquivos.escrever_atomico(ARQUIVO_SENHAS, [f"{dia}|{ultima + 1}\n"])
+        return ultima + 1
+
+    def obter(self, token):
+        _garantir_migracao()
+        hoje = _hoje()
+        atendimento = _particao(hoje).obter(token)
+        if atendimento is not None:
+            return atendimento
+        dia = _dia_indexado(token)
+        if dia is None or dia == hoje:
+            return None
+        return _particao(dia).obter(token)
+
+_REPOSITORIO_TEXTO = _RepositorioAtendimentosTexto()
+_REPOSITORIO_SQLITE = repositorio.RepositorioAtendimentosSQLite()
+
+def _repositorio_atendimentos():
+    """Backend escolhido em utils.repositorio.BACKEND (texto ou sqlite)."""
+    if repositorio.usando_sqlite(): return _REPOSITORIO_SQLITE
+    return _REPOSITORIO_TEXTO
+
+def _carregar_atendimentos():
+    try:
+        return _repositorio_atendimentos().carregar()
     except:
         return []
 
 def _salvar_atendimento(dados):
-    with open(ARQUIVO_ATENDIMENTOS, 'a', encoding='utf-8') as f:
-        f.write(json.dumps(dados) + '\n')
+    _repositorio_atendimentos().inserir(dados)
 
 def criar_atendimento(cpf, nome_paciente, medico_id, especialidade):
-    atendimentos = _carregar_atendimentos()
-    hoje = datetime.now().strftime('%Y%m%d')
+    agora = datetime.now()
+    hoje = agora.strftime('%Y%m%d')
     
-    # Gera senha sequencial diária
-    sequencia = len([a for a in atendimentos if a.get('data_checkin', '').startswith(datetime.now().strftime('%d/%m/%Y'))]) + 1
+    # Gera senha sequencial diária (contador persistente, sem ler o histórico)
+    sequencia = _repositorio_atendimentos().proxima_senha(agora.strftime('%d/%m/%Y'))
     senha = f"{hoje[-4:]}-{sequencia:03d}"
     
     token = str(uuid4())
@@ -35,7 +628,7 @@ def criar_atendimento(cpf, nome_paciente, medico_id, especialidade):
         'nome_paciente': nome_paciente,
         'medico_id': medico_id,
         'especialidade': especialidade,
-        'data_checkin': datetime.now().strftime('%d/%m/%Y %H:%M'),
+        'data_checkin': agora.strftime('%d/%m/%Y %H:%M'),
         'status': 'em_andamento',
         'posicao_fila': sequencia # Simplificação
     }
@@ -44,17 +637,35 @@ def criar_atendimento(cpf, nome_paciente, medico_id, especialidade):
     return novo
 
 def obter_atendimento(token):
-    atendimentos = _carregar_atendimentos()
-    for a in atendimentos:
-        if a['token'] == token:
-            return a
-    return None
+    try:
+        return _repositorio_atendimentos().obter(token)
+    except:
+        return None
 
 def atualizar_status_atendimento(token, status, etapa):
-    # Em um sistema real com BD SQL seria update. 
-    # Com TXT append-only, não vamos reescrever tudo para simplificar o exemplo.
-    pass
+    # TXT: evento anexado (sem reescrever nada); SQLite: update da linha
+    try:
+        momento = datetime.now().strftime('%d/%m/%Y %H:%M:%S')
+        _repositorio_atendimentos().atualizar_status(token, status, etapa, momento)
+    except Exception as e:
+        print(f"Erro ao atualizar status do atendimento: {e}")
+
+def obter_status_atendimento(token):
+    """Status/etapa mais recentes do atendimento (O(1) no backend texto)."""
+    try:
+        return _repositorio_atendimentos().estado(token)
+    except:
+        return None
+
+def iterar_atendimentos():
+    """Percorre todos os atendimentos, inclusive os arquivados, sem montar a lista inteira."""
+    return _repositorio_atendimentos().iterar()
 
 def calcular_tempo_estimado(posicao):
     # Lógica fictícia: 15 min por pessoa na frente
-    return f"{posicao * 15} minutos"
\ No newline at end of file
+    return f"{posicao * 15} minutos"
+
+if __name__ == '__main__':
+    # python -m web.atendimentos  (agendar no cron, ex.: uma vez por dia)
+    arquivados = rotacionar_atendimentos()
+    print(f"Partições arquivadas: {', '.join(arquivados) or 'nenhuma'}")
@@ -61,13 +61,8 @@ def obter_medico(medico_id):
     Returns:
         Dicionário com dados do médico ou None
     """
-    medicos = arquivos.carregar_dados(MEDICOS_FILE)
-    
-    for medico in medicos:
-        if medico.get('id') == medico_id:
-            return medico
-    
-    return None
+    # Leitura mapeada: só o registro encontrado é decodificado
+    return arquivos.abrir_mapeado(MEDICOS_FILE).buscar('id', medico_id)
 
 
 def cadastrar_medico(nome, especialidade, crm, disponivel=True):
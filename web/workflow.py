@@ -4,12 +4,18 @@ Módulo de gerenciamento de workflow de atendimentos
 
 import sys
 import os
+import hashlib
+import json
+import threading
+import time
+from collections import deque
 from uuid import uuid4
 
 # Adiciona o diretório pai ao path
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 import tarefas
+from web import atendimentos
 
 
 def criar_workflow_automatico(atendimento_token, nome_paciente, medico_id, medico_nome):
@@ -18,8 +24,6 @@ def criar_workflow_automatico(atendimento_token, nome_paciente, medico_id, medic
     ALTERAÇÃO: Cria apenas a tarefa de Recepção como PENDENTE.
     O médico só será acionado após a validação da recepção.
     """
-    todas_tarefas = tarefas._carregar_tarefas()
-    
     # 1. Tarefa de Recepção (Check-in Pendente)
     tarefa_recepcao = {
         "id": str(uuid4()),
@@ -34,83 +38,196 @@ def criar_workflow_automatico(atendimento_token, nome_paciente, medico_id, medic
         "atendimento_token": atendimento_token
     }
     
-    todas_tarefas.append(tarefa_recepcao)
-    tarefas._salvar_tarefas(todas_tarefas)
+    with tarefas.transacao_tarefas():
+        todas_tarefas = tarefas._carregar_tarefas()
+        todas_tarefas.append(tarefa_recepcao)
+        tarefas._salvar_tarefas(todas_tarefas)
+
 
+# --- UNIDADE DE TRABALHO ---
 
-def adicionar_tarefa_medico(atendimento_token, nome_paciente, especialidade, responsavel_id=None):
+class TransicaoWorkflow:
     """
-    Adiciona tarefa do médico ao workflow.
-    Aceita um responsavel_id específico agora.
+    Agrupa as mudanças de um passo do workflow (concluir a tarefa atual,
+    criar a próxima e atualizar o status do atendimento) sobre uma única
+    leitura das tarefas e grava tudo de uma vez em confirmar().
+
+    Usada com `with`, segura a trava exclusiva das tarefas da leitura até
+    a gravação, para que outro worker não sobrescreva a transição.
     """
-    todas_tarefas = tarefas._carregar_tarefas()
-    
-    nova_tarefa = {
+
+    def __init__(self):
+        self._tarefas = None
+        self._trava = None
+        self.status_atendimentos = []
+
+    def __enter__(self):
+        self._trava = tarefas.transacao_tarefas()
+        self._trava.__enter__()
+        self._tarefas = None  # relê já com a trava
+        return self
+
+    def __exit__(self, *excecao):
+        trava, self._trava = self._trava, None
+        return trava.__exit__(*excecao)
+
+    @property
+    def tarefas(self):
+        if self._tarefas is None:
+            self._tarefas = tarefas._carregar_tarefas()
+        return self._tarefas
+
+    def concluir(self, id_tarefa, concluida_por=None):
+        """Marca a tarefa como concluída. Retorna a tarefa ou None se não existir."""
+        tarefa = tarefas._buscar_tarefa_por_id(id_tarefa, self.tarefas)
+        if not tarefa:
+            return None
+        tarefa['status'] = tarefas.STATUS_CONCLUIDA
+        tarefa['data_conclusao'] = tarefas._data_atual()
+        if concluida_por:
+            tarefa['concluida_por'] = concluida_por
+        return tarefa
+
+    def adicionar(self, nova_tarefa):
+        self.tarefas.append(nova_tarefa)
+
+    def atualizar_atendimento(self, atendimento_token, status, etapa):
+        # Tarefa manual não tem atendimento (token None): nada a atualizar
+        if not atendimento_token:
+            return
+        self.status_atendimentos.append((atendimento_token, status, etapa))
+
+    def confirmar(self):
+        """Grava as tarefas (uma escrita) e os status de atendimento pendentes."""
+        if not tarefas._salvar_tarefas(self.tarefas):
+            return False
+        for atendimento_token, status, etapa in self.status_atendimentos:
+            atendimentos.atualizar_status_atendimento(atendimento_token, status, etapa)
+        self.status_atendimentos = []
+        return True
+
+
+def _nova_tarefa(atendimento_token, titulo, descricao, setor, responsavel="sistema"):
+    return {
         "id": str(uuid4()),
-        "titulo": f"Consulta - {nome_paciente}",
-        "descricao": f"Consulta médica em {especialidade}",
-        "responsavel": responsavel_id if responsavel_id else "sistema", # Usa o médico específico se houver
-        "setor": "médico",
+        "titulo": titulo,
+        "descricao": descricao,
+        "responsavel": responsavel,
+        "setor": setor,
         "prazo": tarefas._data_atual(),
         "status": tarefas.STATUS_PENDENTE,
         "data_criacao": tarefas._data_atual(),
         "data_conclusao": None,
         "atendimento_token": atendimento_token
     }
-    
-    todas_tarefas.append(nova_tarefa)
-    tarefas._salvar_tarefas(todas_tarefas)
 
 
-def adicionar_tarefa_farmacia(atendimento_token, nome_paciente):
+def _registrar(nova_tarefa, transacao):
+    """Adiciona à transação, se houver; senão grava na hora (comportamento antigo)."""
+    if transacao is not None:
+        transacao.adicionar(nova_tarefa)
+        return
+    with tarefas.transacao_tarefas():
+        todas_tarefas = tarefas._carregar_tarefas()
+        todas_tarefas.append(nova_tarefa)
+        tarefas._salvar_tarefas(todas_tarefas)
+
+
+def adicionar_tarefa_medico(atendimento_token, nome_paciente, especialidade, responsavel_id=None, transacao=None):
+    """
+    Adiciona tarefa do médico ao workflow.
+    Aceita um responsavel_id específico agora.
+    """
+    nova_tarefa = _nova_tarefa(
+        atendimento_token,
+        f"Consulta - {nome_paciente}",
+        f"Consulta médica em {especialidade}",
+        "médico",
+        responsavel_id if responsavel_id else "sistema"  # Usa o médico específico se houver
+    )
+    _registrar(nova_tarefa, transacao)
+
+
+def adicionar_tarefa_farmacia(atendimento_token, nome_paciente, transacao=None):
     """Adiciona tarefa da farmácia ao workflow."""
-    todas_tarefas = tarefas._carregar_tarefas()
-    
-    nova_tarefa = {
-        "id": str(uuid4()),
-        "titulo": f"Farmácia - {nome_paciente}",
-        "descricao": f"Separação e dispensação de medicamentos para {nome_paciente}",
-        "responsavel": "sistema",
-        "setor": "farmácia",
-        "prazo": tarefas._data_atual(),
-        "status": tarefas.STATUS_PENDENTE,
-        "data_criacao": tarefas._data_atual(),
-        "data_conclusao": None,
-        "atendimento_token": atendimento_token
-    }
-    
-    todas_tarefas.append(nova_tarefa)
-    tarefas._salvar_tarefas(todas_tarefas)
+    nova_tarefa = _nova_tarefa(
+        atendimento_token,
+        f"Farmácia - {nome_paciente}",
+        f"Separação e dispensação de medicamentos para {nome_paciente}",
+        "farmácia"
+    )
+    _registrar(nova_tarefa, transacao)
 
 
-def adicionar_tarefa_enfermagem(atendimento_token, nome_paciente):
+def adicionar_tarefa_enfermagem(atendimento_token, nome_paciente, transacao=None):
     """Adiciona tarefa da enfermagem ao workflow."""
-    todas_tarefas = tarefas._carregar_tarefas()
-    
-    nova_tarefa = {
-        "id": str(uuid4()),
-        "titulo": f"Enfermagem - {nome_paciente}",
-        "descricao": f"Administração de medicamentos e cuidados finais para {nome_paciente}",
-        "responsavel": "sistema",
-        "setor": "enfermagem",
-        "prazo": tarefas._data_atual(),
-        "status": tarefas.STATUS_PENDENTE,
-        "data_criacao": tarefas._data_atual(),
-        "data_conclusao": None,
-        "atendimento_token": atendimento_token
-    }
-    
-    todas_tarefas.append(nova_tarefa)
-    tarefas._salvar_tarefas(todas_tarefas)
+    nova_tarefa = _nova_tarefa(
+        atendimento_token,
+        f"Enfermagem - {nome_paciente}",
+        f"Administração de medicamentos e cuidados finais para {nome_paciente}",
+        "enfermagem"
+    )
+    _registrar(nova_tarefa, transacao)
+
+
+def avancar_workflow(id_tarefa, acao, concluida_por=None):
+    """
+    Executa uma ação do dashboard numa única transação: conclui a tarefa,
+    cria a tarefa do próximo setor e atualiza o status do atendimento.
+    Retorna a tarefa concluída, ou None se ela não existir ou se a gravação
+    falhar (nesse caso nada foi gravado).
+    """
+    with TransicaoWorkflow() as transacao:
+        tarefa_atual = transacao.concluir(id_tarefa, concluida_por)
+        if not tarefa_atual:
+            return None
+
+        atendimento_token = tarefa_atual.get('atendimento_token')
+        
+        # Extrai nome do paciente do título (formato "Titulo - Nome")
+        titulo = tarefa_atual.get('titulo') or ''
+        nome_paciente = titulo.split(' - ')[-1] if ' - ' in titulo else "Paciente"
+        
+        if acao == 'encaminhar_medico':
+            # Busca o médico que foi escolhido no Atendimento original
+            atendimento = atendimentos.obter_atendimento(atendimento_token)
+            medico_id = atendimento.get('medico_id') if atendimento else None
+        
+            # Tenta extrair especialidade
+            desc = tarefa_atual.get('descricao') or ''
+            especialidade = "Clínico Geral"
+            if "Especialidade desejada: " in desc:
+                try:
+                    especialidade = desc.split("Especialidade desejada: ")[1].split(".")[0]
+                except:
+                    pass
+        
+            # Cria tarefa já atribuída ao médico certo
+            adicionar_tarefa_medico(atendimento_token, nome_paciente, especialidade,
+                                    responsavel_id=medico_id, transacao=transacao)
+            transacao.atualizar_atendimento(atendimento_token, 'em_atendimento', 'medico')
+        
+        elif acao in ('alta', 'finalizar_atendimento'):
+            # Médico -> Alta / Enfermagem -> Alta
+            transacao.atualizar_atendimento(atendimento_token, 'concluido', 'concluido')
+        
+        elif acao == 'solicitar_medicamento':
+            # Médico -> Farmácia
+            adicionar_tarefa_farmacia(atendimento_token, nome_paciente, transacao=transacao)
+            transacao.atualizar_atendimento(atendimento_token, 'em_atendimento', 'farmacia')
+        
+        elif acao == 'dispensar_medicamento':
+            # Farmácia -> Enfermagem
+            adicionar_tarefa_enfermagem(atendimento_token, nome_paciente, transacao=transacao)
+            transacao.atualizar_atendimento(atendimento_token, 'em_atendimento', 'enfermagem')
+        
+        if not transacao.confirmar():
+            return None
+        return tarefa_atual
 
 
 def obter_tarefas_atendimento(atendimento_token):
-    todas_tarefas = tarefas._carregar_tarefas()
-    
-    tarefas_atendimento = [
-        t for t in todas_tarefas 
-        if t.get('atendimento_token') == atendimento_token
-    ]
+    tarefas_atendimento = tarefas.buscar_tarefas_por_atendimento(atendimento_token)
     
     ordem_setores = {'recepção': 1, 'recepcao': 1, 'médico': 2, 'medico': 2, 'farmácia': 3, 'farmacia': 3, 'enfermagem': 4}
     tarefas_atendimento.sort(key=lambda x: ordem_setores.get(x.get('setor', '').lower(), 99))
@@ -118,8 +235,9 @@ def obter_tarefas_atendimento(atendimento_token):
     return tarefas_atendimento
 
 
-def calcular_progresso(atendimento_token):
-    tarefas_atendimento = obter_tarefas_atendimento(atendimento_token)
+def calcular_progresso(atendimento_token, tarefas_atendimento=None):
+    if tarefas_atendimento is None:
+        tarefas_atendimento = obter_tarefas_atendimento(atendimento_token)
     if not tarefas_atendimento: return 0
     
     # Se só tem recepção pendente, progresso é baixo
@@ -136,4 +254,281 @@ def obter_etapa_atual(atendimento_token):
     for tarefa in tarefas_atendimento:
         if tarefa.get('status') == tarefas.STATUS_PENDENTE:
             return tarefa.get('setor', '').lower()
-    return 'concluido'
\ No newline at end of file
+    return 'concluido'
+
+
+def calcular_etapa_index(tarefas_atendimento):
+    """Posição da primeira tarefa não concluída; len+1 se todas concluídas; -1 sem tarefas."""
+    for i, tarefa in enumerate(tarefas_atendimento):
+        if tarefa.get('status') != tarefas.STATUS_CONCLUIDA:
+            return i
+    return len(tarefas_atendimento) + 1 if tarefas_atendimento else -1
+
+
+def estado_atendimento(atendimento_token, atendimento=None):
+    """O que o app do paciente mostra e muda com o workflow: progresso, etapa, ETA e a linha do tempo."""
+    tarefas_atendimento = obter_tarefas_atendimento(atendimento_token)
+    if atendimento is None:
+        atendimento = atendimentos.obter_atendimento(atendimento_token) or {}
+    etapa_index = calcular_etapa_index(tarefas_atendimento)
+    etapa = 'concluido'
+    if 0 <= etapa_index < len(tarefas_atendimento):
+        etapa = (tarefas_atendimento[etapa_index].get('setor') or '').lower()
+    return {
+        'progresso': calcular_progresso(atendimento_token, tarefas_atendimento),
+        'etapa': etapa,
+        'etapa_index': etapa_index,
+        'tempo_estimado': atendimentos.calcular_tempo_estimado(int(atendimento.get('posicao_fila') or 1)),
+        'tarefas': [{'setor': t.get('setor'), 'descricao': t.get('descricao'), 'status': t.get('status')}
+                    for t in tarefas_atendimento],
+    }
+
+
+# --- ACOMPANHAMENTO EM TEMPO REAL ---
+# Cada atendimento tem uma versão em memória, incrementada quando o cache de
+# tarefas avisa (tarefas.observar_mudancas) que as tarefas dele mudaram.
+# Quem acompanha um atendimento (SSE do app do paciente) dorme numa
+# Condition e só recalcula o estado quando a versão dele muda. Gravações de
+# outros workers chegam pela vigia: uma thread por processo que chama
+# tarefas.verificar_mudancas_tarefas() (um stat) a cada INTERVALO_VIGIA s.
+
+INTERVALO_VIGIA = float(os.environ.get('TASKFLOW_VIGIA_INTERVALO', '1'))
+
+_mudancas = threading.Condition()
+_versoes = {}          # atendimento_token -> versão
+_versao_geral = [0]    # mudança sem atendimento conhecido (SQLite): vale para todos
+_vigia = {'thread': None}
+# ETag do estado por atendimento: token -> (versão em que foi calculada, etag)
+_etags = {}
+MAXIMO_ETAGS = 10000
+
+
+def _ao_mudar_tarefas(tokens):
+    with _mudancas:
+        if tokens is None:
+            _versao_geral[0] += 1
+        else:
+            for token in tokens:
+                _versoes[token] = _versoes.get(token, 0) + 1
+        _mudancas.notify_all()
+
+
+tarefas.observar_mudancas(_ao_mudar_tarefas)
+
+
+def versao_atendimento(atendimento_token):
+    """Muda sempre que as tarefas do atendimento mudam (neste ou em outro worker já percebido pela vigia)."""
+    with _mudancas:
+        return (_versao_geral[0], _versoes.get(atendimento_token, 0))
+
+
+def etag_estado(estado):
+    """ETag forte: hash do JSON compacto do estado, a mesma em qualquer worker para os mesmos dados."""
+    corpo = json.dumps(estado, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha1(corpo.encode('utf-8')).hexdigest()[:20]
+
+
+def estado_e_etag(atendimento_token, atendimento=None):
+    """
+    (estado, etag) do atendimento. Antes o cache de tarefas confere o
+    disco (um stat), então gravações de outros workers já contam, sem
+    esperar a vigia. Enquanto a versão do atendimento não muda, a ETag
+    calculada da última vez é reaproveitada e o estado volta None (não foi
+    recalculado); quem precisa do corpo calcula o estado e tira dele a ETag.
+    """
+    tarefas.verificar_mudancas_tarefas()
+    versao = versao_atendimento(atendimento_token)
+    with _mudancas:
+        guardada = _etags.get(atendimento_token)
+    if guardada is not None and guardada[0] == versao:
+        return None, guardada[1]
+    estado = estado_atendimento(atendimento_token, atendimento)
+    etag = etag_estado(estado)
+    with _mudancas:
+        if len(_etags) >= MAXIMO_ETAGS:
+            _etags.pop(next(iter(_etags)))
+        _etags[atendimento_token] = (versao, etag)
+    return estado, etag
+
+
+def etag_atendimento(atendimento_token, atendimento=None):
+    """ETag do estado_atendimento atual (ver estado_e_etag)."""
+    return estado_e_etag(atendimento_token, atendimento)[1]
+
+
+def _vigiar():
+    while True:
+        time.sleep(INTERVALO_VIGIA)
+        try:
+            tarefas.verificar_mudancas_tarefas()
+        except Exception as e:
+            print(f"Erro ao verificar mudanças nas tarefas: {e}")
+
+
+def iniciar_vigia():
+    """Sobe a thread da vigia, uma vez por processo."""
+    with _mudancas:
+        thread = _vigia['thread']
+        if thread is not None and thread.is_alive(): return
+        thread = threading.Thread(target=_vigiar, daemon=True)
+        _vigia['thread'] = thread
+        thread.start()
+
+
+def acompanhar_atendimento(atendimento_token, espera=15.0, duracao=None):
+    """
+    Gera as mudanças do estado_atendimento: o estado inteiro primeiro, depois
+    só as chaves que mudaram. Gera None quando passa `espera` segundos sem
+    mudança (para o SSE mandar um keep-alive) e termina depois de `duracao`
+    segundos, se informada.
+    """
+    iniciar_vigia()
+    fim = time.monotonic() + duracao if duracao is not None else None
+    enviado, versao = {}, None
+    def _versao():
+        return (_versao_geral[0], _versoes.get(atendimento_token, 0))
+    while fim is None or time.monotonic() < fim:
+        limite = espera if fim is None else max(0, min(espera, fim - time.monotonic()))
+        with _mudancas:
+            # Mudança em outro atendimento acorda a Condition mas não este gerador
+            _mudancas.wait_for(lambda: _versao() != versao, limite)
+            atual = _versao()
+        if atual == versao:
+            yield None
+            continue
+        versao = atual
+        estado = estado_atendimento(atendimento_token)
+        mudou = {chave: valor for chave, valor in estado.items() if enviado.get(chave) != valor}
+        enviado = estado
+        if mudou:
+            yield mudou
+
+
+
+# --- FILAS DOS SETORES EM TEMPO REAL ---
+# Os painéis dos setores (dashboards) recebem as tarefas criadas, concluídas
+# e alteradas por um log de eventos em memória, alimentado pelos avisos de
+# linhas do cache de tarefas (tarefas.observar_linhas): vale tanto para
+# avancar_workflow/realizar_acao_tarefa neste worker quanto para o que a
+# vigia traz dos outros. Cada evento tem um número de sequência; quem
+# reconecta informa o último que recebeu e só recebe o que perdeu. Evento
+# (seq, None, None) = não dá para saber o que mudou: recarregar o painel.
+
+TAMANHO_LOG_FILAS = int(os.environ.get('TASKFLOW_FILAS_EVENTOS', '1000'))
+# Lote maior que isso (ex.: primeira leitura do arquivo) vira um "recarregar"
+LOTE_MAXIMO_FILAS = 200
+
+_eventos_filas = deque(maxlen=TAMANHO_LOG_FILAS)  # (seq, antiga, nova)
+_seq_filas = [0]
+# O log é de cada processo: a marca leva o id dele, e a marca de um worker
+# nunca é aceita por outro (quem muda de worker recebe o painel inteiro)
+_ID_LOG_FILAS = uuid4().hex[:8]
+
+
+def _publicar_na_fila(antiga, nova):
+    _seq_filas[0] += 1
+    _eventos_filas.append((_seq_filas[0], antiga, nova))
+
+
+def _ao_mudar_linhas(pares):
+    with _mudancas:
+        if pares is None or len(pares) > LOTE_MAXIMO_FILAS:
+            _publicar_na_fila(None, None)
+        else:
+            for antiga, nova in pares:
+                _publicar_na_fila(antiga, nova)
+        _mudancas.notify_all()
+
+
+tarefas.observar_linhas(_ao_mudar_linhas)
+
+
+def marca_fila(seq):
+    """Identifica uma posição do log de eventos (id do SSE)."""
+    return f"{_ID_LOG_FILAS}-{seq}"
+
+
+def _seq_da_marca(marca):
+    """Sequência da marca se ela é deste processo; None caso contrário."""
+    processo, _, seq = (marca or '').partition('-')
+    if processo != _ID_LOG_FILAS or not seq.isdigit():
+        return None
+    return int(seq)
+
+
+def foto_painel(carregar):
+    """(marca, carregar()) tirados juntos: nenhum evento entra entre os dois."""
+    with tarefas.leitura_estavel():
+        with _mudancas:
+            seq = _seq_filas[0]
+        return marca_fila(seq), carregar()
+
+
+def tipo_evento_fila(antiga, nova):
+    """'criada', 'concluida', 'atualizada' ou 'removida', do ponto de vista de um painel."""
+    if nova is None:
+        return 'removida'
+    if antiga is None:
+        return 'criada'
+    if nova.get('status') == tarefas.STATUS_CONCLUIDA and antiga.get('status') != tarefas.STATUS_CONCLUIDA:
+        return 'concluida'
+    return 'atualizada'
+
+
+def _evento_fila(marca, antiga, nova):
+    def _concluida(t):
+        return t is not None and t.get('status') == tarefas.STATUS_CONCLUIDA
+    return {'marca': marca, 'tipo': tipo_evento_fila(antiga, nova), 'antiga': antiga, 'nova': nova,
+            'total': (nova is not None) - (antiga is not None),
+            'concluidas': _concluida(nova) - _concluida(antiga)}
+
+
+def acompanhar_fila(filtro, carregar, desde=None, espera=15.0, duracao=None):
+    """
+    Gera os eventos do painel descrito por filtro(tarefa) -> bool, como
+    dicts com 'marca' (id do evento) e 'tipo':
+      - 'estado': 'painel' traz carregar() inteiro. É o primeiro evento
+        quando `desde` (marca do último evento recebido) não é deste
+        processo ou já saiu do log, e se repete quando não dá para saber o
+        que mudou;
+      - 'criada', 'concluida', 'atualizada', 'removida': 'antiga' e 'nova'
+        como o painel as vê (None fora do filtro) e 'total'/'concluidas',
+        quanto os contadores do painel mudam.
+    Gera None a cada `espera` segundos sem eventos (keep-alive) e termina
+    depois de `duracao` segundos, se informada.
+    """
+    iniciar_vigia()
+    fim = time.monotonic() + duracao if duracao is not None else None
+    seq = _seq_da_marca(desde)
+    with _mudancas:
+        primeiro = _eventos_filas[0][0] if _eventos_filas else _seq_filas[0] + 1
+        if seq is not None and not primeiro - 1 <= seq <= _seq_filas[0]:
+            seq = None
+    novos = []
+    while fim is None or time.monotonic() < fim:
+        if seq is None:
+            marca, painel = foto_painel(carregar)
+            seq = _seq_da_marca(marca)
+            yield {'marca': marca, 'tipo': 'estado', 'painel': painel}
+            continue
+        if not novos:
+            limite = espera if fim is None else max(0, min(espera, fim - time.monotonic()))
+            with _mudancas:
+                _mudancas.wait_for(lambda: _seq_filas[0] != seq, limite)
+                primeiro = _eventos_filas[0][0] if _eventos_filas else _seq_filas[0] + 1
+                if seq < primeiro - 1:
+                    seq = None  # ficou para trás mais do que o log guarda
+                    continue
+                novos = [e for e in _eventos_filas if e[0] > seq]
+            if not novos:
+                yield None
+                continue
+        seq_evento, antiga, nova = novos.pop(0)
+        seq = seq_evento
+        if antiga is None and nova is None:
+            seq, novos = None, []
+            continue
+        antiga = antiga if antiga is not None and filtro(antiga) else None
+        nova = nova if nova is not None and filtro(nova) else None
+        if antiga is not None or nova is not None:
+            yield _evento_fila(marca_fila(seq), antiga, nova)